@@ -1,14 +1,50 @@
-from flask import Flask, render_template, jsonify, request
-from src.helper import download_hugging_face_embeddings
-from langchain_pinecone import PineconeVectorStore
-from langchain.chains import RetrievalQA
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context, g
+from src.helper import download_hugging_face_embeddings, build_prompt
 from langchain_core.prompts import PromptTemplate
 from langchain_community.llms import CTransformers
 from dotenv import load_dotenv
 import os
+import json
+import threading
+import time
+import hmac
 import logging
 from src.prompt import *
-from logger import logging
+from src.streaming import stream_answer, format_sse
+from src.generation import generate
+from src.generation_control import GenerationController
+from src.metrics import REGISTRY, CONTENT_TYPE, REQUESTS, REQUEST_SECONDS, PROMPT_BUILD_SECONDS
+from src.semantic_cache import SemanticCache
+from src.vector_store import load_vector_store
+from src.inference_scheduler import InferenceScheduler, ModelWorker, QueueFullError
+from src.batching import RetrievalBatcher
+from src.lexical_index import BM25Index, META_FILE as LEXICAL_META_FILE
+from src.context_packer import ContextPacker
+from src.reranker import CrossEncoderReranker
+from src.batch_qa import BatchAnswerer, parse_question
+from src.prefix_cache import PrefixCachingLLM
+from src.continuous_batching import ContinuousBatchingLLM
+from src.speculative import DraftModel
+from src.startup import StartupOrchestrator
+from cloud_storage.model_cache import ModelCache
+from medicalbot.entity.model_registry import ModelRegistry
+from medicalbot.constants import (SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_SIZE,
+                                  SEMANTIC_CACHE_TTL_SECONDS, SEMANTIC_CACHE_PERSIST_PATH,
+                                  SEMANTIC_CACHE_SAVE_INTERVAL_SECONDS,
+                                  VECTOR_STORE_BACKEND, VECTOR_STORE_INDEX_NAME, VECTOR_STORE_LOCAL_DIR,
+                                  VECTOR_STORE_LOCAL_INDEX_TYPE, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_QUERY_ENTRIES,
+                                  APP_HOST, APP_PORT, SERVING_MODE, SERVING_THREADS, LLM_WORKERS, LLM_QUEUE_SIZE,
+                                  LLM_REQUEST_TIMEOUT_SECONDS, LLM_THREADS_PER_WORKER, LLM_PROMPT_BATCH_SIZE,
+                                  LLM_BACKEND, LLM_MODEL_PATH, LLM_CONTEXT_LENGTH, LLM_PREFIX_CACHE_STATES,
+                                  LLM_PREFIX_CACHE_MAX_MB, LLM_PREFIX_CACHE_CHUNK_HITS, LLM_BATCH_SEQUENCES, LLM_DRAFT_MODEL_PATH, LLM_DRAFT_TOKENS,
+                                  LLM_MAX_NEW_TOKENS, LLM_MIN_NEW_TOKENS, LLM_STOP_SEQUENCES, LLM_REPETITION_REPEATS,
+                                  RETRIEVAL_K, RETRIEVAL_BATCH_MAX_SIZE, RETRIEVAL_BATCH_MAX_WAIT_MS,
+                                  RETRIEVAL_HYBRID_ENABLED, RETRIEVAL_LEXICAL_INDEX_DIR, RETRIEVAL_RRF_K,
+                                  RERANK_ENABLED, RERANK_MODEL, RERANK_CANDIDATES, RERANK_BUDGET_MS, RERANK_CACHE_SIZE,
+                                  BATCH_SIZE, BATCH_MAX_QUESTIONS, BATCH_MAX_IN_FLIGHT,
+                                  CONTEXT_TOKEN_BUDGET, CONTEXT_MIN_SCORE, CONTEXT_DUPLICATE_THRESHOLD,
+                                  SAVE_MODEL_DIR, MODEL_BUCKET_NAME, MODEL_FILE_NAME, ADMIN_TOKEN)
+from logger import logging, set_request_id, get_request_id, dropped_records
 from medicalbot.pipeline.prediction_pipeline import MedicalbotModel
 
 
@@ -19,130 +55,396 @@ app = Flask(__name__)
 # Load environment variables from .env file
 load_dotenv()
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Retrieve Pinecone API Key from environment variables (only needed for the Pinecone backend)
+if VECTOR_STORE_BACKEND == "pinecone":
+    PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY')
+    if not PINECONE_API_KEY:
+        raise ValueError("PINECONE_API_KEY is not set in the environment variables.")
 
-# Retrieve Pinecone API Key from environment variables
-PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY')
-if not PINECONE_API_KEY:
-    raise ValueError("PINECONE_API_KEY is not set in the environment variables.")
+    os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
 
-os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
-
-# Download embeddings
-embeddings = download_hugging_face_embeddings()
+# Define the prompt template
+PROMPT = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
 
-# Define Pinecone index name
-index_name = "medicalchatbot"
+# Pack the retrieved chunks into the prompt within the context token budget
+context_packer = ContextPacker(
+    token_budget=CONTEXT_TOKEN_BUDGET,
+    min_score=CONTEXT_MIN_SCORE,
+    duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD
+)
 
-# Initialize the Pinecone vector store
-docsearch = PineconeVectorStore.from_existing_index(
-    index_name=index_name,
-    embedding=embeddings
+# Stop generation at stop sequences and repetition loops; shorten answers while requests queue up
+generation_controller = GenerationController(
+    max_new_tokens=LLM_MAX_NEW_TOKENS,
+    min_new_tokens=LLM_MIN_NEW_TOKENS,
+    stop_sequences=LLM_STOP_SEQUENCES,
+    repeats=LLM_REPETITION_REPEATS,
+    pressure=lambda: scheduler.pressure() if scheduler is not None else 0.0
 )
 
-# Define the prompt template
-PROMPT = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
-chain_type_kwargs = {"prompt": PROMPT}
+# Services below are filled in by the startup phases, see StartupOrchestrator
+embeddings = None
+docsearch = None
+retriever = None
+scheduler = None
+answer_cache = None
+reranker = None
+model_version = None
+
+# State of the last model hot-swap started through /admin/model
+model_swap = {"status": "idle"}
+model_swap_lock = threading.Lock()
 
 
 # medical_model_load = MedicalbotModel()
 # llama_model = medical_model_load.predict()
 
 
-def load_first_model_file_from_folder(folder_path: str):
+def resolve_model_path():
     """
-    This function loads the first model file from the specified folder.
-
-    Parameters:
-    - folder_path (str): Path to the folder containing saved models.
-
-    Returns:
-    - The model file name (str) if a model file is found.
+    Startup phase: returns the path of the LLaMA model file from the local
+    model cache, which checks it against S3 and downloads it only when it
+    is missing or has changed. The active version of the model registry is
+    preferred over the single model key. Without S3 access the newest cached
+    copy is used. LLM_MODEL_PATH, when set, is served as is.
     """
-    try:
-        # List files in the directory
-        model_files = os.listdir(folder_path)
-
-        # Check if folder is empty
-        if not model_files:
-            logging.info(f"The folder {folder_path} is empty.")
-            return None
-        else:
-            # Return the first file in the folder
-            logging.info(f"Using the first model file from folder: {model_files[0]}")
-            return model_files[0]
-
-    except Exception as e:
-        logging.error(f"Error accessing folder {folder_path}: {str(e)}")
-        raise e
-
-# Specify the folder path
-save_model_folder = "C:\\Users\\pramod\\Desktop\\INURON\\Internship3\\Gen-AI-Medical_Chatbot\\savemodel"  # Change this to the actual folder path
-
-# Check if the folder exists, and create it if it does not
-if not os.path.exists(save_model_folder):
-    os.makedirs(save_model_folder)
-    print(f"Folder created: {save_model_folder}")
-else:
-    print(f"Folder already exists: {save_model_folder}")
-
-
-
-# Folder where the saved models are stored
-save_model_folder = "C:\\Users\\pramod\Desktop\\INURON\\Internship3\\Gen-AI-Medical_Chatbot\\savemodel"  # Change this to the actual folder path
-
-try:
-    logging.info("Entered the process of checking the save model folder.")
+    global model_version
+    if LLM_MODEL_PATH:
+        if not os.path.isfile(LLM_MODEL_PATH):
+            raise ValueError(f"LLM_MODEL_PATH {LLM_MODEL_PATH} does not exist")
+        logging.info(f"Serving the local model file {LLM_MODEL_PATH} (LLM_MODEL_PATH)")
+        return LLM_MODEL_PATH
 
-    # Check if the save model folder is empty or not
-    model_file = load_first_model_file_from_folder(save_model_folder)
+    try:
+        logging.info("Entered the process of resolving the LLaMA model file.")
 
-    if model_file is None:
-        logging.info("Save model folder is empty. Proceeding to load the LLaMA model.")
+        # Active version of the model registry, if one has been pushed
+        version, full_model_path = ModelRegistry(MODEL_BUCKET_NAME).fetch()
+        if full_model_path is not None:
+            model_version = version
+            logging.info(f"LLaMA model version {version} loaded from the model registry.{full_model_path}")
+            return full_model_path
 
         # Initialize the class responsible for loading the LLaMA model
         medical_model_load = MedicalbotModel()
 
-        # Load the LLaMA model
+        # Fetch the LLaMA model through the model cache
         full_model_path = medical_model_load.load_llama_model()
-        
-        logging.info(f"LLaMA model loaded successfully.{full_model_path}")
-        print(full_model_path)
-    else:
-        # Use the first file in the folder as the model
-        llama_model = model_file
-        full_model_path = os.path.join(save_model_folder, llama_model)
-        logging.info(f"LLaMA model loaded from saved model folder: {llama_model}")
-
-except Exception as e:
-    logging.error(f"Error loading the LLaMA model: {str(e)}")
-    raise ValueError("Could not load the LLaMA model.")
-
-
 
+        logging.info(f"LLaMA model loaded successfully.{full_model_path}")
+        return full_model_path
 
+    except Exception as e:
+        logging.error(f"Error loading the LLaMA model from S3: {str(e)}")
+
+        # The registry version served last (whether active or rolled back to), then the single model key
+        model_cache = ModelCache.shared(SAVE_MODEL_DIR)
+        version, full_model_path = ModelRegistry.cached(MODEL_BUCKET_NAME, model_cache)
+        if full_model_path is not None:
+            model_version = version
+            logging.info(f"LLaMA model version {version} loaded from the model cache: {full_model_path}")
+            return full_model_path
+
+        full_model_path = model_cache.cached_path(MODEL_BUCKET_NAME, MODEL_FILE_NAME)
+        if full_model_path is None:
+            raise ValueError("Could not load the LLaMA model.")
+        logging.info(f"LLaMA model loaded from the model cache: {full_model_path}")
+        return full_model_path
+
+
+# Initialize one model worker with its own LLM
+def create_model_worker(model_path, version=None, warmup=False):
+    if LLM_BACKEND == "llama_cpp" and LLM_BATCH_SEQUENCES > 1:
+        if LLM_DRAFT_MODEL_PATH:
+            logging.warning("LLM_DRAFT_MODEL_PATH is ignored: speculative decoding does not combine with LLM_BATCH_SEQUENCES")
+        # Concurrent requests are decoded together; the static prompt prefix is evaluated once for all of them
+        llm = ContinuousBatchingLLM.load(
+            model_path,
+            max_sequences=LLM_BATCH_SEQUENCES,
+            context_length=LLM_CONTEXT_LENGTH,
+            threads=LLM_THREADS_PER_WORKER,
+            batch_size=LLM_PROMPT_BATCH_SIZE,
+            max_new_tokens=LLM_MAX_NEW_TOKENS,
+            temperature=0.8
+        )
+        llm.warm(prompt_prefix)
+        return ModelWorker(llm=llm, version=version)
+
+    if LLM_BACKEND == "llama_cpp":
+        draft = None
+        if LLM_DRAFT_MODEL_PATH:
+            # The small model proposes LLM_DRAFT_TOKENS tokens at a time, the 7B model verifies them in one pass
+            draft = DraftModel.load(LLM_DRAFT_MODEL_PATH, context_length=LLM_CONTEXT_LENGTH,
+                                    threads=LLM_THREADS_PER_WORKER, batch_size=LLM_PROMPT_BATCH_SIZE,
+                                    draft_tokens=LLM_DRAFT_TOKENS)
+        # The static prompt prefix is evaluated once here; requests restore that state instead
+        llm = PrefixCachingLLM.load(
+            model_path,
+            prefix=prompt_prefix,
+            context_length=LLM_CONTEXT_LENGTH,
+            threads=LLM_THREADS_PER_WORKER,
+            batch_size=LLM_PROMPT_BATCH_SIZE,
+            max_new_tokens=LLM_MAX_NEW_TOKENS,
+            temperature=0.8,
+            max_states=LLM_PREFIX_CACHE_STATES,
+            max_bytes=int(LLM_PREFIX_CACHE_MAX_MB * 1024 * 1024),
+            chunk_min_hits=LLM_PREFIX_CACHE_CHUNK_HITS,
+            draft=draft
+        )
+        llm.warm()
+        logging.info(f"llama.cpp model ready")
+        return ModelWorker(llm=llm, version=version)
+
+    if LLM_DRAFT_MODEL_PATH:
+        logging.warning("LLM_DRAFT_MODEL_PATH is ignored: speculative decoding needs LLM_BACKEND='llama_cpp'")
+    if LLM_BATCH_SEQUENCES > 1:
+        logging.warning("LLM_BATCH_SEQUENCES is ignored: ctransformers decodes one request at a time per worker, "
+                        "continuous batching needs LLM_BACKEND='llama_cpp' and a GGUF model")
+
+    # mmap lets the workers share one copy of the weights through the page cache
+    llm = CTransformers(
+        model= model_path,
+        model_type="llama",
+        config={'max_new_tokens': LLM_MAX_NEW_TOKENS, 'temperature': 0.8, 'threads': LLM_THREADS_PER_WORKER,
+                'batch_size': LLM_PROMPT_BATCH_SIZE, 'mmap': True}
+    )
+    logging.info(f"CTransformers Done")
+
+    if warmup:
+        # One token through the model pages the weights in before it takes traffic
+        llm.client("Hello", max_new_tokens=1)
+
+    return ModelWorker(llm=llm, version=version)
+
+# Optional per-request cap on the answer length ("max_tokens" form field)
+def requested_max_tokens():
+    value = request.form.get("max_tokens")
+    if not value:
+        return None
+    max_tokens = int(value)
+    if max_tokens < 1:
+        raise ValueError("max_tokens must be a positive integer")
+    return max_tokens
+
+# Answer one question: batched retrieval, then generation on a model worker
+def answer_question(msg, max_new_tokens=None):
+    docs = retriever.invoke(msg)
+    if reranker is not None:
+        docs = reranker.rerank(msg, docs)
+    with PROMPT_BUILD_SECONDS.time():
+        final_prompt = build_prompt(msg, docs, PROMPT, packer=context_packer)
+    future = scheduler.submit(lambda worker: generate(worker.llm, final_prompt, controller=generation_controller,
+                                                      max_new_tokens=max_new_tokens))
+    result = future.result(timeout=LLM_REQUEST_TIMEOUT_SECONDS)
+    return {"query": msg, "result": result, "source_documents": docs}
+
+
+# Startup phase: download embeddings
+def load_embeddings():
+    global embeddings
+    # Chunk embeddings cached by ingestion are reused; questions are only cached in memory
+    embeddings = download_hugging_face_embeddings(cache_dir=EMBEDDING_CACHE_DIR, read_only=True,
+                                                  memory_entries=EMBEDDING_CACHE_QUERY_ENTRIES)
+    return embeddings
+
+# Startup phase: connect the configured vector store (Pinecone or the local in-process index)
+def load_retriever(embeddings):
+    global docsearch, retriever
+    docsearch = load_vector_store(
+        backend=VECTOR_STORE_BACKEND,
+        embeddings=embeddings,
+        index_name=VECTOR_STORE_INDEX_NAME,
+        local_path=VECTOR_STORE_LOCAL_DIR,
+        index_type=VECTOR_STORE_LOCAL_INDEX_TYPE
+    )
+    logging.info(f"Vector store backend: {VECTOR_STORE_BACKEND}")
+
+    # BM25 index built by store_index.py, fused with the dense results
+    lexical_index = None
+    if RETRIEVAL_HYBRID_ENABLED:
+        if os.path.exists(os.path.join(RETRIEVAL_LEXICAL_INDEX_DIR, LEXICAL_META_FILE)):
+            lexical_index = BM25Index.load(RETRIEVAL_LEXICAL_INDEX_DIR)
+        else:
+            logging.warning(f"No BM25 index at {RETRIEVAL_LEXICAL_INDEX_DIR}, run store_index.py; retrieval is dense-only")
+
+    # Batch the embedding and vector search of concurrently arriving questions
+    retriever = RetrievalBatcher(
+        embeddings=embeddings,
+        vector_store=docsearch,
+        k=RERANK_CANDIDATES if RERANK_ENABLED else RETRIEVAL_K,  # over-fetch for the reranker
+        max_batch_size=RETRIEVAL_BATCH_MAX_SIZE,
+        max_wait_ms=RETRIEVAL_BATCH_MAX_WAIT_MS,
+        lexical_index=lexical_index,
+        rrf_k=RETRIEVAL_RRF_K
+    )
+    return retriever
+
+# Scheduler slots per loaded model: with continuous batching every model decodes LLM_BATCH_SEQUENCES requests at once
+def slots_per_model():
+    return LLM_BATCH_SEQUENCES if LLM_BACKEND == "llama_cpp" and LLM_BATCH_SEQUENCES > 1 else 1
+
+# Worker factory that loads one model for every slots_per_model() consecutive scheduler workers
+def shared_model_workers(model_path, version=None, warmup=False):
+    lock = threading.Lock()
+    slots = iter(range(LLM_WORKERS * slots_per_model()))
+    workers = {}
+
+    def factory():
+        with lock:
+            model = next(slots) // slots_per_model()
+            if model not in workers:
+                workers[model] = create_model_worker(model_path, version=version, warmup=warmup)
+            return workers[model]
+    return factory
+
+# Startup phase: start the pool of model workers behind a bounded request queue
+def start_model_workers(model_path):
+    global scheduler
+    pool = InferenceScheduler(
+        worker_factory=shared_model_workers(model_path, version=model_version),
+        num_workers=LLM_WORKERS * slots_per_model(),
+        max_queue=LLM_QUEUE_SIZE
+    )
+    pool.wait_until_ready()
+    scheduler = pool
+    return scheduler
+
+# Startup phase: initialize the semantic answer cache in front of the answer path
+def load_answer_cache(embeddings):
+    global answer_cache
+    if SEMANTIC_CACHE_ENABLED:
+        answer_cache = SemanticCache(
+            embeddings=embeddings,
+            threshold=SEMANTIC_CACHE_THRESHOLD,
+            max_size=SEMANTIC_CACHE_MAX_SIZE,
+            ttl=SEMANTIC_CACHE_TTL_SECONDS,
+            persist_path=SEMANTIC_CACHE_PERSIST_PATH or None,
+            save_interval=SEMANTIC_CACHE_SAVE_INTERVAL_SECONDS
+        )
+        logging.info(f"Semantic cache enabled (threshold={SEMANTIC_CACHE_THRESHOLD})")
+    return answer_cache
+
+
+# Startup phase: load the cross-encoder that reranks the over-fetched candidates down to RETRIEVAL_K
+def load_reranker():
+    global reranker
+    if RERANK_ENABLED:
+        reranker = CrossEncoderReranker.load(
+            RERANK_MODEL,
+            top_k=RETRIEVAL_K,
+            budget_ms=RERANK_BUDGET_MS,
+            cache_size=RERANK_CACHE_SIZE
+        )
+        logging.info(f"Reranking {RERANK_CANDIDATES} candidates with {RERANK_MODEL} (budget {RERANK_BUDGET_MS:.0f} ms)")
+    return reranker
+
+
+# Pre-load a registry version next to the serving model, swap it in once warm and make it the active version
+def run_model_swap(version):
+    global model_version
+    try:
+        registry = ModelRegistry(MODEL_BUCKET_NAME)
+        version, model_path = registry.fetch(version)
+        replaced = scheduler.replace_workers(shared_model_workers(model_path, version=version, warmup=True))
+        previous, model_version = model_version, version
+        for llm in {id(worker.llm): worker.llm for worker in replaced}.values():
+            # Batched models stop their decode thread once their last requests are done
+            if hasattr(llm, "close"):
+                llm.close()
+        registry.set_active(version)
+        if answer_cache is not None:
+            # Cached answers were produced by the previous model
+            answer_cache.clear()
+
+        with model_swap_lock:
+            model_swap.update(status="done", finished_at=time.time())
+        logging.info(f"Model swapped from {previous} to {version}")
 
-# Initialize the LLM
-llm = CTransformers(
-    model= full_model_path,
-    model_type="llama",
-    config={'max_new_tokens': 512, 'temperature': 0.8}
-)
-logging.info(f"CTransformers Done")
-print("CTransformers Done")
-
-# Initialize the RetrievalQA chain
-qa = RetrievalQA.from_chain_type(
-    llm=llm, 
-    chain_type="stuff", 
-    retriever=docsearch.as_retriever(search_kwargs={'k': 2}),
-    return_source_documents=True, 
-    chain_type_kwargs=chain_type_kwargs
-)
+    except Exception as e:
+        with model_swap_lock:
+            model_swap.update(status="failed", error=str(e), finished_at=time.time())
+        logging.error(f"Model swap to {version} failed: {str(e)}")
+
+def start_model_swap(version):
+    """Starts a background swap to `version`; returns False when one is already running."""
+    with model_swap_lock:
+        if model_swap["status"] == "loading":
+            return False
+        model_swap.clear()
+        model_swap.update(status="loading", version=version, started_at=time.time())
+    threading.Thread(target=run_model_swap, args=(version,), name="model-swap", daemon=True).start()
+    return True
+
+def model_swap_status():
+    with model_swap_lock:
+        return dict(model_swap)
+
+def is_admin(token):
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token or "", ADMIN_TOKEN)
+
+
+# Run the startup phases concurrently in the background so the port is bound right away
+startup = StartupOrchestrator()
+startup.add_phase("embeddings", load_embeddings)
+startup.add_phase("vector_store", load_retriever, depends_on=("embeddings",))
+startup.add_phase("model_file", resolve_model_path)
+startup.add_phase("model_workers", start_model_workers, depends_on=("model_file",))
+startup.add_phase("semantic_cache", load_answer_cache, depends_on=("embeddings",))
+startup.add_phase("reranker", load_reranker)
+startup.start()
+
+
+# Component state exposed on /metrics, read at scrape time
+def scheduler_stat(name):
+    return lambda: scheduler.stats()[name] if scheduler is not None else None
+
+def cache_stat(name):
+    return lambda: answer_cache.stats()[name] if answer_cache is not None else None
+
+REGISTRY.gauge("medicalbot_ready", "1 once every startup phase is ready").set_function(lambda: int(startup.ready))
+REGISTRY.gauge("medicalbot_queue_depth", "Requests waiting for a model worker").set_function(scheduler_stat("queue_depth"))
+REGISTRY.gauge("medicalbot_busy_workers", "Model workers generating an answer").set_function(scheduler_stat("busy_workers"))
+REGISTRY.counter("medicalbot_rejected_requests_total", "Requests rejected with a full queue").set_function(scheduler_stat("rejected"))
+REGISTRY.counter("medicalbot_cache_hits_total", "Semantic answer cache hits").set_function(cache_stat("hits"))
+REGISTRY.counter("medicalbot_cache_misses_total", "Semantic answer cache misses").set_function(cache_stat("misses"))
+REGISTRY.counter("medicalbot_log_records_dropped_total", "Log records dropped with a full log queue").set_function(dropped_records)
+
+
+def not_ready_response():
+    return jsonify({"error": "Service is starting up, please retry shortly", **startup.status()}), 503  # Service Unavailable
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    set_request_id(request.headers.get("X-Request-ID"))
+
+# A streamed response is timed when its first chunk is sent, not when the view returns the generator
+def observe_first_chunk(chunks, route, started):
+    observed = False
+    try:
+        for chunk in chunks:
+            if not observed:
+                REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+                observed = True
+            yield chunk
+    finally:
+        if not observed:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+# Count every request and time it until the response (or the first byte of a stream) is ready
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    REQUESTS.inc(route=route, status=response.status_code)
+    if response.is_streamed:
+        response.response = observe_first_chunk(response.response, route, g.request_started)
+    else:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, route=route)
+    response.headers["X-Request-ID"] = get_request_id()
+    return response
 
-logging.info(f"RetrievalQA Done")
-print("RetrievalQA Done")
 # Define the main route
 @app.route("/")
 def index():
@@ -151,22 +453,177 @@ def index():
 # Define the chat route
 @app.route("/get", methods=["POST"])
 def chat():
+    if not startup.ready:
+        return not_ready_response()
     try:
         msg = request.form.get("msg", "")
         if not msg:
             return jsonify({"error": "No message provided"}), 400  # Bad Request
         
-        logging.info(f"Input: {msg}")
+        try:
+            max_tokens = requested_max_tokens()
+        except ValueError:
+            return jsonify({"error": "max_tokens must be a positive integer"}), 400  # Bad Request
+
+        logging.debug("Input: %s", msg)
         #response = qa.invoke({"query": msg})
-        response=qa({"query": msg})
+        if answer_cache is not None and max_tokens is None:
+            response = answer_cache.get_or_compute(msg, lambda: answer_question(msg))
+        else:
+            # Answers shortened on request are not cached for everyone else
+            response = answer_question(msg, max_new_tokens=max_tokens)
 
-        logging.info(f"Response: {response['result']}")
+        logging.info("Answered with %d characters", len(str(response['result'])))
+        logging.debug("Response: %s", response['result'])
         return str(response['result'])
     
+    except QueueFullError as e:
+        logging.info(f"Rejected: {str(e)}")
+        return jsonify({"error": "Server is busy, please retry shortly"}), 429  # Too Many Requests
+
     except Exception as e:
         logging.error(f"Error: {str(e)}")
         return jsonify({"error": "An error occurred during processing"}), 500
 
+# Define the streaming chat route (Server-Sent Events)
+@app.route("/stream", methods=["POST"])
+def chat_stream():
+    if not startup.ready:
+        return not_ready_response()
+    msg = request.form.get("msg", "")
+    if not msg:
+        return jsonify({"error": "No message provided"}), 400  # Bad Request
+    try:
+        max_tokens = requested_max_tokens()
+    except ValueError:
+        return jsonify({"error": "max_tokens must be a positive integer"}), 400  # Bad Request
+
+    logging.debug("Stream input: %s", msg)
+
+    try:
+        docs = retriever.invoke(msg)
+        if reranker is not None:
+            docs = reranker.rerank(msg, docs)
+        frames = scheduler.stream(lambda worker: stream_answer(msg, docs, worker.llm, PROMPT, packer=context_packer,
+                                                               controller=generation_controller,
+                                                               max_new_tokens=max_tokens))
+    except QueueFullError as e:
+        logging.info(f"Rejected: {str(e)}")
+        return jsonify({"error": "Server is busy, please retry shortly"}), 429  # Too Many Requests
+    except Exception as e:
+        logging.error(f"Error: {str(e)}")
+        return jsonify({"error": "An error occurred during processing"}), 500
+
+    def generate():
+        try:
+            yield from frames
+        except Exception as e:
+            logging.error(f"Error: {str(e)}")
+            yield format_sse({"error": "An error occurred during processing"}, event="error")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Define the batch route: answers a list of questions, one JSON line per answer as each completes
+@app.route("/batch", methods=["POST"])
+def batch():
+    if not startup.ready:
+        return not_ready_response()
+    records = (request.get_json(silent=True) or {}).get("questions")
+    if not isinstance(records, list) or not records:
+        return jsonify({"error": "No questions provided"}), 400  # Bad Request
+    if len(records) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"At most {BATCH_MAX_QUESTIONS} questions per request"}), 413  # Payload Too Large
+    try:
+        questions = [parse_question(record, index) for index, record in enumerate(records)]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400  # Bad Request
+
+    answerer = BatchAnswerer(retriever, scheduler, PROMPT, packer=context_packer, reranker=reranker,
+                             controller=generation_controller, batch_size=BATCH_SIZE,
+                             max_in_flight=BATCH_MAX_IN_FLIGHT or None)
+
+    def generate():
+        try:
+            for record in answerer.answer(questions):
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logging.error(f"Error: {str(e)}")
+            yield json.dumps({"error": "An error occurred during processing"}) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Expose semantic cache hit/miss counters
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    if answer_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **answer_cache.stats()})
+
+# Expose model worker, queue and retrieval batching metrics
+@app.route("/scheduler/stats", methods=["GET"])
+def scheduler_stats():
+    if not startup.ready:
+        return not_ready_response()
+    return jsonify({**scheduler.stats(), "retrieval": retriever.stats()})
+
+# Prometheus-style metrics: request, retrieval and generation latencies and counters
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+# Liveness: the process is serving HTTP and no startup phase has failed
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    if startup.failed:
+        return jsonify({"status": "failed", **startup.status()}), 500
+    return jsonify({"status": "alive"})
+
+# Readiness: every startup phase has finished, with per-phase timings
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    status = startup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+# Admin: serving model version, last swap and registry versions
+@app.route("/admin/model", methods=["GET"])
+def admin_model():
+    if not is_admin(request.headers.get("X-Admin-Token")):
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        registry = ModelRegistry(MODEL_BUCKET_NAME)
+        versions = [manifest["version"] for manifest in registry.list_versions()]
+        active = registry.get_active()
+    except Exception as e:
+        logging.error(f"Error reading the model registry: {str(e)}")
+        versions, active = None, None
+    return jsonify({"serving": model_version, "swap": model_swap_status(), "active": active, "versions": versions})
+
+# Admin: roll the running server forward or back to a registry version without downtime
+@app.route("/admin/model", methods=["POST"])
+def admin_model_swap():
+    if not is_admin(request.headers.get("X-Admin-Token")):
+        return jsonify({"error": "Forbidden"}), 403
+    if not startup.ready:
+        return not_ready_response()
+    version = request.form.get("version") or (request.get_json(silent=True) or {}).get("version")
+    if not version:
+        return jsonify({"error": "No version provided"}), 400  # Bad Request
+    if not start_model_swap(version):
+        return jsonify({"error": "A model swap is already in progress", "swap": model_swap_status()}), 409  # Conflict
+    return jsonify({"swap": model_swap_status()}), 202  # Accepted
+
 # Run the Flask application
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=8080, debug=True)
+    if SERVING_MODE == "production":
+        from waitress import serve
+        serve(app, host=APP_HOST, port=APP_PORT, threads=SERVING_THREADS)
+    else:
+        app.run(host=APP_HOST, port=APP_PORT, debug=True)
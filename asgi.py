@@ -0,0 +1,290 @@
+import asyncio
+import json
+import time
+
+import uvicorn
+from fastapi import FastAPI, Form, Header, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from starlette.concurrency import iterate_in_threadpool
+
+from logger import logging, set_request_id
+from medicalbot.constants import (APP_HOST, APP_PORT, LLM_REQUEST_TIMEOUT_SECONDS, MODEL_BUCKET_NAME, BATCH_SIZE,
+                                  BATCH_MAX_QUESTIONS, BATCH_MAX_IN_FLIGHT)
+from src.helper import build_prompt
+from src.inference_scheduler import QueueFullError
+from src.batch_qa import BatchAnswerer, parse_question
+from src.streaming import stream_answer, format_sse
+from src.generation import generate
+from src.metrics import REGISTRY, CONTENT_TYPE, REQUESTS, REQUEST_SECONDS, PROMPT_BUILD_SECONDS
+from medicalbot.entity.model_registry import ModelRegistry
+
+# Reuse the startup phases, retriever, model workers and cache of the Flask app.
+# They are filled in by the background startup, so always read them as server.<name>.
+import app as server
+
+
+# Initialize FastAPI app
+app = FastAPI(title="Medical Chatbot")
+app.mount("/static", StaticFiles(directory="static"), name="static")
+templates = Jinja2Templates(directory="templates")
+
+
+# Count every request, time it until the response (or the first byte of a stream) is ready and tag its logs
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    request_id = set_request_id(request.headers.get("X-Request-ID"))
+    response = await call_next(request)
+    route = request.scope.get("route")
+    route = route.path if route is not None else "unmatched"
+    REQUESTS.inc(route=route, status=response.status_code)
+    # call_next hands every body over as a stream; it is timed when its first chunk is sent
+    response.body_iterator = observe_first_chunk(response.body_iterator, route, start)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+async def observe_first_chunk(chunks, route, started):
+    observed = False
+    try:
+        async for chunk in chunks:
+            if not observed:
+                REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+                observed = True
+            yield chunk
+    finally:
+        if not observed:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+
+
+def busy_response():
+    return JSONResponse({"error": "Server is busy, please retry shortly"}, status_code=429)  # Too Many Requests
+
+
+def error_response():
+    return JSONResponse({"error": "An error occurred during processing"}, status_code=500)
+
+
+def not_ready_response():
+    return JSONResponse({"error": "Service is starting up, please retry shortly", **server.startup.status()},
+                        status_code=503)  # Service Unavailable
+
+
+# Answer one question without holding a thread while waiting
+async def answer_question(msg, max_new_tokens=None):
+    docs = await server.retriever.ainvoke(msg)
+    if server.reranker is not None:
+        docs = await server.reranker.arerank(msg, docs)
+    with PROMPT_BUILD_SECONDS.time():
+        final_prompt = build_prompt(msg, docs, server.PROMPT, packer=server.context_packer)
+    future = server.scheduler.submit(lambda worker: generate(worker.llm, final_prompt,
+                                                             controller=server.generation_controller,
+                                                             max_new_tokens=max_new_tokens))
+    result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=LLM_REQUEST_TIMEOUT_SECONDS)
+    return {"query": msg, "result": result, "source_documents": docs}
+
+
+# Define the main route
+@app.get("/", response_class=HTMLResponse)
+async def index(request: Request):
+    # chat.html uses Flask's url_for('static', filename=...) signature
+    return templates.TemplateResponse(request, "chat.html", {
+        "url_for": lambda endpoint, filename: f"/static/{filename}",
+    })
+
+
+# Define the chat route
+@app.post("/get")
+async def chat(msg: str = Form(""), max_tokens: int = Form(None)):
+    if not server.startup.ready:
+        return not_ready_response()
+    if not msg:
+        return JSONResponse({"error": "No message provided"}, status_code=400)  # Bad Request
+    if max_tokens is not None and max_tokens < 1:
+        return JSONResponse({"error": "max_tokens must be a positive integer"}, status_code=400)  # Bad Request
+
+    logging.debug("Input: %s", msg)
+    try:
+        if server.answer_cache is not None and max_tokens is None:
+            # Embedding the question for the cache lookup is CPU work, keep it off the event loop
+            loop = asyncio.get_running_loop()
+            vector, response = await loop.run_in_executor(None, server.answer_cache.lookup, msg)
+            if response is None:
+                response = await answer_question(msg)
+                await loop.run_in_executor(None, server.answer_cache.store, vector, response)
+        else:
+            # Answers shortened on request are not cached for everyone else
+            response = await answer_question(msg, max_new_tokens=max_tokens)
+
+        logging.info("Answered with %d characters", len(str(response['result'])))
+        logging.debug("Response: %s", response['result'])
+        return PlainTextResponse(str(response['result']))
+
+    except QueueFullError as e:
+        logging.info(f"Rejected: {str(e)}")
+        return busy_response()
+
+    except Exception as e:
+        logging.error(f"Error: {str(e)}")
+        return error_response()
+
+
+# Define the streaming chat route (Server-Sent Events)
+@app.post("/stream")
+async def chat_stream(msg: str = Form(""), max_tokens: int = Form(None)):
+    if not server.startup.ready:
+        return not_ready_response()
+    if not msg:
+        return JSONResponse({"error": "No message provided"}, status_code=400)  # Bad Request
+    if max_tokens is not None and max_tokens < 1:
+        return JSONResponse({"error": "max_tokens must be a positive integer"}, status_code=400)  # Bad Request
+
+    logging.debug("Stream input: %s", msg)
+    try:
+        docs = await server.retriever.ainvoke(msg)
+        if server.reranker is not None:
+            docs = await server.reranker.arerank(msg, docs)
+        frames = server.scheduler.astream(lambda worker: stream_answer(msg, docs, worker.llm, server.PROMPT,
+                                                                       packer=server.context_packer,
+                                                                       controller=server.generation_controller,
+                                                                       max_new_tokens=max_tokens))
+    except QueueFullError as e:
+        logging.info(f"Rejected: {str(e)}")
+        return busy_response()
+    except Exception as e:
+        logging.error(f"Error: {str(e)}")
+        return error_response()
+
+    async def generate():
+        try:
+            async for frame in frames:
+                yield frame
+        except Exception as e:
+            logging.error(f"Error: {str(e)}")
+            yield format_sse({"error": "An error occurred during processing"}, event="error")
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Define the batch route: answers a list of questions, one JSON line per answer as each completes
+@app.post("/batch")
+async def batch(request: Request):
+    if not server.startup.ready:
+        return not_ready_response()
+    try:
+        records = (await request.json()).get("questions")
+    except (ValueError, AttributeError):
+        records = None
+    if not isinstance(records, list) or not records:
+        return JSONResponse({"error": "No questions provided"}, status_code=400)  # Bad Request
+    if len(records) > BATCH_MAX_QUESTIONS:
+        return JSONResponse({"error": f"At most {BATCH_MAX_QUESTIONS} questions per request"},
+                            status_code=413)  # Payload Too Large
+    try:
+        questions = [parse_question(record, index) for index, record in enumerate(records)]
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)  # Bad Request
+
+    answerer = BatchAnswerer(server.retriever, server.scheduler, server.PROMPT, packer=server.context_packer,
+                             reranker=server.reranker, controller=server.generation_controller,
+                             batch_size=BATCH_SIZE, max_in_flight=BATCH_MAX_IN_FLIGHT or None)
+
+    # Batched retrieval and waiting on the workers block, so the answerer runs on the thread pool
+    async def generate():
+        try:
+            async for record in iterate_in_threadpool(answerer.answer(questions)):
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logging.error(f"Error: {str(e)}")
+            yield json.dumps({"error": "An error occurred during processing"}) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Expose semantic cache hit/miss counters
+@app.get("/cache/stats")
+async def cache_stats():
+    if server.answer_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **server.answer_cache.stats()}
+
+
+# Expose model worker, queue and retrieval batching metrics
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    if not server.startup.ready:
+        return not_ready_response()
+    return {**server.scheduler.stats(), "retrieval": server.retriever.stats()}
+
+
+# Prometheus-style metrics: request, retrieval and generation latencies and counters
+@app.get("/metrics")
+async def metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+# Liveness: the process is serving HTTP and no startup phase has failed
+@app.get("/healthz")
+async def healthz():
+    if server.startup.failed:
+        return JSONResponse({"status": "failed", **server.startup.status()}, status_code=500)
+    return {"status": "alive"}
+
+
+# Readiness: every startup phase has finished, with per-phase timings
+@app.get("/readyz")
+async def readyz():
+    status = server.startup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+# Admin: serving model version, last swap and registry versions
+@app.get("/admin/model")
+async def admin_model(x_admin_token: str = Header(None)):
+    if not server.is_admin(x_admin_token):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    def read_registry():
+        registry = ModelRegistry(MODEL_BUCKET_NAME)
+        return [manifest["version"] for manifest in registry.list_versions()], registry.get_active()
+
+    try:
+        versions, active = await asyncio.get_running_loop().run_in_executor(None, read_registry)
+    except Exception as e:
+        logging.error(f"Error reading the model registry: {str(e)}")
+        versions, active = None, None
+    return {"serving": server.model_version, "swap": server.model_swap_status(), "active": active,
+            "versions": versions}
+
+
+# Admin: roll the running server forward or back to a registry version without downtime
+@app.post("/admin/model")
+async def admin_model_swap(request: Request, x_admin_token: str = Header(None)):
+    if not server.is_admin(x_admin_token):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    if not server.startup.ready:
+        return not_ready_response()
+    # The version comes as a form field or, like on the Flask server, in a JSON body
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        version = body.get("version") if isinstance(body, dict) else None
+    else:
+        version = (await request.form()).get("version")
+    if not version:
+        return JSONResponse({"error": "No version provided"}, status_code=400)  # Bad Request
+    if not server.start_model_swap(version):
+        return JSONResponse({"error": "A model swap is already in progress", "swap": server.model_swap_status()},
+                            status_code=409)  # Conflict
+    return JSONResponse({"swap": server.model_swap_status()}, status_code=202)  # Accepted
+
+
+# Run the ASGI application
+if __name__ == '__main__':
+    uvicorn.run(app, host=APP_HOST, port=APP_PORT, loop="asyncio", timeout_keep_alive=75)
@@ -0,0 +1,64 @@
+"""
+Offline batch question answering.
+
+Answers a JSONL file of questions (one object per line with a "question" field
+and an optional "id", or one JSON string per line) with the same retrieval,
+reranking, context packing and model workers as the server, and appends one
+JSON record per answer with its source chunks to the output file:
+
+    python batch_qa.py questions.jsonl --output answers.jsonl
+
+The output file is the checkpoint: rerunning the same command after a crash or
+Ctrl-C skips the questions already answered and retries the failed ones. A line
+that is not valid JSON is recorded as failed under its line number.
+"""
+import argparse
+import json
+import sys
+
+from medicalbot.constants import (BATCH_SIZE, BATCH_MAX_IN_FLIGHT, LLM_MAX_NEW_TOKENS, LLM_STOP_SEQUENCES,
+                                  LLM_REPETITION_REPEATS)
+from src.batch_qa import BatchAnswerer, run_batch
+from src.generation_control import GenerationController
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions into a JSONL file, resumably.")
+    parser.add_argument("input", help="Question file: .jsonl with a 'question' (and optional 'id') per line")
+    parser.add_argument("--output", default="answers.jsonl", help="Answer file, appended to and resumed from")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Questions embedded and searched together")
+    parser.add_argument("--max-in-flight", type=int, default=BATCH_MAX_IN_FLIGHT or None,
+                        help="Generations queued or running at once; defaults to BATCH_MAX_IN_FLIGHT, or two per "
+                             "scheduler slot (LLM_WORKERS x batched sequences) to keep every model busy")
+    parser.add_argument("--sync-every", type=int, default=100, help="Answers between fsyncs of the output file")
+    parser.add_argument("--startup-timeout", type=float, default=None, help="Seconds to wait for the models to load")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # Importing the server module starts loading the embeddings, indexes and model workers
+    import app as server
+    if not server.startup.wait(timeout=args.startup_timeout):
+        print(json.dumps({"error": "Startup failed", **server.startup.status()}), file=sys.stderr)
+        return 1
+
+    # The queue only holds this run's own questions, so answers are not shortened for queue pressure
+    controller = GenerationController(max_new_tokens=LLM_MAX_NEW_TOKENS, stop_sequences=LLM_STOP_SEQUENCES,
+                                      repeats=LLM_REPETITION_REPEATS)
+    answerer = BatchAnswerer(server.retriever, server.scheduler, server.PROMPT, packer=server.context_packer,
+                             reranker=server.reranker, controller=controller, batch_size=args.batch_size,
+                             max_in_flight=args.max_in_flight or server.scheduler.num_workers * 2)
+    try:
+        summary = run_batch(answerer, args.input, args.output, sync_every=args.sync_every)
+    except KeyboardInterrupt:
+        print(f"Interrupted; rerun the same command to resume from {args.output}", file=sys.stderr)
+        return 130
+
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
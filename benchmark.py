@@ -0,0 +1,481 @@
+"""
+Benchmark harness for the retrieval and generation path.
+
+Builds a throw-away local vector index, replays a question set through the same
+stages the server uses (batched retrieval, prompt assembly, model workers) and
+writes the results as JSON:
+
+    python benchmark.py --output bench_results.json
+    python benchmark.py --embeddings real --llm savemodel/llama-2-7b-chat.ggmlv3.q4_0.bin --data-dir data/
+    python benchmark.py --retrieval-k 4 --chunk-size 800 --baseline bench_results.json
+
+With `--baseline` the run is compared against an earlier result file and the
+script exits with status 1 when a tracked metric regressed by more than
+`--tolerance`.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.prompts import PromptTemplate
+
+from src.batching import RetrievalBatcher
+from src.context_packer import ContextPacker
+from src.embedding_pipeline import EmbeddingPipeline
+from src.generation import iter_tokens
+from src.generation_control import GenerationController
+from src.helper import build_prompt, text_split, download_hugging_face_embeddings
+from src.inference_scheduler import InferenceScheduler, ModelWorker
+from src.ingestion import incremental_ingest
+from src.lexical_index import BM25Index
+from src.metrics import (EMBEDDING_SECONDS, VECTOR_SEARCH_SECONDS, LEXICAL_SEARCH_SECONDS, PROMPT_BUILD_SECONDS,
+                         CONTEXT_TOKENS, QUEUE_WAIT_SECONDS, PROMPT_EVAL_SECONDS, TOKEN_DECODE_SECONDS,
+                         GENERATION_SECONDS, PROMPT_TOKENS, DRAFT_TOKENS, GENERATION_STOPS, TOKENS_SAVED)
+from src.prefix_cache import PrefixCachingLLM
+from src.continuous_batching import ContinuousBatchingLLM
+from src.speculative import DraftModel
+from src.prompt import prompt_template, prompt_prefix
+from src.vector_store import LocalVectorStore
+from medicalbot.constants import (VECTOR_STORE_DIMENSION, RETRIEVAL_K, CONTEXT_TOKEN_BUDGET, LLM_STOP_SEQUENCES,
+                                  LLM_REPETITION_REPEATS)
+
+
+DEFAULT_QUESTIONS = [
+    "What are the common symptoms of diabetes?",
+    "How is hypertension treated?",
+    "What causes migraine headaches?",
+    "What are the side effects of aspirin?",
+    "How can I tell if a burn needs medical attention?",
+    "What is the difference between a virus and a bacterial infection?",
+    "What are the early signs of a heart attack?",
+    "How is asthma diagnosed?",
+    "What foods should be avoided with gout?",
+    "When is a fever dangerous in adults?",
+    "What are the risk factors for osteoporosis?",
+    "How long does it take to recover from pneumonia?",
+]
+
+SYNTHETIC_TOPICS = ["diabetes", "hypertension", "asthma", "migraine", "pneumonia", "gout", "anemia", "arthritis",
+                    "influenza", "osteoporosis", "eczema", "hepatitis"]
+SYNTHETIC_ASPECTS = ["symptoms", "causes", "diagnosis", "treatment", "prevention", "complications", "risk factors",
+                     "prognosis"]
+
+# Regression checks against a baseline: (section, metric, True when higher is better)
+TRACKED_METRICS = [
+    ("ingestion", "chunks_per_sec", True),
+    ("retrieval", "qps", True),
+    ("retrieval", "p95_seconds", False),
+    ("end_to_end", "p50_seconds", False),
+    ("end_to_end", "p95_seconds", False),
+    ("end_to_end", "p99_seconds", False),
+    ("end_to_end", "tokens_per_sec", True),
+]
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic bag-of-words hashing embeddings; no model download, stable across runs."""
+
+    def __init__(self, dimension=VECTOR_STORE_DIMENSION):
+        self.dimension = dimension
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16) % self.dimension] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class FakeLLM:
+    """
+    Stand-in for the CTransformers LLM with a fixed cost model: `prompt_ms` per
+    100 prompt words for prompt eval, then `token_ms` per generated token.
+    """
+
+    def __init__(self, max_new_tokens=64, prompt_ms=20.0, token_ms=5.0):
+        self.max_new_tokens = max_new_tokens
+        self.prompt_ms = prompt_ms
+        self.token_ms = token_ms
+
+    def client(self, prompt, stream=False, **kwargs):
+        def tokens():
+            time.sleep(self.prompt_ms / 1000 * len(prompt.split()) / 100)
+            for i in range(kwargs.get("max_new_tokens") or self.max_new_tokens):
+                time.sleep(self.token_ms / 1000)
+                yield f" token{i}" if i else "Answer"
+        return tokens() if stream else "".join(tokens())
+
+    def invoke(self, prompt):
+        return self.client(prompt)
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {}
+    values = np.asarray(latencies)
+    return {
+        "p50_seconds": round(float(np.percentile(values, 50)), 4),
+        "p95_seconds": round(float(np.percentile(values, 95)), 4),
+        "p99_seconds": round(float(np.percentile(values, 99)), 4),
+        "mean_seconds": round(float(values.mean()), 4),
+        "max_seconds": round(float(values.max()), 4),
+    }
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)  # Windows
+    except (ImportError, AttributeError):
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def load_questions(path):
+    if path is None:
+        return DEFAULT_QUESTIONS
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if path.endswith(".jsonl"):
+        return [json.loads(line)["question"] for line in lines]
+    return lines
+
+
+def synthetic_documents(count, seed=0):
+    rng = random.Random(seed)
+    documents = []
+    for i in range(count):
+        topic, aspect = rng.choice(SYNTHETIC_TOPICS), rng.choice(SYNTHETIC_ASPECTS)
+        sentences = [f"The {aspect} of {topic} vary between patients and depend on age and general health."
+                     for _ in range(rng.randint(3, 8))]
+        sentences.append(f"A doctor should be consulted about the {aspect} of {topic} when in doubt. Reference {i}.")
+        documents.append(Document(page_content=" ".join(sentences),
+                                  metadata={"source": f"synthetic/{topic}.pdf", "page": i}))
+    return documents
+
+
+def run_in_threads(items, concurrency, fn):
+    """Calls fn(item) from `concurrency` threads; returns the per-item latencies and the wall time."""
+    latencies = []
+    lock = threading.Lock()
+    queue = list(reversed(items))
+
+    def work():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                item = queue.pop()
+            start = time.perf_counter()
+            fn(item)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+
+def benchmark_ingestion(args, embeddings, index_dir):
+    store = LocalVectorStore(embedding=embeddings, path=index_dir, dimension=VECTOR_STORE_DIMENSION,
+                             index_type=args.index_type)
+    pipeline = EmbeddingPipeline(embeddings=embeddings, batch_size=args.embedding_batch_size,
+                                 max_workers=args.embedding_workers)
+    lexical_index = None if args.dense_only else BM25Index(os.path.join(index_dir, "bm25_index"))
+
+    start = time.perf_counter()
+    if args.data_dir:
+        summary = incremental_ingest(data_dir=args.data_dir, vector_store=store,
+                                     manifest_path=os.path.join(index_dir, "ingest_manifest.json"),
+                                     persist=store.save, max_workers=args.pdf_workers, embedding_pipeline=pipeline,
+                                     chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                                     lexical_index=lexical_index)
+        chunks = summary["chunks_added"]
+    else:
+        documents = text_split(synthetic_documents(args.synthetic_documents), chunk_size=args.chunk_size,
+                               chunk_overlap=args.chunk_overlap)
+        chunks = pipeline.run(documents, store)["chunks"]
+        store.save()
+        if lexical_index is not None:
+            lexical_index.add_documents(documents, ids=[str(i) for i in range(len(documents))])
+            lexical_index.save()
+    elapsed = time.perf_counter() - start
+
+    return store, lexical_index, {
+        "source": args.data_dir or f"synthetic:{args.synthetic_documents}",
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(chunks / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def benchmark_retrieval(args, embeddings, store, lexical_index, questions):
+    batcher = RetrievalBatcher(embeddings=embeddings, vector_store=store, k=args.retrieval_k,
+                               max_batch_size=args.retrieval_batch_size, max_wait_ms=args.retrieval_wait_ms,
+                               lexical_index=lexical_index)
+    latencies, wall = run_in_threads(questions * args.repeat, args.concurrency, batcher.invoke)
+    return batcher, {
+        "queries": len(latencies),
+        "concurrency": args.concurrency,
+        "seconds": round(wall, 3),
+        "qps": round(len(latencies) / wall, 1) if wall > 0 else 0.0,
+        **percentiles(latencies),
+        **batcher.stats(),
+    }
+
+
+def create_worker(args):
+    if args.llm == "fake":
+        return ModelWorker(llm=FakeLLM(args.max_new_tokens, args.fake_prompt_ms, args.fake_token_ms), version="fake")
+
+    if args.llm_backend == "llama_cpp" and args.batch_sequences > 1:
+        llm = ContinuousBatchingLLM.load(args.llm, max_sequences=args.batch_sequences, threads=args.llm_threads,
+                                         batch_size=args.llm_batch_size, max_new_tokens=args.max_new_tokens)
+        llm.warm(prompt_prefix)
+        return ModelWorker(llm=llm, version=os.path.basename(args.llm))
+
+    if args.llm_backend == "llama_cpp":
+        draft = None
+        if args.draft_model:
+            draft = DraftModel.load(args.draft_model, threads=args.llm_threads, batch_size=args.llm_batch_size,
+                                    draft_tokens=args.draft_tokens)
+        llm = PrefixCachingLLM.load(args.llm, prefix=prompt_prefix, threads=args.llm_threads,
+                                    batch_size=args.llm_batch_size, max_new_tokens=args.max_new_tokens, draft=draft)
+        llm.warm()
+        return ModelWorker(llm=llm, version=os.path.basename(args.llm))
+
+    from langchain_community.llms import CTransformers
+    llm = CTransformers(model=args.llm, model_type="llama",
+                        config={"max_new_tokens": args.max_new_tokens, "temperature": 0.8, "threads": args.llm_threads,
+                                "batch_size": args.llm_batch_size, "mmap": True})
+    return ModelWorker(llm=llm, version=os.path.basename(args.llm))
+
+
+def benchmark_end_to_end(args, retriever, questions):
+    prompt = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
+    packer = ContextPacker(token_budget=args.context_tokens) if args.context_tokens else None
+    # With continuous batching one model serves --batch-sequences scheduler workers
+    slots = args.batch_sequences if args.llm != "fake" and args.llm_backend == "llama_cpp" else 1
+    lock, models, calls = threading.Lock(), {}, iter(range(args.llm_workers * slots))
+
+    def worker_factory():
+        with lock:
+            model = next(calls) // slots
+            if model not in models:
+                models[model] = create_worker(args)
+            return models[model]
+
+    scheduler = InferenceScheduler(worker_factory=worker_factory, num_workers=args.llm_workers * slots,
+                                   max_queue=max(args.concurrency, 1) * 2)
+    controller = None
+    if not args.no_generation_control:
+        controller = GenerationController(max_new_tokens=args.max_new_tokens, min_new_tokens=args.min_new_tokens,
+                                          stop_sequences=LLM_STOP_SEQUENCES, repeats=LLM_REPETITION_REPEATS,
+                                          pressure=scheduler.pressure)
+    load_start = time.perf_counter()
+    scheduler.wait_until_ready()
+    load_seconds = time.perf_counter() - load_start
+
+    tokens = []
+    first_token_seconds = []
+    lock = threading.Lock()
+
+    def answer(question):
+        start = time.perf_counter()
+        docs = retriever.invoke(question)
+        with PROMPT_BUILD_SECONDS.time():
+            final_prompt = build_prompt(question, docs, prompt, packer=packer)
+
+        def generate(worker):
+            count, first = 0, None
+            for _ in iter_tokens(worker.llm, final_prompt, controller=controller):
+                if count == 0:
+                    first = time.perf_counter() - start
+                count += 1
+            return count, first
+
+        count, first = scheduler.submit(generate).result()
+        with lock:
+            tokens.append(count)
+            if first is not None:
+                first_token_seconds.append(first)
+
+    latencies, wall = run_in_threads(questions * args.repeat, args.concurrency, answer)
+    scheduler.shutdown()
+
+    return {
+        "requests": len(latencies),
+        "concurrency": args.concurrency,
+        "model_load_seconds": round(load_seconds, 3),
+        "seconds": round(wall, 3),
+        "requests_per_sec": round(len(latencies) / wall, 3) if wall > 0 else 0.0,
+        "tokens": int(sum(tokens)),
+        "tokens_per_sec": round(sum(tokens) / wall, 1) if wall > 0 else 0.0,
+        "time_to_first_token": percentiles(first_token_seconds),
+        **percentiles(latencies),
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    regressions = []
+    for section, metric, higher_is_better in TRACKED_METRICS:
+        current = results.get(section, {}).get(metric)
+        previous = baseline.get(section, {}).get(metric)
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append({"metric": f"{section}.{metric}", "baseline": previous, "current": current,
+                                "change": round(change, 3)})
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, retrieval and end-to-end answering.")
+    parser.add_argument("--questions", help="Question file: one question per line, or .jsonl with a 'question' field")
+    parser.add_argument("--repeat", type=int, default=3, help="Times the question set is replayed")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent clients")
+    parser.add_argument("--embeddings", choices=("fake", "real"), default="fake",
+                        help="'fake' uses hashing embeddings, 'real' the sentence-transformers model")
+    parser.add_argument("--llm", default="fake", help="'fake' or the path of a GGML model file")
+    parser.add_argument("--llm-backend", choices=("ctransformers", "llama_cpp"), default="ctransformers")
+    parser.add_argument("--batch-sequences", type=int, default=1,
+                        help="Requests decoded together per model (llama_cpp backend, continuous batching)")
+    parser.add_argument("--draft-model", help="Small GGUF model for speculative decoding (llama_cpp backend)")
+    parser.add_argument("--draft-tokens", type=int, default=4, help="Tokens the draft model proposes per pass")
+    parser.add_argument("--data-dir", help="Ingest the PDFs of this folder instead of a synthetic corpus")
+    parser.add_argument("--synthetic-documents", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--chunk-overlap", type=int, default=20)
+    parser.add_argument("--index-type", choices=("exact", "hnsw"), default="exact")
+    parser.add_argument("--pdf-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--embedding-batch-size", type=int, default=64)
+    parser.add_argument("--embedding-workers", type=int, default=2)
+    parser.add_argument("--retrieval-k", type=int, default=RETRIEVAL_K)
+    parser.add_argument("--dense-only", action="store_true", help="Skip the BM25 side of hybrid retrieval")
+    parser.add_argument("--retrieval-batch-size", type=int, default=16)
+    parser.add_argument("--retrieval-wait-ms", type=float, default=10)
+    parser.add_argument("--context-tokens", type=int, default=CONTEXT_TOKEN_BUDGET,
+                        help="Context token budget of the prompt packer, 0 stuffs every retrieved chunk")
+    parser.add_argument("--llm-workers", type=int, default=1)
+    parser.add_argument("--llm-threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--llm-batch-size", type=int, default=256)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--min-new-tokens", type=int, default=16, help="Token cap when the request queue is full")
+    parser.add_argument("--no-generation-control", action="store_true",
+                        help="Generate to --max-new-tokens without stop sequences, repetition or load-based caps")
+    parser.add_argument("--fake-prompt-ms", type=float, default=20.0, help="Fake LLM prompt eval cost per 100 words")
+    parser.add_argument("--fake-token-ms", type=float, default=5.0, help="Fake LLM decode cost per token")
+    parser.add_argument("--skip-generation", action="store_true", help="Only benchmark ingestion and retrieval")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    questions = load_questions(args.questions)
+
+    if args.embeddings == "real":
+        embeddings = download_hugging_face_embeddings(batch_size=args.embedding_batch_size)
+    else:
+        embeddings = HashEmbeddings()
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "platform": {"python": platform.python_version(), "system": platform.system(), "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="medicalbot-bench-") as index_dir:
+        print("Benchmarking ingestion ...")
+        store, lexical_index, results["ingestion"] = benchmark_ingestion(args, embeddings, index_dir)
+        print(f"  {results['ingestion']}")
+
+        print("Benchmarking retrieval ...")
+        retriever, results["retrieval"] = benchmark_retrieval(args, embeddings, store, lexical_index, questions)
+        print(f"  {results['retrieval']}")
+
+        if not args.skip_generation:
+            print("Benchmarking end-to-end answering ...")
+            results["end_to_end"] = benchmark_end_to_end(args, retriever, questions)
+            print(f"  {results['end_to_end']}")
+
+    results["stages"] = {
+        "embedding_batch": EMBEDDING_SECONDS.summary(),
+        "vector_search_batch": VECTOR_SEARCH_SECONDS.summary(),
+        "lexical_search": LEXICAL_SEARCH_SECONDS.summary(),
+        "prompt_build": PROMPT_BUILD_SECONDS.summary(),
+        "context_tokens": CONTEXT_TOKENS.summary(),
+        "queue_wait": QUEUE_WAIT_SECONDS.summary(),
+        "prompt_eval": PROMPT_EVAL_SECONDS.summary(),
+        "token_decode": TOKEN_DECODE_SECONDS.summary(),
+        "generation": GENERATION_SECONDS.summary(),
+        "prompt_tokens": {source: int(PROMPT_TOKENS.value(source=source)) for source in ("reused", "evaluated")},
+        "draft_tokens": {outcome: int(DRAFT_TOKENS.value(outcome=outcome)) for outcome in ("accepted", "rejected")},
+        "generation_stops": {reason: int(GENERATION_STOPS.value(reason=reason))
+                             for reason in ("eos", "stop_sequence", "repetition", "max_tokens")},
+        "tokens_saved": {reason: int(TOKENS_SAVED.value(reason=reason))
+                         for reason in ("stop_sequence", "repetition", "token_cap")},
+    }
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        results["regressions"] = compare_with_baseline(results, baseline, args.tolerance)
+        for regression in results["regressions"]:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']} -> {regression['current']} "
+                  f"({regression['change']:+.1%})")
+        exit_code = 1 if results["regressions"] else 0
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output} (peak RSS {results['peak_rss_mb']} MB)")
+    return exit_code
+
+
+# The guard keeps worker processes of the parallel PDF extraction from re-running the benchmark.
+if __name__ == "__main__":
+    sys.exit(main())
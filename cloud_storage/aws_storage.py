@@ -11,6 +11,11 @@ from pandas import DataFrame
 from langchain_community.llms import CTransformers
 from io import BytesIO
 import tempfile
+from cloud_storage.s3_transfer import S3ParallelDownloader, S3ParallelUploader, sha256_file, MB
+from cloud_storage.model_manifest import manifest_key, build_model_manifest, read_model_manifest
+import json
+from cloud_storage.model_cache import ModelCache
+from medicalbot.constants import SAVE_MODEL_DIR, S3_TRANSFER_MAX_CONCURRENCY, S3_TRANSFER_PART_SIZE_MB, MODEL_CACHE_MAX_GB
 
 
 
@@ -25,12 +30,16 @@ class SimpleStorageService:
 
     def s3_key_path_available(self,bucket_name,s3_key)->bool:
         try:
-            bucket = self.get_bucket(bucket_name)
-            file_objects = [file_object for file_object in bucket.objects.filter(Prefix=s3_key)]
-            if len(file_objects) > 0:
-                return True
-            else:
-                return False
+            # A single HEAD request for an object key instead of listing the prefix
+            self.s3_client.head_object(Bucket=bucket_name, Key=s3_key)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                raise MedicalException(e,sys)
+        try:
+            # Not an object, it may still be a "folder" prefix
+            response = self.s3_client.list_objects_v2(Bucket=bucket_name, Prefix=s3_key, MaxKeys=1)
+            return response.get("KeyCount", 0) > 0
         except Exception as e:
             raise MedicalException(e,sys)
             
@@ -38,11 +47,11 @@ class SimpleStorageService:
         logging.info("Entering read_object method to read model data.")
         try:
             response = file_object.get()
-            logging.debug(f"S3 Response: {response}")  # Log the full response for debugging
+            logging.debug("S3 response: %s bytes, ETag %s", response.get("ContentLength"), response.get("ETag"))
             
             # Read the body of the response
             model_data = response['Body'].read()  # This reads the binary data
-            logging.debug(f"Read {len(model_data)} bytes from the model data.")
+            logging.debug("Read %d bytes from the model data.", len(model_data))
             
             if decode:
                 return model_data.decode('utf-8')  # If you need to decode
@@ -91,8 +100,8 @@ class SimpleStorageService:
 
         Output      :   The loaded model object
         On Failure  :   Write an exception log and then raise an exception
-        Version     :   1.4
-        Revisions   :   Saving model directly with the same name as from S3.
+        Version     :   1.6
+        Revisions   :   Serving the model from the local model cache, downloading only when it changed in S3.
         """
         logging.info("Entered the load_model method of SimpleStorageService class")
 
@@ -110,31 +119,8 @@ class SimpleStorageService:
             file_object = self.get_file_object(model_file, bucket_name)
             logging.info("File object retrieved successfully: %s", file_object)
 
-            # Read the binary content directly from the file object
-            logging.info("Entering read_object method to read model data.")
-            model_data = self.read_object(file_object, decode=False)
-
-            if model_data is None:
-                logging.error("Model data is None after reading from S3.")
-                raise MedicalException("Model data could not be read from S3.", sys)
-
-            logging.info("Successfully read model data from S3.")
-            
-            # Get the current working directory and define the 'savemodel' folder
-            current_directory = os.getcwd()
-            save_model_folder = os.path.join(current_directory, "savemodel")
-
-            # Create the folder if it doesn't exist
-            if not os.path.exists(save_model_folder):
-                os.makedirs(save_model_folder)
-                logging.info(f"Created directory: {save_model_folder}")
-
-            # Save the model data in the 'savemodel' folder using the original model name
-            model_save_path = os.path.join(save_model_folder, model_name)
-
-            # Save the model data to the 'savemodel' folder with the original file name
-            with open(model_save_path, "wb") as model_file:
-                model_file.write(model_data)
+            # Reuse the cached copy when it is still current, otherwise download it into the cache
+            model_save_path = self.get_model_cache().fetch(bucket_name, file_object.key)
 
             logging.info(f"Model saved at: {model_save_path}")
 
@@ -151,35 +137,44 @@ class SimpleStorageService:
             raise MedicalException(e, sys) from e
 
 
+    def get_downloader(self) -> S3ParallelDownloader:
+        return S3ParallelDownloader(
+            self.s3_client,
+            max_concurrency=S3_TRANSFER_MAX_CONCURRENCY,
+            part_size=S3_TRANSFER_PART_SIZE_MB * MB,
+        )
+
+    def get_uploader(self) -> S3ParallelUploader:
+        return S3ParallelUploader(
+            self.s3_client,
+            max_concurrency=S3_TRANSFER_MAX_CONCURRENCY,
+            part_size=S3_TRANSFER_PART_SIZE_MB * MB,
+        )
+
+    def get_model_cache(self) -> ModelCache:
+        return ModelCache.shared(
+            SAVE_MODEL_DIR,
+            s3_client=self.s3_client,
+            downloader=self.get_downloader(),
+            max_bytes=int(MODEL_CACHE_MAX_GB * 1024 * MB),
+        )
+
     def download_model_from_s3(self, s3_bucket, s3_key):
-        """Downloads a model from an S3 bucket and saves it locally with its original name.
+        """Returns a local copy of a model stored in an S3 bucket.
+
+        The model is served from the content-addressed model cache when its
+        ETag still matches S3 (a single HEAD request). Otherwise it is
+        fetched in parallel ranged parts, verified and added to the cache,
+        evicting the least recently used versions beyond the disk budget.
         
         Args:
             s3_bucket: The name of the S3 bucket.
             s3_key: The S3 key of the model file (including its name).
         """
-        # Create an S3 client
-        s3 = boto3.client('s3')
-        logging.info(f"connection to s3 bucket done successfully")
-
-        # Specify the local directory
-        local_directory = "savemodel"
-
-        # Ensure the local directory exists; create it if it doesn't
-        os.makedirs(local_directory, exist_ok=True)
-
-        # Extract the filename from the S3 key
-        file_name = os.path.basename(s3_key)
+        local_file_path = self.get_model_cache().fetch(s3_bucket, s3_key)
+        logging.info(f"Model available at: {local_file_path}")
 
-        # Construct the full local path
-        local_file_path = os.path.join(local_directory, file_name)
-        logging.info(f"local folder path created : {local_file_path}")
-
-        # Download the model from S3 directly
-        s3.download_file(s3_bucket, s3_key, local_file_path)
-        logging.info(f"Model downloaded and saved as: {local_file_path}")
-
-        print(f"Model downloaded and saved as: {local_file_path}")
+        print(f"Model available at: {local_file_path}")
         
         return local_file_path
 
@@ -224,6 +219,64 @@ class SimpleStorageService:
             raise MedicalException(e, sys) from e
    
     
+    def read_model_manifest(self, bucket_name: str, s3_key: str) -> Union[dict, None]:
+        """
+        Method Name :   read_model_manifest
+        Description :   This method reads the JSON manifest stored next to the s3_key model
+
+        Output      :   The manifest as a dict, or None when the model has no manifest
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            return read_model_manifest(self.s3_client, bucket_name, s3_key)
+        except ClientError as e:
+            raise MedicalException(e, sys) from e
+
+    def upload_model(self, from_filename: str, to_filename: str, bucket_name: str, remove: bool = False) -> dict:
+        """
+        Method Name :   upload_model
+        Description :   This method uploads a model file with parallel checksummed multipart requests
+                        and writes a manifest (sha256, size, quantization, timestamp) next to it.
+                        The upload is skipped when S3 already holds the same content.
+
+        Output      :   The manifest of the model in S3
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        logging.info("Entered the upload_model method of SimpleStorageService class")
+
+        try:
+            sha256 = sha256_file(from_filename)
+
+            uploaded = False
+            manifest = self.read_model_manifest(bucket_name, to_filename)
+            if manifest is not None and manifest.get("sha256") == sha256:
+                head = self.s3_client.head_object(Bucket=bucket_name, Key=to_filename)
+                if head["ETag"] == manifest.get("etag") and head["ContentLength"] == manifest.get("size"):
+                    logging.info(f"{to_filename} in {bucket_name} already has sha256 {sha256}, skipping the upload")
+                    uploaded = True
+
+            if not uploaded:
+                upload = self.get_uploader().upload(from_filename, bucket_name, to_filename)
+                manifest = build_model_manifest(from_filename, to_filename, sha256, upload)
+                self.s3_client.put_object(
+                    Bucket=bucket_name,
+                    Key=manifest_key(to_filename),
+                    Body=json.dumps(manifest, indent=2).encode("utf-8"),
+                    ContentType="application/json",
+                )
+                logging.info(f"Uploaded {from_filename} to {to_filename} in {bucket_name} bucket with manifest: {manifest}")
+
+            if remove is True:
+                os.remove(from_filename)
+                logging.info(f"Remove is set to {remove}, deleted the file")
+
+            logging.info("Exited the upload_model method of SimpleStorageService class")
+            return manifest
+
+        except Exception as e:
+            raise MedicalException(e, sys) from e
+   
+    
     def create_folder(self, folder_name: str, bucket_name: str) -> None:
         """
         Method Name :   create_folder
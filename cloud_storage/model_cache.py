@@ -0,0 +1,252 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from logger import logging
+from medicalbot.exception import MedicalException
+from cloud_storage.model_manifest import read_model_manifest
+from cloud_storage.s3_transfer import S3ParallelDownloader, etag_for_file, sha256_file
+
+
+INDEX_FILE = "index.json"
+BLOBS_DIR = "blobs"
+INCOMING_DIR = ".incoming"
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class ModelCache:
+    """
+    Content-addressed local cache of model files downloaded from S3.
+
+    Every artifact is stored once under `blobs/<sha256>/<file name>`; each
+    S3 object version pointing to it is described in `index.json` (bucket,
+    S3 key, ETag, size, last used). A cached copy is validated with a HEAD
+    request against the ETag instead of being downloaded again; when S3
+    cannot be reached the newest cached copy is served. Older versions stay on disk for rollback until the cache
+    exceeds `max_bytes`, then the least recently used ones are evicted.
+    """
+
+    def __init__(self, cache_dir: str, s3_client=None, downloader: S3ParallelDownloader = None,
+                 max_bytes: int = None):
+        self.cache_dir = cache_dir
+        self.s3_client = s3_client
+        self.downloader = downloader or (S3ParallelDownloader(s3_client) if s3_client is not None else None)
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, INDEX_FILE)
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(cache_dir, BLOBS_DIR), exist_ok=True)
+        self._entries = self._load_index()
+
+    @classmethod
+    def shared(cls, cache_dir: str, s3_client=None, downloader: S3ParallelDownloader = None,
+               max_bytes: int = None) -> "ModelCache":
+        """
+        The one cache instance of the process for `cache_dir`. Instances do not see
+        each other's index changes or locks, so a directory must have only one.
+        """
+        cache_dir = os.path.abspath(cache_dir)
+        with _shared_lock:
+            cache = _shared.get(cache_dir)
+            if cache is None:
+                cache = _shared[cache_dir] = cls(cache_dir, s3_client=s3_client, downloader=downloader,
+                                                 max_bytes=max_bytes)
+            elif cache.s3_client is None and s3_client is not None:
+                # Created offline first, S3 is available now
+                cache.s3_client = s3_client
+                cache.downloader = downloader or S3ParallelDownloader(s3_client)
+            return cache
+
+    def _load_index(self) -> dict:
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path) as f:
+                entries = json.load(f).get("entries", {})
+        except ValueError:
+            logging.info(f"Model cache index {self.index_path} is unreadable, starting with an empty index")
+            return {}
+        # Drop entries whose blob was removed by hand
+        return {entry_id: entry for entry_id, entry in entries.items() if os.path.exists(self._blob_path(entry))}
+
+    def _save_index(self) -> None:
+        # A unique temporary file, so two writers never interleave into the same one
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{INDEX_FILE}.", suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"entries": self._entries}, f, indent=2)
+            os.replace(tmp_path, self.index_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _blob_path(self, entry: dict) -> str:
+        return os.path.join(self.cache_dir, BLOBS_DIR, entry["sha256"], entry["file_name"])
+
+    @staticmethod
+    def _entry_id(bucket_name: str, s3_key: str, etag: str) -> str:
+        return f"{bucket_name}/{s3_key}@" + etag.strip('"')
+
+    def _find(self, bucket_name: str, s3_key: str, etag: str = None) -> dict:
+        """Most recently downloaded entry for the key, optionally with a given ETag."""
+        matches = [entry for entry in self._entries.values()
+                   if entry["bucket"] == bucket_name and entry["s3_key"] == s3_key
+                   and (etag is None or entry["etag"] == etag)]
+        return max(matches, key=lambda entry: entry["downloaded_at"], default=None)
+
+    def _touch(self, entry: dict) -> str:
+        entry["last_used"] = time.time()
+        self._save_index()
+        return self._blob_path(entry)
+
+    def _add(self, local_path: str, bucket_name: str, s3_key: str, etag: str) -> dict:
+        """Moves a verified download into the content-addressed store."""
+        sha256 = sha256_file(local_path)
+        # A blob keeps the file name it was first stored with, other keys with the same content share it
+        shared = next((entry for entry in self._entries.values() if entry["sha256"] == sha256), None)
+        file_name = shared["file_name"] if shared is not None else os.path.basename(s3_key)
+        entry = {
+            "sha256": sha256,
+            "file_name": file_name,
+            "size": os.path.getsize(local_path),
+            "bucket": bucket_name,
+            "s3_key": s3_key,
+            "etag": etag,
+            "downloaded_at": time.time(),
+            "last_used": time.time(),
+        }
+        blob_path = self._blob_path(entry)
+        if os.path.exists(blob_path):
+            logging.info(f"Content of {s3_key} is already cached as {sha256}")
+            os.remove(local_path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(local_path, blob_path)
+        self._entries[self._entry_id(bucket_name, s3_key, etag)] = entry
+        self._save_index()
+        return entry
+
+    def _adopt_legacy_file(self, bucket_name: str, s3_key: str, etag: str, size: int) -> dict:
+        """
+        Imports a model downloaded before the cache existed (`<cache_dir>/<file name>`)
+        when it matches the remote object, so it is not fetched again.
+        """
+        legacy_path = os.path.join(self.cache_dir, os.path.basename(s3_key))
+        if not os.path.isfile(legacy_path) or os.path.getsize(legacy_path) != size:
+            return None
+        if etag_for_file(legacy_path, etag) != etag.strip('"'):
+            return None
+        logging.info(f"Adopting previously downloaded {legacy_path} into the model cache")
+        return self._add(legacy_path, bucket_name, s3_key, etag)
+
+    def total_bytes(self) -> int:
+        return sum({entry["sha256"]: entry["size"] for entry in self._entries.values()}.values())
+
+    def evict(self, reserve_bytes: int = 0, pinned: tuple = ()) -> list:
+        """
+        Removes least recently used artifacts until the cache plus `reserve_bytes`
+        fits into `max_bytes`. Artifacts whose sha256 is in `pinned` are never removed.
+        """
+        if self.max_bytes is None:
+            return []
+        # An artifact was last used when any of the S3 objects sharing it was
+        last_used = {}
+        for entry in self._entries.values():
+            last_used[entry["sha256"]] = max(last_used.get(entry["sha256"], 0), entry["last_used"])
+
+        evicted = []
+        for sha256 in sorted((sha for sha in last_used if sha not in pinned), key=last_used.get):
+            if self.total_bytes() + reserve_bytes <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.cache_dir, BLOBS_DIR, sha256), ignore_errors=True)
+            for entry_id in [entry_id for entry_id, entry in self._entries.items() if entry["sha256"] == sha256]:
+                entry = self._entries.pop(entry_id)
+                logging.info(f"Evicted cached model {entry['s3_key']} ({sha256[:12]}, {entry['size']} bytes)")
+            evicted.append(sha256)
+        if evicted:
+            self._save_index()
+        if self.total_bytes() + reserve_bytes > self.max_bytes:
+            logging.info(f"Model cache needs {self.total_bytes() + reserve_bytes} bytes, "
+                         f"over its budget of {self.max_bytes} bytes")
+        return evicted
+
+    def cached_path(self, bucket_name: str, s3_key: str) -> str:
+        """Path of the newest cached version of the key without contacting S3, or None."""
+        with self._lock:
+            entry = self._find(bucket_name, s3_key)
+            return self._touch(entry) if entry is not None else None
+
+    def last_used_path(self, bucket_name: str, key_prefix: str) -> tuple:
+        """(S3 key, path) of the cached object under `key_prefix` that was served last, without contacting S3."""
+        with self._lock:
+            matches = [entry for entry in self._entries.values()
+                       if entry["bucket"] == bucket_name and entry["s3_key"].startswith(key_prefix)]
+            entry = max(matches, key=lambda entry: entry["last_used"], default=None)
+            if entry is None:
+                return None, None
+            return entry["s3_key"], self._touch(entry)
+
+    def fetch(self, bucket_name: str, s3_key: str, pinned: tuple = ()) -> str:
+        """
+        Method Name :   fetch
+        Description :   Returns the local path of s3_key, reusing the cached copy when its ETag
+                        still matches the object in S3 and downloading it otherwise. Artifacts
+                        whose sha256 is in `pinned` are not evicted to make room for the download
+
+        Output      :   Path of the cached model file
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        logging.info("Entered the fetch method of ModelCache class")
+        try:
+            with self._lock:
+                try:
+                    head = self.s3_client.head_object(Bucket=bucket_name, Key=s3_key)
+                except Exception as e:
+                    entry = self._find(bucket_name, s3_key)
+                    if entry is None:
+                        raise
+                    logging.info(f"Could not check {s3_key} in S3 ({str(e)}), using the cached copy")
+                    return self._touch(entry)
+
+                etag, size = head["ETag"], head["ContentLength"]
+                entry = self._find(bucket_name, s3_key, etag) or self._adopt_legacy_file(bucket_name, s3_key, etag, size)
+                if entry is not None:
+                    logging.info(f"Cached model {s3_key} is up to date ({entry['sha256'][:12]})")
+                    return self._touch(entry)
+
+                logging.info(f"Model {s3_key} is not cached or has changed, downloading {size} bytes")
+                self.evict(reserve_bytes=size, pinned=tuple(pinned))
+                # A manifest written for this very object gives the sha256 to verify the download with
+                manifest = read_model_manifest(self.s3_client, bucket_name, s3_key)
+                if manifest is None or manifest.get("etag") != etag:
+                    manifest = {}
+                incoming_path = os.path.join(self.cache_dir, INCOMING_DIR, os.path.basename(s3_key))
+                self.downloader.download(bucket_name, s3_key, incoming_path,
+                                         sha256=manifest.get("sha256"), part_size=manifest.get("part_size"))
+                entry = self._add(incoming_path, bucket_name, s3_key, etag)
+                self.evict(pinned=(entry["sha256"], *pinned))
+
+                logging.info("Exited the fetch method of ModelCache class")
+                return self._blob_path(entry)
+
+        except Exception as e:
+            raise MedicalException(e, sys) from e
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "artifacts": len({entry["sha256"] for entry in self._entries.values()}),
+                "total_bytes": self.total_bytes(),
+                "max_bytes": self.max_bytes,
+                "models": sorted(
+                    ({key: entry[key] for key in ("s3_key", "etag", "size", "sha256", "last_used")}
+                     for entry in self._entries.values()),
+                    key=lambda entry: entry["last_used"], reverse=True),
+            }
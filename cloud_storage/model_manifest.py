@@ -0,0 +1,50 @@
+import json
+import os
+import re
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+# GGML/GGUF quantization tags as they appear in model file names, e.g. llama-2-7b-chat.ggmlv3.q4_0.bin
+QUANTIZATION_PATTERN = re.compile(r"(?<![a-z0-9])(q\d_k(?:_[sml])?|q\d_\d|q\d|f16|f32)(?![a-z0-9])", re.IGNORECASE)
+
+
+def manifest_key(s3_key: str) -> str:
+    return f"{s3_key}{MANIFEST_SUFFIX}"
+
+
+def read_model_manifest(s3_client, bucket_name: str, s3_key: str) -> dict:
+    """The manifest stored next to s3_key, or None when the model has none."""
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=manifest_key(s3_key))
+        return json.loads(response["Body"].read())
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+
+
+def quantization_from_file_name(file_name: str) -> str:
+    match = QUANTIZATION_PATTERN.search(os.path.basename(file_name))
+    return match.group(1).lower() if match else None
+
+
+def build_model_manifest(from_filename: str, s3_key: str, sha256: str, upload: dict) -> dict:
+    """
+    Describes a pushed model artifact; stored next to it as `<s3_key>.manifest.json`
+    so consumers can verify a download without trusting the multipart ETag.
+    """
+    return {
+        "file_name": os.path.basename(from_filename),
+        "s3_key": s3_key,
+        "sha256": sha256,
+        "size": upload["size"],
+        "quantization": quantization_from_file_name(from_filename),
+        "etag": upload["etag"],
+        "part_size": upload["part_size"],
+        "parts": upload["parts"],
+        "pushed_at": datetime.now(timezone.utc).isoformat(),
+    }
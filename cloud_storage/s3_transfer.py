@@ -0,0 +1,234 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from logger import logging
+from medicalbot.exception import MedicalException
+
+
+MB = 1024 * 1024
+
+# Part sizes commonly used by S3 clients; used to re-derive a multipart ETag
+COMMON_PART_SIZES = [8 * MB, 16 * MB, 5 * MB, 10 * MB, 15 * MB, 32 * MB, 50 * MB, 64 * MB, 100 * MB, 128 * MB]
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(8 * MB), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def etag_for_file(path: str, etag: str, part_size: int = None) -> str:
+    """
+    Recomputes an S3 ETag for a local file, or returns None when the part size
+    of a multipart upload cannot be determined. A known `part_size` (e.g. from
+    the model manifest) is tried before the common ones.
+    """
+    etag = etag.strip('"')
+    if "-" not in etag:
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(8 * MB), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    part_count = int(etag.split("-")[1])
+    size = os.path.getsize(path)
+    candidates = [candidate for candidate in ([part_size] if part_size else []) + COMMON_PART_SIZES
+                  if math.ceil(size / candidate) == part_count]
+    for part_size in candidates:
+        part_digests = []
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(part_size), b""):
+                part_digests.append(hashlib.md5(block).digest())
+        candidate = f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{part_count}"
+        if candidate == etag:
+            return candidate
+    return None
+
+
+class S3ParallelDownloader:
+    """
+    Downloads large S3 objects with ranged GETs fetched in parallel.
+
+    Parts are written straight into `<destination>.part` and their completion
+    is recorded in `<destination>.part.json`, so an interrupted download
+    resumes with the missing parts only. The finished file is checked against
+    the object's ETag and atomically renamed to `destination`.
+    """
+
+    def __init__(self, s3_client, max_concurrency: int = 8, part_size: int = 16 * MB):
+        self.s3_client = s3_client
+        self.max_concurrency = max_concurrency
+        self.part_size = part_size
+
+    def _load_state(self, state_path: str, etag: str, size: int) -> set:
+        if not os.path.exists(state_path):
+            return set()
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except ValueError:
+            return set()
+        if state.get("etag") != etag or state.get("size") != size or state.get("part_size") != self.part_size:
+            logging.info("Remote object changed since the partial download, starting over")
+            return set()
+        return set(state.get("completed", []))
+
+    def _save_state(self, state_path: str, etag: str, size: int, completed: set) -> None:
+        tmp_path = f"{state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"etag": etag, "size": size, "part_size": self.part_size, "completed": sorted(completed)}, f)
+        os.replace(tmp_path, state_path)
+
+    def _download_part(self, bucket_name: str, s3_key: str, etag: str, part_path: str, part: int, size: int) -> None:
+        start = part * self.part_size
+        end = min(start + self.part_size, size) - 1
+        response = self.s3_client.get_object(Bucket=bucket_name, Key=s3_key, Range=f"bytes={start}-{end}", IfMatch=etag)
+        with open(part_path, "r+b") as f:
+            f.seek(start)
+            for chunk in response["Body"].iter_chunks(chunk_size=MB):
+                f.write(chunk)
+
+    def download(self, bucket_name: str, s3_key: str, destination: str, verify: bool = True,
+                 sha256: str = None, part_size: int = None) -> str:
+        """
+        Method Name :   download
+        Description :   Downloads s3_key from bucket_name to destination using parallel ranged requests,
+                        resuming a previous partial download when possible. The file is verified against
+                        `sha256` when given (the model manifest), otherwise against the ETag, using the
+                        multipart `part_size` of the upload when known
+
+        Output      :   Path of the downloaded file
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        logging.info("Entered the download method of S3ParallelDownloader class")
+        try:
+            head = self.s3_client.head_object(Bucket=bucket_name, Key=s3_key)
+            size = head["ContentLength"]
+            etag = head["ETag"]
+
+            os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+            part_path = f"{destination}.part"
+            state_path = f"{part_path}.json"
+
+            completed = self._load_state(state_path, etag, size)
+            if not completed or not os.path.exists(part_path):
+                completed = set()
+                with open(part_path, "wb") as f:
+                    f.truncate(size)
+
+            part_count = math.ceil(size / self.part_size)
+            pending = [part for part in range(part_count) if part not in completed]
+            logging.info(f"Downloading {s3_key} ({size} bytes): {len(pending)} of {part_count} parts "
+                         f"with concurrency {self.max_concurrency}")
+
+            lock = threading.Lock()
+
+            def fetch(part):
+                self._download_part(bucket_name, s3_key, etag, part_path, part, size)
+                with lock:
+                    completed.add(part)
+                    self._save_state(state_path, etag, size, completed)
+
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                for future in [executor.submit(fetch, part) for part in pending]:
+                    future.result()
+
+            if verify:
+                if sha256 is not None:
+                    expected, actual = sha256, sha256_file(part_path)
+                else:
+                    expected, actual = etag.strip('"'), etag_for_file(part_path, etag, part_size)
+                if actual is None:
+                    logging.warning(f"{s3_key} could not be verified: no sha256 manifest and the multipart "
+                                    f"layout of ETag {etag} is unknown")
+                elif actual != expected:
+                    os.remove(part_path)
+                    if os.path.exists(state_path):
+                        os.remove(state_path)
+                    raise ValueError(f"Checksum mismatch for {s3_key}: expected {expected}, got {actual}")
+
+            os.replace(part_path, destination)
+            if os.path.exists(state_path):
+                os.remove(state_path)
+
+            logging.info(f"Model downloaded and saved as: {destination}")
+            logging.info("Exited the download method of S3ParallelDownloader class")
+            return destination
+
+        except Exception as e:
+            raise MedicalException(e, sys) from e
+
+
+class S3ParallelUploader:
+    """
+    Uploads large files as S3 multipart uploads with the parts sent in
+    parallel.
+
+    Every part carries its SHA-256 checksum, so S3 rejects a part that was
+    corrupted in transit; a failed upload is aborted so no orphaned parts are
+    left behind. Files smaller than one part are sent with a single PUT.
+    """
+
+    def __init__(self, s3_client, max_concurrency: int = 8, part_size: int = 16 * MB):
+        self.s3_client = s3_client
+        self.max_concurrency = max_concurrency
+        self.part_size = part_size
+
+    def _upload_part(self, from_filename: str, bucket_name: str, s3_key: str, upload_id: str, part: int) -> dict:
+        with open(from_filename, "rb") as f:
+            f.seek(part * self.part_size)
+            body = f.read(self.part_size)
+        checksum = base64.b64encode(hashlib.sha256(body).digest()).decode()
+        response = self.s3_client.upload_part(Bucket=bucket_name, Key=s3_key, UploadId=upload_id,
+                                              PartNumber=part + 1, Body=body, ChecksumSHA256=checksum)
+        return {"PartNumber": part + 1, "ETag": response["ETag"], "ChecksumSHA256": checksum}
+
+    def upload(self, from_filename: str, bucket_name: str, s3_key: str) -> dict:
+        """
+        Method Name :   upload
+        Description :   Uploads from_filename to s3_key in bucket_name, in parallel checksummed parts
+
+        Output      :   Dict with the ETag, size, part size and part count of the uploaded object
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        logging.info("Entered the upload method of S3ParallelUploader class")
+        try:
+            size = os.path.getsize(from_filename)
+            if size <= self.part_size:
+                with open(from_filename, "rb") as f:
+                    response = self.s3_client.put_object(Bucket=bucket_name, Key=s3_key, Body=f,
+                                                         ChecksumAlgorithm="SHA256")
+                return {"etag": response["ETag"], "size": size, "part_size": self.part_size, "parts": 1}
+
+            part_count = math.ceil(size / self.part_size)
+            logging.info(f"Uploading {from_filename} ({size} bytes) to {s3_key}: {part_count} parts "
+                         f"with concurrency {self.max_concurrency}")
+
+            upload_id = self.s3_client.create_multipart_upload(Bucket=bucket_name, Key=s3_key,
+                                                               ChecksumAlgorithm="SHA256")["UploadId"]
+            try:
+                with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                    parts = list(executor.map(
+                        lambda part: self._upload_part(from_filename, bucket_name, s3_key, upload_id, part),
+                        range(part_count)))
+                response = self.s3_client.complete_multipart_upload(Bucket=bucket_name, Key=s3_key,
+                                                                    UploadId=upload_id,
+                                                                    MultipartUpload={"Parts": parts})
+            except Exception:
+                self.s3_client.abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+                raise
+
+            logging.info("Exited the upload method of S3ParallelUploader class")
+            return {"etag": response["ETag"], "size": size, "part_size": self.part_size, "parts": part_count}
+
+        except Exception as e:
+            raise MedicalException(e, sys) from e
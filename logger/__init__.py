@@ -1,32 +1,124 @@
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
 import os
-from from_root import from_root
-from datetime import datetime
+import queue
+import random
+import uuid
+from datetime import datetime, timezone
 
-# Set up log file name with the current timestamp
-LOG_FILE = f"{datetime.now().strftime('%m_%d_%Y_%H_%M_%S')}.log"
+from medicalbot.constants import (LOG_DIR, LOG_FILE_NAME, LOG_LEVEL, LOG_FORMAT, LOG_MAX_BYTES, LOG_BACKUP_COUNT,
+                                  LOG_QUEUE_SIZE, LOG_DEBUG_SAMPLE_RATE)
 
-# Define the log directory name
-log_dir = 'logs'
+# Records are handed to a bounded queue on the calling thread and written to a size-rotated file by a
+# background listener thread, so a request never waits for disk I/O and the logs never outgrow
+# LOG_MAX_BYTES * (LOG_BACKUP_COUNT + 1).
 
-root_path = r"C:\Users\pramod\Desktop\INURON\Internship3\Gen-AI-Medical_Chatbot"
-# Create the full path for the log directory within the project root
-logs_dir_path = os.path.join(root_path, log_dir)
-print(f"Log directory path: {logs_dir_path}")  # Debugging statement to confirm the directory path
+# Id of the request being served, attached to every record logged while handling it
+request_id_var = contextvars.ContextVar("request_id", default=None)
 
-# Create the full path for the log file within the logs directory
-log_file_path = os.path.join(logs_dir_path, LOG_FILE)
-print(f"Log file path: {log_file_path}")  # Debugging statement to confirm the log file path
 
-# Ensure the log directory exists (creates the directory if it doesn't exist)
+def set_request_id(request_id=None):
+    """Sets (or generates) the id of the current request and returns it."""
+    request_id = request_id or uuid.uuid4().hex[:16]
+    request_id_var.set(request_id)
+    return request_id
+
+
+def get_request_id():
+    return request_id_var.get()
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Keeps only a `rate` share of DEBUG (and lower) records; higher levels always pass."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Drops records instead of blocking the caller when the writer falls behind."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The queue never leaves the process, so unlike the default the record keeps exc_info for
+        # JsonFormatter; only the message is resolved here, before its arguments can change
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def dropped_records():
+    return queue_handler.dropped
+
+
+def shutdown_logging():
+    """Writes out the records still queued and stops the writer thread; safe to call twice."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+# Configure the logging system: a non-blocking queue in front of a size-rotated log file
+logs_dir_path = os.path.abspath(LOG_DIR)
 os.makedirs(logs_dir_path, exist_ok=True)
-print(f"Log directory created: {logs_dir_path}")  # Confirming directory creation
+log_file_path = os.path.join(logs_dir_path, LOG_FILE_NAME)
+
+file_handler = logging.handlers.RotatingFileHandler(log_file_path, maxBytes=LOG_MAX_BYTES,
+                                                    backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+if LOG_FORMAT == "json":
+    file_handler.setFormatter(JsonFormatter())
+else:
+    file_handler.setFormatter(logging.Formatter(
+        "[ %(asctime)s ] %(name)s - %(levelname)s - [%(request_id)s] %(message)s"))
+
+queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+queue_handler.addFilter(DebugSamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+queue_handler.addFilter(RequestIdFilter())
 
-# Configure the logging system to write log messages to the specified file
-logging.basicConfig(
-    filename=log_file_path,  # File path for the log file
-    format="[ %(asctime)s ] %(name)s - %(levelname)s - %(message)s",  # Log message format
-    level=logging.DEBUG,  # Log level (captures DEBUG and higher level messages)
-)
+listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+listener.start()
+atexit.register(shutdown_logging)
 
-# Test logging to verify setup
\ No newline at end of file
+root_logger = logging.getLogger()
+root_logger.setLevel(LOG_LEVEL)
+root_logger.addHandler(queue_handler)
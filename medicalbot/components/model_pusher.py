@@ -2,7 +2,7 @@ import sys
 from cloud_storage.aws_storage import SimpleStorageService
 from medicalbot.exception import MedicalException
 from logger import logging
-from medicalbot.entity.s3_estimator import MedicalEstimator
+from medicalbot.entity.model_registry import ModelRegistry
 from medicalbot.constants import MODEL_TRAINER_MODEL_CONFIG_FILE_PATH, MODEL_BUCKET_NAME, MODEL_FILE_NAME
 from medicalbot.entity.artifact_entity import ModelPusherArtifact
 
@@ -12,14 +12,15 @@ class ModelPusher:
         Initialize ModelPusher with the necessary S3 configuration.
         
         :param model_bucket_name: S3 bucket name where the model will be uploaded.
-        :param model_file_name: Path (key) in S3 where the model will be stored.
+        :param model_file_name: Name of the model file; versions are stored under MODEL_PUSHER_S3_KEY with their local file name.
         """
         self.s3 = SimpleStorageService()
-        self.medical_estimator = MedicalEstimator(bucket_name=model_bucket_name, model_path=model_file_name)
+        self.model_registry = ModelRegistry(bucket_name=model_bucket_name)
 
     def initiate_model_pusher(self, local_model_path: str = MODEL_TRAINER_MODEL_CONFIG_FILE_PATH) -> None:
         """
-        Initiates the model pusher process to upload the model to S3.
+        Initiates the model pusher process to upload the model to S3 as a new
+        version of the model registry and make it the active version.
         
         :param local_model_path: The local file path of the model to upload.
         :return: None
@@ -30,13 +31,18 @@ class ModelPusher:
         try:
             logging.info(f"Uploading model from {local_model_path} to S3 bucket: {MODEL_BUCKET_NAME}")
 
-            # Upload the model file to the S3 bucket using MedicalEstimator
-            self.medical_estimator.save_model(from_file=local_model_path)
+            # Upload the model file to the S3 bucket as a new registry version and activate it
+            manifest = self.model_registry.register(local_model_path)
+            self.model_registry.set_active(manifest["version"])
 
             logging.info(f"Successfully uploaded model from {local_model_path} to S3.")
             logging.info("Exited initiate_model_pusher method of ModelPusher class")
             
-            model_pusher_artifact = ModelPusherArtifact(local_model_path)
+            model_pusher_artifact = ModelPusherArtifact(
+                local_model_path=local_model_path,
+                s3_model_path=manifest["s3_key"],
+                manifest=manifest
+            )
 
             logging.info("Uploaded artifacts folder to s3 bucket")
             logging.info(f"Model pusher artifact: [{model_pusher_artifact}]")
@@ -1,3 +1,4 @@
+import json
 import os
 from datetime import date
 from urllib.parse import quote_plus
@@ -22,9 +23,133 @@ REGION_NAME = "us-east-1"
 
 MODEL_BUCKET_NAME = "llma2-model"
 MODEL_PUSHER_S3_KEY = "model-registry"
+MODEL_REGISTRY_VERSIONS_DIR = "versions"
+MODEL_REGISTRY_ACTIVE_FILE = "active.json"
+
+SAVE_MODEL_DIR: str = os.getenv("SAVE_MODEL_DIR", "savemodel")
+S3_TRANSFER_MAX_CONCURRENCY: int = int(os.getenv("S3_TRANSFER_MAX_CONCURRENCY", "8"))
+S3_TRANSFER_PART_SIZE_MB: int = int(os.getenv("S3_TRANSFER_PART_SIZE_MB", "16"))
+MODEL_CACHE_MAX_GB: float = float(os.getenv("MODEL_CACHE_MAX_GB", "20"))  # disk budget of SAVE_MODEL_DIR
 
 
 """ prediction pipe line 
 """
 APP_HOST = "0.0.0.0"
-APP_PORT = 8080
\ No newline at end of file
+APP_PORT = 8080
+ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")  # required in the X-Admin-Token header of /admin routes, empty disables them
+
+
+"""
+SEMANTIC CACHE related constant start with SEMANTIC_CACHE var name
+"""
+SEMANTIC_CACHE_ENABLED: bool = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_SIZE: int = int(os.getenv("SEMANTIC_CACHE_MAX_SIZE", "1024"))
+SEMANTIC_CACHE_TTL_SECONDS: int = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))
+SEMANTIC_CACHE_PERSIST_PATH: str = os.getenv("SEMANTIC_CACHE_PERSIST_PATH", "")
+SEMANTIC_CACHE_SAVE_INTERVAL_SECONDS: float = float(os.getenv("SEMANTIC_CACHE_SAVE_INTERVAL_SECONDS", "30"))
+
+
+"""
+VECTOR STORE related constant start with VECTOR_STORE var name
+"""
+VECTOR_STORE_BACKEND: str = os.getenv("VECTOR_STORE_BACKEND", "pinecone")  # "pinecone" or "local"
+VECTOR_STORE_INDEX_NAME: str = "medicalchatbot"
+VECTOR_STORE_LOCAL_DIR: str = os.getenv("VECTOR_STORE_LOCAL_DIR", "local_index")
+VECTOR_STORE_LOCAL_INDEX_TYPE: str = os.getenv("VECTOR_STORE_LOCAL_INDEX_TYPE", "exact")  # "exact" or "hnsw"
+VECTOR_STORE_DIMENSION: int = 384
+
+
+"""
+INGESTION related constant start with INGESTION var name
+"""
+INGESTION_DATA_DIR: str = os.getenv("INGESTION_DATA_DIR", "data/")
+INGESTION_MANIFEST_PATH: str = os.getenv("INGESTION_MANIFEST_PATH", os.path.join("artifact", "ingest_manifest.json"))
+INGESTION_PDF_WORKERS: int = int(os.getenv("INGESTION_PDF_WORKERS", str(os.cpu_count() or 1)))
+INGESTION_PDF_PAGES_PER_TASK: int = int(os.getenv("INGESTION_PDF_PAGES_PER_TASK", "50"))
+INGESTION_EMBEDDING_BATCH_SIZE: int = int(os.getenv("INGESTION_EMBEDDING_BATCH_SIZE", "64"))
+INGESTION_EMBEDDING_WORKERS: int = int(os.getenv("INGESTION_EMBEDDING_WORKERS", "2"))
+# Wipe an index that has vectors but no manifest (built before incremental ingestion) instead of refusing to run
+INGESTION_RESET_UNTRACKED_INDEX: bool = os.getenv("INGESTION_RESET_UNTRACKED_INDEX", "false").lower() == "true"
+
+
+"""
+EMBEDDING CACHE related constant start with EMBEDDING_CACHE var name
+"""
+EMBEDDING_CACHE_DIR: str = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")  # empty string disables the cache
+EMBEDDING_CACHE_QUERY_ENTRIES: int = int(os.getenv("EMBEDDING_CACHE_QUERY_ENTRIES", "10000"))  # question embeddings the server keeps in memory (never written to disk)
+
+
+"""
+SERVING related constant start with SERVING or LLM var name
+"""
+SERVING_MODE: str = os.getenv("SERVING_MODE", "development")  # "development" (Flask dev server) or "production" (waitress)
+SERVING_THREADS: int = int(os.getenv("SERVING_THREADS", "16"))
+LLM_WORKERS: int = int(os.getenv("LLM_WORKERS", "1"))
+LLM_QUEUE_SIZE: int = int(os.getenv("LLM_QUEUE_SIZE", "8"))
+LLM_REQUEST_TIMEOUT_SECONDS: float = float(os.getenv("LLM_REQUEST_TIMEOUT_SECONDS", "300"))
+LLM_THREADS_PER_WORKER: int = int(os.getenv("LLM_THREADS_PER_WORKER", str(max(1, (os.cpu_count() or 1) // LLM_WORKERS))))
+LLM_PROMPT_BATCH_SIZE: int = int(os.getenv("LLM_PROMPT_BATCH_SIZE", "256"))  # prompt tokens evaluated per forward pass
+LLM_BACKEND: str = os.getenv("LLM_BACKEND", "ctransformers")  # "ctransformers" or "llama_cpp" (caches prompt prefix states)
+LLM_MODEL_PATH: str = os.getenv("LLM_MODEL_PATH", "")  # local model file served instead of the S3 model (llama_cpp needs GGUF)
+LLM_CONTEXT_LENGTH: int = int(os.getenv("LLM_CONTEXT_LENGTH", "2048"))  # llama_cpp backend only
+LLM_PREFIX_CACHE_STATES: int = int(os.getenv("LLM_PREFIX_CACHE_STATES", "4"))  # cached model states per worker
+LLM_PREFIX_CACHE_MAX_MB: float = float(os.getenv("LLM_PREFIX_CACHE_MAX_MB", "1024"))  # memory for cached model states per worker
+LLM_PREFIX_CACHE_CHUNK_HITS: int = int(os.getenv("LLM_PREFIX_CACHE_CHUNK_HITS", "2"))  # 0 only caches the static prefix
+LLM_BATCH_SEQUENCES: int = int(os.getenv("LLM_BATCH_SEQUENCES", "1"))  # >1 decodes this many requests per model together; opt-in, llama_cpp + GGUF only
+LLM_DRAFT_MODEL_PATH: str = os.getenv("LLM_DRAFT_MODEL_PATH", "")  # small GGUF model for speculative decoding (llama_cpp only)
+LLM_DRAFT_TOKENS: int = int(os.getenv("LLM_DRAFT_TOKENS", "4"))  # tokens the draft model proposes per verification pass
+LLM_MAX_NEW_TOKENS: int = int(os.getenv("LLM_MAX_NEW_TOKENS", "512"))
+LLM_MIN_NEW_TOKENS: int = int(os.getenv("LLM_MIN_NEW_TOKENS", "128"))  # token cap when the request queue is full
+LLM_STOP_SEQUENCES: list = json.loads(os.getenv("LLM_STOP_SEQUENCES", '["\\nQuestion:", "\\nContext:", "\\nUser:", "\\nHelpful answer:", "</s>"]'))
+LLM_REPETITION_REPEATS: int = int(os.getenv("LLM_REPETITION_REPEATS", "3"))  # stop when the text ends in a block repeated this often, 0 disables
+
+
+"""
+RETRIEVAL related constant start with RETRIEVAL var name
+"""
+RETRIEVAL_K: int = int(os.getenv("RETRIEVAL_K", "4"))  # candidates handed to the context packer
+RETRIEVAL_BATCH_MAX_SIZE: int = int(os.getenv("RETRIEVAL_BATCH_MAX_SIZE", "16"))
+RETRIEVAL_BATCH_MAX_WAIT_MS: float = float(os.getenv("RETRIEVAL_BATCH_MAX_WAIT_MS", "10"))
+RETRIEVAL_HYBRID_ENABLED: bool = os.getenv("RETRIEVAL_HYBRID_ENABLED", "true").lower() == "true"  # BM25 + dense
+RETRIEVAL_LEXICAL_INDEX_DIR: str = os.getenv("RETRIEVAL_LEXICAL_INDEX_DIR", os.path.join("artifact", "bm25_index"))
+RETRIEVAL_RRF_K: int = int(os.getenv("RETRIEVAL_RRF_K", "60"))  # rank offset of reciprocal rank fusion
+
+
+"""
+RERANK related constant start with RERANK var name
+"""
+RERANK_ENABLED: bool = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL: str = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES: int = int(os.getenv("RERANK_CANDIDATES", "8"))  # over-fetched, reranked down to RETRIEVAL_K
+RERANK_BUDGET_MS: float = float(os.getenv("RERANK_BUDGET_MS", "200"))  # longest a question waits for reranking
+RERANK_CACHE_SIZE: int = int(os.getenv("RERANK_CACHE_SIZE", "4096"))  # cached (query, chunk) scores
+
+
+"""
+BATCH related constant start with BATCH var name
+"""
+BATCH_SIZE: int = int(os.getenv("BATCH_SIZE", "64"))  # questions embedded and searched per retrieval call
+BATCH_MAX_QUESTIONS: int = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))  # per /batch request; larger sets use batch_qa.py
+BATCH_MAX_IN_FLIGHT: int = int(os.getenv("BATCH_MAX_IN_FLIGHT", "0"))  # generations queued per batch request; 0 = one per scheduler slot (LLM_WORKERS x batched sequences)
+
+
+"""
+CONTEXT related constant start with CONTEXT var name
+"""
+CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "300"))  # about what two raw chunks used to cost
+CONTEXT_MIN_SCORE: float = float(os.getenv("CONTEXT_MIN_SCORE", "0.0"))  # chunks less similar than this are never packed
+CONTEXT_DUPLICATE_THRESHOLD: float = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.9"))  # word overlap of near-duplicates
+
+
+"""
+LOGGING related constant start with LOG var name
+"""
+LOG_DIR: str = os.getenv("LOG_DIR", "logs")
+LOG_FILE_NAME: str = os.getenv("LOG_FILE_NAME", "medicalbot.log")
+LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+LOG_MAX_BYTES: int = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT: int = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # records beyond this are dropped, never waited for
+LOG_DEBUG_SAMPLE_RATE: float = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))  # share of DEBUG records kept
@@ -2,3 +2,5 @@ from dataclasses import dataclass
 @dataclass
 class ModelPusherArtifact:
     local_model_path:str
+    s3_model_path:str = None
+    manifest:dict = None
@@ -0,0 +1,183 @@
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+from cloud_storage.aws_storage import SimpleStorageService
+from cloud_storage.model_manifest import MANIFEST_SUFFIX
+from medicalbot.constants import MODEL_PUSHER_S3_KEY, MODEL_REGISTRY_VERSIONS_DIR, MODEL_REGISTRY_ACTIVE_FILE
+from medicalbot.exception import MedicalException
+from logger import logging
+
+
+class ModelRegistry:
+    """
+    Versioned model registry in S3 under the `MODEL_PUSHER_S3_KEY` prefix.
+
+    Every pushed model lives in `<prefix>/versions/<version>/<file name>` next
+    to its manifest; `<prefix>/active.json` points at the version the servers
+    should run and remembers the previous one for roll-back.
+    """
+
+    def __init__(self, bucket_name: str, prefix: str = MODEL_PUSHER_S3_KEY):
+        """
+        :param bucket_name: Name of the S3 bucket holding the registry.
+        :param prefix: Key prefix of the registry in the bucket.
+        """
+        self.bucket_name = bucket_name
+        self.prefix = prefix.strip("/")
+        self.s3 = SimpleStorageService()
+
+    def _versions_prefix(self) -> str:
+        return self.versions_prefix(self.prefix)
+
+    @staticmethod
+    def versions_prefix(prefix: str = MODEL_PUSHER_S3_KEY) -> str:
+        return f"{prefix.strip('/')}/{MODEL_REGISTRY_VERSIONS_DIR}/"
+
+    @staticmethod
+    def cached(bucket_name: str, model_cache, prefix: str = MODEL_PUSHER_S3_KEY) -> tuple:
+        """
+        The registry version served last, from the local model cache alone
+        (no S3 access or credentials needed), for starting up offline.
+
+        :return: (version, local model path), or (None, None) when no registry version is cached
+        """
+        versions_prefix = ModelRegistry.versions_prefix(prefix)
+        s3_key, path = model_cache.last_used_path(bucket_name, versions_prefix)
+        if path is None:
+            return None, None
+        return s3_key[len(versions_prefix):].split("/")[0], path
+
+    def _active_key(self) -> str:
+        return f"{self.prefix}/{MODEL_REGISTRY_ACTIVE_FILE}"
+
+    def register(self, local_model_path: str, version: str = None) -> dict:
+        """
+        Upload a model file as a new version.
+
+        :param local_model_path: The local file path of the model to upload.
+        :param version: Version name, defaults to the current UTC timestamp.
+        :return: The manifest of the registered version
+        """
+        try:
+            version = version or datetime.now(timezone.utc).strftime("v%Y%m%d%H%M%S")
+            s3_key = f"{self._versions_prefix()}{version}/{os.path.basename(local_model_path)}"
+            logging.info(f"Registering {local_model_path} as model version {version}")
+
+            manifest = self.s3.upload_model(from_filename=local_model_path, to_filename=s3_key,
+                                            bucket_name=self.bucket_name)
+            return {"version": version, **manifest}
+
+        except Exception as e:
+            raise MedicalException(e, sys) from e
+
+    def list_versions(self) -> list:
+        """
+        :return: Manifests of all registered versions, oldest first
+        """
+        try:
+            versions = []
+            paginator = self.s3.s3_client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self._versions_prefix()):
+                for item in page.get("Contents", []):
+                    if not item["Key"].endswith(MANIFEST_SUFFIX):
+                        continue
+                    model_key = item["Key"][:-len(MANIFEST_SUFFIX)]
+                    version = model_key[len(self._versions_prefix()):].split("/")[0]
+                    manifest = self.s3.read_model_manifest(self.bucket_name, model_key)
+                    versions.append({"version": version, **manifest})
+            return sorted(versions, key=lambda manifest: manifest.get("pushed_at", ""))
+
+        except Exception as e:
+            raise MedicalException(e, sys) from e
+
+    def get_version(self, version: str) -> dict:
+        """
+        :return: Manifest of the version
+        :raises ValueError: If the version is not registered
+        """
+        response = self.s3.s3_client.list_objects_v2(Bucket=self.bucket_name,
+                                                      Prefix=f"{self._versions_prefix()}{version}/")
+        for item in response.get("Contents", []):
+            if item["Key"].endswith(MANIFEST_SUFFIX):
+                manifest = self.s3.read_model_manifest(self.bucket_name, item["Key"][:-len(MANIFEST_SUFFIX)])
+                return {"version": version, **manifest}
+        raise ValueError(f"Model version {version} is not registered in s3://{self.bucket_name}/{self.prefix}")
+
+    def get_active(self) -> dict:
+        """
+        :return: The active pointer ({"version", "s3_key", "previous", "updated_at"}), or None when unset
+        """
+        try:
+            response = self.s3.s3_client.get_object(Bucket=self.bucket_name, Key=self._active_key())
+            return json.loads(response["Body"].read())
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise MedicalException(e, sys) from e
+
+    def set_active(self, version: str) -> dict:
+        """
+        Point the registry at a version. The pointer is a single object, so
+        readers see either the old or the new version, never a mix.
+
+        :param version: A registered version.
+        :return: The new active pointer
+        """
+        try:
+            manifest = self.get_version(version)
+            current = self.get_active()
+            previous = current["version"] if current else None
+            if previous == version:
+                previous = current.get("previous")
+            active = {
+                "version": version,
+                "s3_key": manifest["s3_key"],
+                "sha256": manifest["sha256"],
+                "previous": previous,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self.s3.s3_client.put_object(Bucket=self.bucket_name, Key=self._active_key(),
+                                         Body=json.dumps(active, indent=2).encode("utf-8"),
+                                         ContentType="application/json")
+            logging.info(f"Active model version set to {version}")
+            return active
+
+        except Exception as e:
+            raise MedicalException(e, sys) from e
+
+    def _pinned(self, active: dict) -> tuple:
+        """sha256 of the active and the previous version, which the model cache must keep for roll-back."""
+        if active is None:
+            return ()
+        pinned = [active.get("sha256")]
+        if active.get("previous"):
+            try:
+                pinned.append(self.get_version(active["previous"])["sha256"])
+            except ValueError:
+                logging.info(f"Previous model version {active['previous']} is no longer registered")
+        return tuple(sha256 for sha256 in pinned if sha256)
+
+    def fetch(self, version: str = None) -> tuple:
+        """
+        Make a version available locally through the model cache.
+
+        :param version: Version to fetch, defaults to the active one.
+        :return: (version, local model path), or (None, None) when no version is active
+        """
+        try:
+            active = self.get_active()
+            if version is None:
+                if active is None:
+                    return None, None
+                version, s3_key = active["version"], active["s3_key"]
+            else:
+                s3_key = self.get_version(version)["s3_key"]
+
+            return version, self.s3.get_model_cache().fetch(self.bucket_name, s3_key, pinned=self._pinned(active))
+
+        except Exception as e:
+            raise MedicalException(e, sys) from e
@@ -25,19 +25,19 @@ class MedicalEstimator:
         self.model_path = model_path
         self.loaded_model: MedicalModel = None  # Corrected syntax
 
-    def save_model(self, from_file: str, remove: bool = False) -> None:
+    def save_model(self, from_file: str, remove: bool = False) -> dict:
         """
         Save the model to the specified model path in the S3 bucket.
         
         :param from_file: The local file path of the model to upload.
         :param remove: If True, the local model file will be deleted after uploading to S3.
-        :return: None
+        :return: The manifest (sha256, size, quantization, timestamp) stored next to the model
         """
         try:
             logging.info(f"Uploading model from {from_file} to S3 bucket: {self.bucket_name}")
 
-            # Upload the model file to the S3 bucket
-            self.s3.upload_file(
+            # Upload the model file in parallel checksummed parts, with its manifest
+            manifest = self.s3.upload_model(
                 from_filename=from_file,
                 to_filename=self.model_path,
                 bucket_name=self.bucket_name,
@@ -50,6 +50,8 @@ class MedicalEstimator:
             if remove:
                 logging.info(f"Local file {from_file} removed after upload.")
 
+            return manifest
+
         except Exception as e:
             logging.error(f"Failed to upload model from {from_file} to S3 bucket: {e}")
             raise MedicalException(e, sys)
@@ -0,0 +1,197 @@
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from logger import logging
+from src.generation import generate
+from src.helper import build_prompt
+from src.inference_scheduler import QueueFullError
+from src.metrics import PROMPT_BUILD_SECONDS
+
+
+#Turn one question record (a string, or an object with "question" and an optional "id") into (id, question)
+def parse_question(record, default_id):
+    if isinstance(record, str):
+        question, question_id = record, default_id
+    elif isinstance(record, dict):
+        question = record.get("question") or record.get("query") or record.get("msg")
+        question_id = record.get("id", default_id)
+    else:
+        question = None
+    if not question or not isinstance(question, str):
+        raise ValueError(f"Question {default_id} has no 'question' text")
+    return question_id, question
+
+
+
+#Read (id, question) pairs from a JSONL file; the id defaults to the line number
+def read_questions(path, on_error=None):
+    """A line that is not valid JSON or has no question raises, or is passed to `on_error(line number, error)`."""
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield parse_question(json.loads(line), number)
+            except ValueError as e:
+                if on_error is None:
+                    raise
+                on_error(number, e)
+
+
+
+#Ids already answered in an output file, after cutting off a record left incomplete by a crash
+def completed_ids(path):
+    """
+    The output file is the checkpoint: every answered question is one flushed
+    JSONL line. Records with an "error" are not counted, so failed questions
+    are retried on the next run (consumers keep the last record per id).
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+
+    valid_bytes = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            valid_bytes += len(line)
+            if "error" not in record:
+                done.add(str(record["id"]))
+
+    if valid_bytes < os.path.getsize(path):
+        logging.info(f"Truncating {path} to its last complete record")
+        with open(path, "ab") as f:
+            f.truncate(valid_bytes)
+    return done
+
+
+
+class BatchAnswerer:
+    """
+    Answers many questions for the batch endpoint and the offline CLI.
+
+    Questions are retrieved `batch_size` at a time with one embedding call and
+    one batched vector query (plus BM25 fusion and reranking when configured),
+    and their generations are spread over the model workers with at most
+    `max_in_flight` of them queued or running, so live traffic keeps its place
+    in the inference queue. `answer` yields one record per question in
+    completion order while later batches are still being retrieved.
+    """
+
+    def __init__(self, retriever, scheduler, prompt, packer=None, reranker=None, controller=None, batch_size=64,
+                 max_in_flight=None):
+        self.retriever = retriever
+        self.scheduler = scheduler
+        self.prompt = prompt
+        self.packer = packer
+        self.reranker = reranker
+        self.controller = controller
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight or scheduler.num_workers
+
+    def _submit(self, final_prompt):
+        while True:
+            try:
+                return self.scheduler.submit(lambda worker: generate(worker.llm, final_prompt,
+                                                                     controller=self.controller))
+            except QueueFullError:
+                # The queue is shared with interactive requests; wait for a slot instead of failing the batch
+                time.sleep(0.05)
+
+    @staticmethod
+    def _record(question_id, question, docs, future):
+        try:
+            answer = future.result()
+        except Exception as e:
+            logging.error(f"Batch question {question_id} failed: {str(e)}")
+            return {"id": question_id, "question": question, "error": str(e)}
+        sources = [{"source": doc.metadata.get("source"), "page": doc.metadata.get("page"),
+                    "score": doc.metadata.get("score"), "rrf_score": doc.metadata.get("rrf_score"),
+                    "rerank_score": doc.metadata.get("rerank_score"),
+                    "text": doc.page_content} for doc in docs]
+        return {"id": question_id, "question": question, "answer": answer, "sources": sources}
+
+    def _drain(self, pending, block):
+        done, _ = wait(list(pending), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield self._record(*pending.pop(future), future)
+
+    def _retrieve(self, batch):
+        try:
+            return self.retriever.invoke_batch([question for _, question in batch])
+        except Exception as e:
+            logging.error(f"Batch retrieval failed: {str(e)}")
+            return [e] * len(batch)
+
+    def _answer_batch(self, batch, pending):
+        for (question_id, question), docs in zip(batch, self._retrieve(batch)):
+            if isinstance(docs, Exception):
+                yield {"id": question_id, "question": question, "error": str(docs)}
+                continue
+            if self.reranker is not None:
+                docs = self.reranker.rerank(question, docs)
+            with PROMPT_BUILD_SECONDS.time():
+                final_prompt = build_prompt(question, docs, self.prompt, packer=self.packer)
+            while len(pending) >= self.max_in_flight:
+                yield from self._drain(pending, block=True)
+            pending[self._submit(final_prompt)] = (question_id, question, docs)
+            yield from self._drain(pending, block=False)
+
+    def answer(self, questions):
+        """`questions` is an iterable of (id, question); yields result records as answers complete."""
+        pending = {}  # future -> (id, question, docs)
+        batch = []
+        for item in questions:
+            batch.append(item)
+            if len(batch) < self.batch_size:
+                continue
+            yield from self._answer_batch(batch, pending)
+            batch = []
+        if batch:
+            yield from self._answer_batch(batch, pending)
+        while pending:
+            yield from self._drain(pending, block=True)
+
+
+
+#Answer a JSONL file of questions into a JSONL output file, resuming where an earlier run stopped
+def run_batch(answerer, input_path, output_path, sync_every=100):
+    done = completed_ids(output_path)
+    if done:
+        logging.info(f"Resuming {input_path}: {len(done)} questions already answered in {output_path}")
+
+    summary = {"skipped": len(done), "answered": 0, "failed": 0}
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "a", encoding="utf-8") as f:
+        def write(record):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            summary["failed" if "error" in record else "answered"] += 1
+            written = summary["answered"] + summary["failed"]
+            if written % sync_every == 0:
+                os.fsync(f.fileno())
+                logging.info(f"Batch progress: {written} written ({summary['failed']} failed)")
+
+        # A malformed line is recorded as failed under its line number instead of ending the run
+        def malformed(number, error):
+            logging.error(f"Line {number} of {input_path} is not a valid question: {str(error)}")
+            write({"id": number, "error": f"Line {number} is not a valid question: {str(error)}"})
+
+        remaining = (item for item in read_questions(input_path, on_error=malformed) if str(item[0]) not in done)
+        for record in answerer.answer(remaining):
+            write(record)
+        os.fsync(f.fileno())
+
+    elapsed = time.perf_counter() - start
+    summary["seconds"] = round(elapsed, 3)
+    summary["questions_per_sec"] = round(summary["answered"] / elapsed, 3) if elapsed > 0 else 0.0
+    logging.info(f"Batch summary: {summary}")
+    return summary
@@ -0,0 +1,130 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from langchain_core.documents import Document
+from logger import logging
+from src.lexical_index import reciprocal_rank_fusion
+from src.metrics import EMBEDDING_SECONDS, VECTOR_SEARCH_SECONDS, LEXICAL_SEARCH_SECONDS, RETRIEVAL_BATCH_SIZE
+
+
+class RetrievalBatcher:
+    """
+    Groups concurrently arriving questions into one batch for the embedding
+    and vector search stage.
+
+    The first question of a batch waits at most `max_wait_ms` for others to
+    join (up to `max_batch_size`); the whole batch is then embedded with a
+    single `embed_documents` call and searched together. Every caller gets its
+    own result as soon as the batch is done, so a lone user only pays the
+    short wait window. With a `lexical_index` (BM25Index) every question is
+    also searched lexically and both result lists are merged by reciprocal
+    rank fusion. Exposes `invoke(query)` so it can stand in for a LangChain
+    retriever.
+    """
+
+    def __init__(self, embeddings, vector_store, k=2, max_batch_size=16, max_wait_ms=10, lexical_index=None,
+                 rrf_k=60):
+        self.embeddings = embeddings
+        self.vector_store = vector_store
+        self.k = k
+        self.lexical_index = lexical_index
+        self.rrf_k = rrf_k
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self.batches = 0
+        self.queries = 0
+
+        self._queue = queue.Queue()
+        self._search_pool = ThreadPoolExecutor(max_workers=max_batch_size, thread_name_prefix="retrieval")
+        self._thread = threading.Thread(target=self._run, name="retrieval-batcher", daemon=True)
+        self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _with_score(doc, score):
+        # Copy rather than annotate in place: stores may hand out the same Document to concurrent queries
+        return Document(page_content=doc.page_content, metadata={**doc.metadata, "score": float(score)})
+
+    def _search(self, vectors):
+        if hasattr(self.vector_store, "similarity_search_by_vectors_with_score"):
+            results = self.vector_store.similarity_search_by_vectors_with_score(vectors, k=self.k)
+        elif hasattr(self.vector_store, "similarity_search_by_vector_with_score"):
+            # Remote stores get one query per question, issued concurrently
+            results = self._search_pool.map(
+                lambda vector: self.vector_store.similarity_search_by_vector_with_score(vector, k=self.k), vectors)
+        else:
+            return list(self._search_pool.map(
+                lambda vector: self.vector_store.similarity_search_by_vector(vector, k=self.k), vectors))
+        # The relevance score travels in the metadata so the context packer can rank by it
+        return [[self._with_score(doc, score) for doc, score in docs] for docs in results]
+
+    def _fuse(self, query, docs):
+        with LEXICAL_SEARCH_SECONDS.time():
+            lexical = self.lexical_index.search(query, k=self.k)
+        dense = [(doc, doc.metadata.get("score", 0.0)) for doc in docs]
+        return reciprocal_rank_fusion([dense, lexical], k=self.k, rrf_k=self.rrf_k)
+
+    def _retrieve(self, queries):
+        RETRIEVAL_BATCH_SIZE.observe(len(queries))
+        with EMBEDDING_SECONDS.time():
+            vectors = self.embeddings.embed_documents(queries)
+        with VECTOR_SEARCH_SECONDS.time():
+            results = self._search(vectors)
+        if self.lexical_index is None:
+            return results
+        return [self._fuse(query, docs) for query, docs in zip(queries, results)]
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self._retrieve([query for query, _ in batch])
+                for (_, future), docs in zip(batch, results):
+                    future.set_result(docs)
+            except Exception as e:
+                logging.error(f"Retrieval batch failed: {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self.batches += 1
+            self.queries += len(batch)
+
+    def invoke(self, query):
+        future = Future()
+        self._queue.put((query, future))
+        return future.result()
+
+    async def ainvoke(self, query):
+        future = Future()
+        self._queue.put((query, future))
+        return await asyncio.wrap_future(future)
+
+    def invoke_batch(self, queries):
+        """Retrieves for a batch of queries right away on the calling thread, e.g. for bulk answering."""
+        results = self._retrieve(list(queries))
+        self.batches += 1
+        self.queries += len(results)
+        return results
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "avg_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+        }
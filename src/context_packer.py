@@ -0,0 +1,176 @@
+import math
+import re
+from dataclasses import dataclass, field
+
+from logger import logging
+from src.metrics import CONTEXT_TOKENS, CONTEXT_CHUNKS
+
+
+_WORD = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"[.!?](?=\s)")
+
+
+#Rough LLaMA token count: English prose averages about 4 characters per token, medical terms a bit less
+def approximate_token_count(text, chars_per_token=3.5):
+    return math.ceil(len(text) / chars_per_token) if text else 0
+
+
+
+@dataclass
+class PackedContext:
+    context: str
+    docs: list = field(default_factory=list)
+    tokens_used: int = 0
+    token_budget: int = 0
+    candidates: int = 0
+    duplicates: int = 0
+    merged: int = 0
+    trimmed: int = 0
+    dropped: int = 0
+
+
+class _Passage:
+    def __init__(self, doc, text):
+        self.source = doc.metadata.get("source")
+        self.docs = [doc]
+        self.text = text
+        self.words = set(_WORD.findall(text.lower()))
+
+
+class ContextPacker:
+    """
+    Packs retrieved chunks into the `{context}` of the stuff prompt within a
+    token budget.
+
+    Chunks are taken in order of their relevance score (`metadata["rrf_score"]`
+    for hybrid retrieval, else `metadata["score"]`, retrieval rank when absent);
+    chunks reranked by the cross-encoder come first, in order of
+    `metadata["rerank_score"]`. Only `metadata["score"]` is compared with
+    `min_score`. A chunk contained in, or nearly identical to,
+    an already packed one is skipped; neighbouring chunks of the same source
+    that share the `text_split` overlap are merged so the overlap is only paid
+    for once. Whatever no longer fits the budget is cut at a sentence boundary
+    or dropped, so `RETRIEVAL_K` can be raised without lengthening prompt
+    evaluation.
+    """
+
+    def __init__(self, token_budget=300, count_tokens=approximate_token_count, min_score=0.0,
+                 duplicate_threshold=0.9, min_overlap=8, max_overlap=200, min_fragment_tokens=32, separator="\n\n"):
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self.min_score = min_score
+        self.duplicate_threshold = duplicate_threshold
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+        self.min_fragment_tokens = min_fragment_tokens
+        self.separator = separator
+        self._separator_tokens = count_tokens(separator)
+
+    def _overlap(self, head, tail):
+        """Length of the longest suffix of `head` that is also a prefix of `tail`."""
+        for size in range(min(self.max_overlap, len(head), len(tail)), self.min_overlap - 1, -1):
+            if head.endswith(tail[:size]):
+                return size
+        return 0
+
+    def _is_duplicate(self, text, words, passages):
+        for passage in passages:
+            if text in passage.text:
+                return True
+            union = words | passage.words
+            if union and len(words & passage.words) / len(union) >= self.duplicate_threshold:
+                return True
+        return False
+
+    def _truncate(self, text, max_tokens):
+        """Longest prefix of `text` within `max_tokens`, cut back to a sentence or word boundary."""
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        prefix = text[:low]
+        if low == len(text):
+            return prefix
+        sentence_ends = [match.end() for match in _SENTENCE_END.finditer(prefix)]
+        if sentence_ends and sentence_ends[-1] >= low // 2:
+            return prefix[:sentence_ends[-1]]
+        return prefix.rsplit(None, 1)[0] if " " in prefix else prefix
+
+    @staticmethod
+    def _rank(doc):
+        # Cross-encoder logits and retrieval scores are on different scales, so they are never compared
+        rerank_score = doc.metadata.get("rerank_score")
+        if rerank_score is not None:
+            return (0, -rerank_score)
+        rrf_score = doc.metadata.get("rrf_score")
+        if rrf_score is not None:
+            return (1, -rrf_score)
+        return (2, -(doc.metadata.get("score") or 0.0))
+
+    def pack(self, docs):
+        ranked = sorted(docs, key=self._rank)
+        passages = []
+        used = 0
+        packed = PackedContext(context="", token_budget=self.token_budget, candidates=len(docs))
+
+        for doc in ranked:
+            score = doc.metadata.get("score")
+            if score is not None and score < self.min_score:
+                packed.dropped += 1
+                continue
+
+            text = doc.page_content.strip()
+            words = set(_WORD.findall(text.lower()))
+            if not text or self._is_duplicate(text, words, passages):
+                packed.duplicates += 1
+                continue
+
+            # A neighbouring chunk of an already packed passage only adds its non-overlapping part
+            target, prepend = None, False
+            for passage in passages:
+                if passage.source != doc.metadata.get("source"):
+                    continue
+                size = self._overlap(passage.text, text)
+                if size:
+                    target, text = passage, text[size:]
+                    break
+                size = self._overlap(text, passage.text)
+                if size:
+                    target, text, prepend = passage, text[:-size], True
+                    break
+
+            separator = self._separator_tokens if target is None and passages else 0
+            cost = self.count_tokens(text) + separator
+            if used + cost > self.token_budget:
+                room = self.token_budget - used - separator
+                if room < self.min_fragment_tokens or prepend:
+                    packed.dropped += 1
+                    continue
+                text = self._truncate(text, room)
+                cost = self.count_tokens(text) + separator
+                packed.trimmed += 1
+
+            if target is None:
+                passages.append(_Passage(doc, text))
+            else:
+                target.text = text + target.text if prepend else target.text + text
+                target.words |= words
+                target.docs.append(doc)
+                packed.merged += 1
+            used += cost
+
+        packed.context = self.separator.join(passage.text for passage in passages)
+        packed.docs = [doc for passage in passages for doc in passage.docs]
+        packed.tokens_used = self.count_tokens(packed.context)
+
+        CONTEXT_TOKENS.observe(packed.tokens_used)
+        for outcome in ("duplicates", "merged", "trimmed", "dropped"):
+            if getattr(packed, outcome):
+                CONTEXT_CHUNKS.inc(getattr(packed, outcome), outcome=outcome)
+        logging.debug("Packed %d of %d chunks into %d/%d context tokens (%d duplicate, %d merged, %d trimmed, %d dropped)",
+                      len(packed.docs), packed.candidates, packed.tokens_used, self.token_budget,
+                      packed.duplicates, packed.merged, packed.trimmed, packed.dropped)
+        return packed
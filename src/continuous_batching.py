@@ -0,0 +1,325 @@
+import codecs
+import queue
+import threading
+
+import numpy as np
+
+from logger import logging
+from src.metrics import DECODE_BATCH_SIZE, PROMPT_TOKENS
+from src.prefix_cache import check_gguf, common_prefix_length
+
+try:
+    import llama_cpp
+    from llama_cpp import _internals as llama_internals
+except ImportError:  # optional, only needed for LLM_BACKEND=llama_cpp
+    llama_cpp = None
+    llama_internals = None
+
+
+# The warmed static prompt prefix lives in this KV cache sequence; requests use 1..max_sequences
+PREFIX_SEQUENCE = 0
+
+
+#Token ids that end a generation (EOS, EOT and the like) according to the model's vocabulary
+def end_of_generation_tokens(model):
+    is_eog = getattr(llama_cpp, "llama_vocab_is_eog", None)
+    if is_eog is None or getattr(model, "vocab", None) is None:
+        return {model.token_eos()}
+    return {token for token in range(model.n_vocab()) if is_eog(model.vocab, token)}
+
+
+class _Sequence:
+    """One request in the batch: its prompt, KV cache slot and generated tokens."""
+
+    def __init__(self, tokens, limit):
+        self.tokens = list(tokens)
+        self.limit = limit
+        self.output = queue.Queue()
+        self.cancelled = False
+
+        self.seq_id = None
+        self.pending = []  # prompt tokens not evaluated yet
+        self.position = 0  # tokens in the KV cache
+        self.last = None  # sampled token to evaluate next
+        self.generated = 0
+
+
+class ContinuousBatchingLLM:
+    """
+    llama.cpp model that decodes the answers of concurrent requests together.
+
+    Every request gets its own sequence in one shared KV cache. A single
+    decode thread evaluates, per step, the next token of every sequence that
+    is generating plus the prompt tokens of newly arrived ones (up to
+    `batch_size` tokens, so a long prompt is spread over several steps), then
+    samples each sequence's token from its own logits. Requests join the
+    batch at the next step and leave it as soon as they finish, so one user
+    gets the latency of a single sequence while concurrent users share each
+    pass over the weights, which is what limits tokens/sec on a CPU.
+
+    `warm()` evaluates the static prompt prefix once in a sequence of its own;
+    prompts starting with it copy those KV cache entries instead of
+    evaluating them again.
+
+    `stream` is thread-safe: every scheduler worker holds the same instance and
+    at most `max_sequences` requests are decoded at once; further ones wait
+    for a free sequence. `close()` stops the decode thread once the running
+    requests are done.
+    """
+
+    def __init__(self, model, context, batch, batch_size=512, max_sequences=4, context_length=2048, max_new_tokens=512,
+                 temperature=0.8, top_k=40, top_p=0.95, repeat_penalty=1.1, repeat_last_n=64, seed=None):
+        self.model = model
+        self.context = context
+        self.max_sequences = max_sequences
+        self.context_length = context_length
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.repeat_penalty = repeat_penalty
+        self.repeat_last_n = repeat_last_n
+
+        self.steps = 0
+        self.decoded_tokens = 0
+        self.reused_tokens = 0
+        self.evaluated_tokens = 0
+
+        self._batch = batch
+        self._batch_size = batch_size
+        self._n_vocab = model.n_vocab()
+        self._eog = end_of_generation_tokens(model)
+        self._rng = np.random.default_rng(seed)
+        self._prefix_tokens = []
+
+        self._waiting = []
+        self._running = []
+        self._free_ids = list(range(1, max_sequences + 1))
+        self._lock = threading.Condition()  # guards the waiting list, cancellation and closing
+        self._decode_lock = threading.Lock()  # guards the batch and the KV cache
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="llm-decode", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def load(cls, model_path, max_sequences=4, context_length=2048, threads=None, batch_size=512, **kwargs):
+        if llama_cpp is None:
+            raise ImportError("LLM_BACKEND='llama_cpp' requires the llama-cpp-python package: pip install llama-cpp-python")
+        if batch_size < max_sequences:
+            raise ValueError(f"A batch of {batch_size} tokens cannot decode {max_sequences} sequences together")
+        check_gguf(model_path)
+        llama_cpp.llama_backend_init()
+        # What Llama(verbose=False) does: only llama.cpp errors reach stderr
+        logging.getLogger("llama-cpp-python").setLevel(logging.ERROR)
+        model_params = llama_cpp.llama_model_default_params()
+        model_params.use_mmap = True
+        model = llama_internals.LlamaModel(path_model=model_path, params=model_params, verbose=False)
+
+        # One KV cache shared by the prefix sequence and every request sequence
+        context_params = llama_cpp.llama_context_default_params()
+        context_params.n_ctx = context_length * max_sequences
+        context_params.n_batch = batch_size
+        context_params.n_ubatch = batch_size
+        context_params.n_seq_max = max_sequences + 1
+        if hasattr(context_params, "kv_unified"):
+            context_params.kv_unified = True
+        if threads:
+            context_params.n_threads = threads
+            context_params.n_threads_batch = threads
+        context = llama_internals.LlamaContext(model=model, params=context_params, verbose=False)
+        batch = llama_internals.LlamaBatch(n_tokens=batch_size, embd=0, n_seq_max=1, verbose=False)
+        logging.info(f"llama.cpp model loaded from {model_path} for {max_sequences} concurrent sequences")
+        return cls(model, context, batch, batch_size=batch_size, max_sequences=max_sequences,
+                   context_length=context_length, **kwargs)
+
+    def _tokenize(self, text):
+        return self.model.tokenize(text.encode("utf-8"), add_bos=True, special=False)
+
+    def warm(self, prefix):
+        """Evaluates the static prompt prefix once; prompts starting with it reuse its KV cache entries."""
+        tokens = self._tokenize(prefix)
+        with self._decode_lock:
+            for start in range(0, len(tokens), self._batch_size):
+                self._fill([(PREFIX_SEQUENCE, tokens[start:start + self._batch_size], start, False)])
+                self.context.decode(self._batch)
+            self._prefix_tokens = tokens
+        logging.info(f"Cached the KV cache entries of {len(tokens)} prompt prefix tokens")
+
+    def _fill(self, entries):
+        """
+        Writes (seq_id, tokens, first position, logits wanted) entries into the
+        batch; returns the batch row of each entry's last token.
+        """
+        batch = self._batch.batch
+        rows = []
+        n = 0
+        for seq_id, tokens, position, logits in entries:
+            for offset, token in enumerate(tokens):
+                batch.token[n] = token
+                batch.pos[n] = position + offset
+                batch.n_seq_id[n] = 1
+                batch.seq_id[n][0] = seq_id
+                batch.logits[n] = False
+                n += 1
+            batch.logits[n - 1] = logits
+            rows.append(n - 1)
+        batch.n_tokens = n
+        return rows
+
+    def _admit(self):
+        """Moves waiting requests into free sequences; prompts sharing the prefix copy its KV cache entries."""
+        while self._waiting and self._free_ids:
+            sequence = self._waiting.pop(0)
+            if sequence.cancelled:
+                sequence.output.put(None)
+                continue
+            sequence.seq_id = self._free_ids.pop(0)
+            # The last prompt token is always evaluated, its logits give the first answer token
+            reused = min(common_prefix_length(self._prefix_tokens, sequence.tokens), len(sequence.tokens) - 1)
+            if reused:
+                self.context.kv_cache_seq_cp(PREFIX_SEQUENCE, sequence.seq_id, 0, reused)
+            sequence.position = reused
+            sequence.pending = sequence.tokens[reused:]
+            self.reused_tokens += reused
+            self.evaluated_tokens += len(sequence.pending)
+            PROMPT_TOKENS.inc(reused, source="reused")
+            PROMPT_TOKENS.inc(len(sequence.pending), source="evaluated")
+            self._running.append(sequence)
+
+    def _release(self, sequence, error=None):
+        self.context.kv_cache_seq_rm(sequence.seq_id, -1, -1)
+        self._free_ids.append(sequence.seq_id)
+        self._running.remove(sequence)
+        sequence.output.put(error)
+
+    def _sample(self, logits, history):
+        logits = np.array(logits, dtype=np.float32)
+        if self.repeat_penalty != 1.0 and history:
+            recent = np.unique(history[-self.repeat_last_n:])
+            values = logits[recent]
+            logits[recent] = np.where(values > 0, values / self.repeat_penalty, values * self.repeat_penalty)
+        if self.temperature <= 0:
+            return int(np.argmax(logits))
+
+        candidates = np.argpartition(-logits, self.top_k - 1)[:self.top_k] if 0 < self.top_k < len(logits) \
+            else np.arange(len(logits))
+        candidates = candidates[np.argsort(-logits[candidates])]
+        probs = np.exp((logits[candidates] - logits[candidates[0]]) / self.temperature)
+        probs /= probs.sum()
+        if self.top_p < 1.0:
+            keep = int(np.searchsorted(np.cumsum(probs), self.top_p)) + 1
+            candidates, probs = candidates[:keep], probs[:keep] / probs[:keep].sum()
+        return int(self._rng.choice(candidates, p=probs))
+
+    def _step(self):
+        """One forward pass; runs on the decode thread without holding `_lock`."""
+        # Sequences that are generating get their next token in first, prompt tokens fill the rest
+        entries = []
+        space = self._batch_size
+        for sequence in self._running:
+            if sequence.last is not None:
+                entries.append((sequence, [sequence.last], True))
+                space -= 1
+        for sequence in self._running:
+            if sequence.pending and space > 0:
+                tokens, sequence.pending = sequence.pending[:space], sequence.pending[space:]
+                entries.append((sequence, tokens, not sequence.pending))
+                space -= len(tokens)
+
+        with self._decode_lock:
+            rows = self._fill([(sequence.seq_id, tokens, sequence.position, logits)
+                               for sequence, tokens, logits in entries])
+            self.context.decode(self._batch)
+        self.steps += 1
+
+        sampled = 0
+        for (sequence, tokens, logits), row in zip(entries, rows):
+            sequence.position += len(tokens)
+            if not logits:
+                continue
+            sampled += 1
+            token = self._sample(np.ctypeslib.as_array(self.context.get_logits_ith(row), shape=(self._n_vocab,)),
+                                 sequence.tokens)
+            if token in self._eog:
+                self._release(sequence)
+                continue
+            sequence.output.put(token)
+            sequence.tokens.append(token)
+            sequence.generated += 1
+            sequence.last = token
+            if sequence.generated >= sequence.limit or sequence.position + 1 >= self.context_length:
+                self._release(sequence)
+        if sampled:
+            self.decoded_tokens += sampled
+            DECODE_BATCH_SIZE.observe(sampled)
+
+    def _run(self):
+        # Only this thread touches the running sequences, so the lock is held just to
+        # take new requests and cancellations, never during a forward pass
+        while True:
+            with self._lock:
+                for sequence in [sequence for sequence in self._running if sequence.cancelled]:
+                    self._release(sequence)
+                self._admit()
+                if not self._running:
+                    if self._closed:
+                        return
+                    self._lock.wait()
+                    continue
+            try:
+                self._step()
+            except Exception as e:
+                logging.error(f"Batched decode step failed: {str(e)}")
+                for sequence in list(self._running):
+                    self._release(sequence, error=e)
+
+    def stream(self, prompt, max_new_tokens=None):
+        tokens = self._tokenize(prompt)
+        if len(tokens) >= self.context_length:
+            raise ValueError(f"The prompt has {len(tokens)} tokens, the context holds {self.context_length}")
+        sequence = _Sequence(tokens, min(max_new_tokens or self.max_new_tokens, self.context_length - len(tokens)))
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The model has been closed")
+            self._waiting.append(sequence)
+            self._lock.notify()
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        try:
+            while True:
+                token = sequence.output.get()
+                if token is None:
+                    break
+                if isinstance(token, Exception):
+                    raise token
+                text = decoder.decode(self.model.detokenize([token]))
+                if text:
+                    yield text
+        finally:
+            # A consumer that stops early frees its sequence at the next step
+            with self._lock:
+                sequence.cancelled = True
+                self._lock.notify()
+
+    def invoke(self, prompt):
+        return "".join(self.stream(prompt))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+
+    def stats(self):
+        with self._lock:
+            total = self.reused_tokens + self.evaluated_tokens
+            return {
+                "max_sequences": self.max_sequences,
+                "running_sequences": len(self._running),
+                "waiting_sequences": len(self._waiting),
+                "decode_steps": self.steps,
+                "decoded_tokens": self.decoded_tokens,
+                "mean_decode_batch": round(self.decoded_tokens / self.steps, 2) if self.steps else 0.0,
+                "reused_tokens": self.reused_tokens,
+                "evaluated_tokens": self.evaluated_tokens,
+                "reuse_rate": round(self.reused_tokens / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,237 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from logger import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+VECTORS_FILE = "vectors.f32"
+KEYS_FILE = "keys.txt"
+LOCK_FILE = "cache.lock"
+
+
+#Hold an exclusive lock on `path` across processes (the server and store_index.py share the cache)
+@contextmanager
+def file_lock(path):
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Persistent embedding cache keyed by the sha256 of the text.
+
+    Vectors are appended to a float32 file that is read through a memory map,
+    and row `i` belongs to the key on line `i` of `KEYS_FILE`. Both ingestion
+    and the query path go through the same cache, so a chunk or question that
+    was embedded once is never sent to the model again.
+
+    Several processes may share the directory. Appends hold an exclusive lock
+    on `LOCK_FILE`, and row numbers always come from the files' contents, so
+    rows appended by another process are picked up before writing and on a
+    cache miss.
+
+    With `read_only` (the server) the files are only read: user questions are
+    never written to disk, and new embeddings are kept in an in-memory LRU of
+    `memory_entries` vectors instead.
+    """
+
+    def __init__(self, embeddings, cache_dir, dimension=384, namespace="all-MiniLM-L6-v2", read_only=False,
+                 memory_entries=10000):
+        self.embeddings = embeddings
+        self.cache_dir = cache_dir
+        self.dimension = dimension
+        self.namespace = namespace
+        self.read_only = read_only
+        self.memory_entries = memory_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._vectors_path = os.path.join(cache_dir, VECTORS_FILE)
+        self._keys_path = os.path.join(cache_dir, KEYS_FILE)
+        self._lock_path = os.path.join(cache_dir, LOCK_FILE)
+        self._rows = {}
+        self._count = 0  # rows in the files, including keys stored twice by older versions
+        self._keys_offset = 0  # bytes of KEYS_FILE already read
+        self._matrix = None
+        self._memory = OrderedDict()  # key -> vector, read_only only
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._lock, file_lock(self._lock_path):
+            self._load()
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.namespace}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _load(self):
+        """Reads both files from the start; needs the file lock."""
+        keys = []
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path) as f:
+                keys = [line.strip() for line in f if line.strip()]
+
+        row_bytes = self.dimension * 4
+        stored_bytes = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+
+        # Recover from an interrupted append by cutting both files to the rows they agree on
+        count = min(len(keys), stored_bytes // row_bytes)
+        if count != len(keys) or count * row_bytes != stored_bytes:
+            logging.info(f"Truncating embedding cache at {self.cache_dir} to {count} consistent rows")
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(count * row_bytes)
+            with open(self._keys_path, "w") as f:
+                f.writelines(f"{key}\n" for key in keys[:count])
+
+        self._rows = {}
+        for row, key in enumerate(keys[:count]):
+            self._rows.setdefault(key, row)
+        self._count = count
+        self._keys_offset = os.path.getsize(self._keys_path) if os.path.exists(self._keys_path) else 0
+        self._matrix = None
+        logging.info(f"Loaded {count} cached embeddings from {self.cache_dir}")
+
+    def _sync(self):
+        """Picks up the rows other processes appended since the last read; needs the file lock."""
+        if not os.path.exists(self._keys_path):
+            return
+        with open(self._keys_path, "rb") as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        data = data[:data.rfind(b"\n") + 1]
+        self._keys_offset += len(data)
+        for key in data.decode("ascii").split():
+            self._rows.setdefault(key, self._count)
+            self._count += 1
+
+    def _refresh(self):
+        """On a miss: another process (e.g. ingestion next to the server) may have embedded the text already."""
+        with self._lock, file_lock(self._lock_path):
+            self._sync()
+
+    def _vector(self, row):
+        if self._matrix is None or row >= self._matrix.shape[0]:
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r",
+                                     shape=(self._count, self.dimension))
+        return self._matrix[row].tolist()
+
+    def _remember(self, keys, vectors):
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._memory[key] = list(vector)
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _recall(self, key):
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+            return vector
+
+    def _store(self, keys, vectors):
+        if self.read_only:
+            self._remember(keys, vectors)
+        else:
+            self._append(keys, vectors)
+
+    def _append(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        row_bytes = self.dimension * 4
+        with self._lock, file_lock(self._lock_path):
+            self._sync()
+            stored_rows = os.path.getsize(self._vectors_path) // row_bytes if os.path.exists(self._vectors_path) else 0
+            if stored_rows != self._count:
+                # Another process died between its two writes; cut both files back to the rows they agree on
+                self._load()
+            new = list({key: vector for key, vector in zip(keys, vectors) if key not in self._rows}.items())
+            if not new:
+                return
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.stack([vector for _, vector in new]).tobytes())
+            with open(self._keys_path, "a") as f:
+                f.writelines(f"{key}\n" for key, _ in new)
+            # Our own rows are numbered by their place in the files, like everyone else's
+            self._sync()
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        results = [None] * len(texts)
+        missing = []
+        for i, key in enumerate(keys):
+            row = self._rows.get(key)
+            if row is None:
+                missing.append(i)
+            else:
+                results[i] = self._vector(row)
+
+        if missing:
+            self._refresh()
+            found = [i for i in missing if keys[i] in self._rows]
+            for i in found:
+                results[i] = self._vector(self._rows[keys[i]])
+            missing = [i for i in missing if keys[i] not in self._rows]
+
+        if missing and self.read_only:
+            for i in missing:
+                results[i] = self._recall(keys[i])
+            missing = [i for i in missing if results[i] is None]
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            # Embed each distinct missing text once, even if it repeats in the batch
+            unique = list(dict.fromkeys(keys[i] for i in missing))
+            texts_by_key = {keys[i]: texts[i] for i in missing}
+            vectors = self.embeddings.embed_documents([texts_by_key[key] for key in unique])
+            self._store(unique, vectors)
+            vectors_by_key = dict(zip(unique, vectors))
+            for i in missing:
+                results[i] = list(vectors_by_key[keys[i]])
+        return results
+
+    def embed_query(self, text):
+        key = self._key(text)
+        if key not in self._rows:
+            self._refresh()
+        row = self._rows.get(key)
+        if row is not None:
+            self.hits += 1
+            return self._vector(row)
+        vector = self._recall(key) if self.read_only else None
+        if vector is not None:
+            self.hits += 1
+            return vector
+
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._store([key], [vector])
+        return list(vector)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._rows), "memory": len(self._memory)}
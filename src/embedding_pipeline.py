@@ -0,0 +1,91 @@
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from logger import logging
+
+
+#Write precomputed embeddings into the vector store
+def upsert_vectors(vector_store, vectors, documents, ids):
+    if hasattr(vector_store, "add_vectors"):
+        vector_store.add_vectors(
+            vectors,
+            [doc.page_content for doc in documents],
+            metadatas=[doc.metadata for doc in documents],
+            ids=ids,
+        )
+        return
+
+    # PineconeVectorStore keeps the chunk text in the metadata under its text key
+    records = [
+        (doc_id, list(map(float, vector)), {**doc.metadata, vector_store._text_key: doc.page_content})
+        for doc_id, vector, doc in zip(ids, vectors, documents)
+    ]
+    vector_store._index.upsert(vectors=records)
+
+
+
+class EmbeddingPipeline:
+    """
+    Embeds chunks in fixed-size batches on a pool of threads and upserts every
+    batch as soon as it is ready.
+
+    At most `max_workers * 2` batches are in flight, so memory stays bounded
+    however large the corpus is. The sentence-transformers encoder releases the
+    GIL inside torch, so threads share one loaded model and still use several
+    cores.
+    """
+
+    def __init__(self, embeddings, batch_size=64, max_workers=1):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+
+    def _batches(self, documents, ids):
+        batch_docs, batch_ids = [], []
+        for doc, doc_id in zip(documents, ids):
+            batch_docs.append(doc)
+            batch_ids.append(doc_id)
+            if len(batch_docs) == self.batch_size:
+                yield batch_docs, batch_ids
+                batch_docs, batch_ids = [], []
+        if batch_docs:
+            yield batch_docs, batch_ids
+
+    def _embed(self, batch_docs):
+        return self.embeddings.embed_documents([doc.page_content for doc in batch_docs])
+
+    def run(self, documents, vector_store, ids=None):
+        """
+        Embeds and upserts `documents` (any iterable, consumed lazily). Returns a
+        dict with the number of chunks, elapsed seconds and chunks/sec.
+        """
+        if ids is None:
+            ids = iter(lambda: str(uuid.uuid4()), None)
+
+        start = time.perf_counter()
+        chunks = 0
+        pending = deque()
+
+        def drain_one():
+            batch_docs, batch_ids, future = pending.popleft()
+            upsert_vectors(vector_store, future.result(), batch_docs, batch_ids)
+            return len(batch_docs)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for batch_docs, batch_ids in self._batches(documents, ids):
+                pending.append((batch_docs, batch_ids, executor.submit(self._embed, batch_docs)))
+                if len(pending) >= self.max_workers * 2:
+                    chunks += drain_one()
+            while pending:
+                chunks += drain_one()
+
+        elapsed = time.perf_counter() - start
+        stats = {
+            "chunks": chunks,
+            "seconds": round(elapsed, 3),
+            "chunks_per_sec": round(chunks / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+        logging.info(f"Embedding pipeline: {stats}")
+        return stats
@@ -0,0 +1,27 @@
+from src.metrics import observe_generation
+
+
+
+#Yield the tokens the LLM generates for a prompt as they are produced
+def iter_tokens(llm, prompt, controller=None, max_new_tokens=None):
+    """
+    LangChain's CTransformers wrapper has no token streaming of its own
+    (`stream` yields the finished answer once), so tokens are read from the
+    underlying ctransformers model. Generation timings are recorded on the way.
+    With a GenerationController the token limit is decided per request (on the
+    worker, when generation starts) and generation may be stopped early.
+    """
+    limit = controller.token_limit(max_new_tokens) if controller is not None else max_new_tokens
+    kwargs = {"max_new_tokens": limit} if limit else {}
+    client = getattr(llm, "client", None)
+    tokens = client(prompt, stream=True, **kwargs) if callable(client) else llm.stream(prompt, **kwargs)
+    tokens = observe_generation(tokens)
+    if controller is not None:
+        tokens = controller.control(tokens, limit)
+    yield from tokens
+
+
+
+#Generate the complete answer for a prompt
+def generate(llm, prompt, controller=None, max_new_tokens=None):
+    return "".join(iter_tokens(llm, prompt, controller=controller, max_new_tokens=max_new_tokens))
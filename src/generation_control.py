@@ -0,0 +1,114 @@
+from src.metrics import GENERATION_STOPS, TOKENS_SAVED
+
+
+class GenerationController:
+    """
+    Decides how long an answer may get and cuts generation off early.
+
+    `token_limit` caps a generation at `max_new_tokens`, lowered by a
+    per-request limit and, under load, linearly towards `min_new_tokens` as
+    the inference queue fills (`pressure` returns 0.0 for an empty queue and
+    1.0 for a full one), so answers get shorter instead of requests timing out.
+
+    `control` passes the model's tokens through and stops reading them at the
+    first stop sequence (which is not emitted; text that could be the start of
+    one is held back until it is decided) or once the text ends in the same
+    block of `min_period`..`max_period` characters `repeats` times, which is
+    how a looping model looks; text up to the end of the first copy that was
+    not emitted yet still is. Stopping the iteration stops the model. Tokens
+    saved are counted against `max_new_tokens`.
+    """
+
+    def __init__(self, max_new_tokens=512, min_new_tokens=128, stop_sequences=(), repeats=3, min_period=8,
+                 max_period=200, pressure=None):
+        self.max_new_tokens = max_new_tokens
+        self.min_new_tokens = min(min_new_tokens, max_new_tokens)
+        self.stop_sequences = tuple(stop for stop in stop_sequences if stop)
+        self.repeats = repeats
+        self.min_period = min_period
+        self.max_period = max_period
+        self.pressure = pressure
+
+    def token_limit(self, requested=None):
+        limit = self.max_new_tokens
+        if self.pressure is not None:
+            pressure = min(max(self.pressure(), 0.0), 1.0)
+            limit -= round((self.max_new_tokens - self.min_new_tokens) * pressure)
+        if requested:
+            limit = min(limit, requested)
+        return max(limit, 1)
+
+    def _find_stop(self, text, start):
+        """Index of the earliest stop sequence in the text not emitted yet (from `start`), or -1."""
+        found = [index for index in (text.find(stop, start) for stop in self.stop_sequences) if index >= 0]
+        return min(found) if found else -1
+
+    def _held_back(self, text):
+        """Length of the end of `text` that could still become a stop sequence."""
+        held = 0
+        for stop in self.stop_sequences:
+            for length in range(min(len(stop) - 1, len(text)), held, -1):
+                if text.endswith(stop[:length]):
+                    held = length
+                    break
+        return held
+
+    def _repeating(self, text):
+        """Length of the block `text` ends in `repeats` times, or 0; runs of one character (rules, padding) don't count."""
+        if not self.repeats or self.repeats < 2:
+            return 0
+        for period in range(self.min_period, min(self.max_period, len(text) // self.repeats) + 1):
+            block = text[-period:]
+            if len(set(block)) == 1:
+                continue
+            if all(text[-(copy + 1) * period:-copy * period] == block for copy in range(1, self.repeats)):
+                return period
+        return 0
+
+    def _stopped(self, reason, generated, limit):
+        GENERATION_STOPS.inc(reason=reason)
+        if reason in ("stop_sequence", "repetition"):
+            TOKENS_SAVED.inc(max(self.max_new_tokens - generated, 0), reason=reason)
+        elif reason == "max_tokens" and limit < self.max_new_tokens:
+            TOKENS_SAVED.inc(self.max_new_tokens - limit, reason="token_cap")
+
+    def control(self, tokens, limit=None):
+        """Yields the text of `tokens` until a stop sequence, a repetition loop or `limit` tokens."""
+        limit = limit or self.max_new_tokens
+        text = ""
+        sent = 0
+        generated = 0
+        reason = "eos"
+        try:
+            for token in tokens:
+                generated += 1
+                text += token
+                if self.stop_sequences:
+                    stop = self._find_stop(text, sent)
+                    if stop >= 0:
+                        if stop > sent:
+                            yield text[sent:stop]
+                        reason = "stop_sequence"
+                        break
+                period = self._repeating(text[-self.max_period * self.repeats:])
+                if period:
+                    # The first copy of the repeated block is part of the answer, the others are the loop
+                    end = len(text) - (self.repeats - 1) * period
+                    if end > sent:
+                        yield text[sent:end]
+                    reason = "repetition"
+                    break
+                end = len(text) - self._held_back(text) if self.stop_sequences else len(text)
+                if end > sent:
+                    yield text[sent:end]
+                    sent = end
+                if generated >= limit:
+                    reason = "max_tokens"
+                    break
+            if reason in ("eos", "max_tokens") and len(text) > sent:
+                yield text[sent:]
+        finally:
+            close = getattr(tokens, "close", None)
+            if close is not None:
+                close()
+        self._stopped(reason, generated, limit)
@@ -1,10 +1,22 @@
 from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.documents import Document
+from src.embedding_cache import CachedEmbeddings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pypdf import PdfReader
+import glob
+import os
 
 
 #Extract Data From the PDF File
-def load_pdf_file(data):
+def load_pdf_file(data, max_workers=1, pages_per_task=50):
+    if max_workers and max_workers > 1:
+        paths=sorted(glob.glob(os.path.join(data, "*.pdf")))
+        documents=list(iter_pdf_documents(paths, max_workers=max_workers, pages_per_task=pages_per_task))
+        documents.sort(key=lambda doc: (doc.metadata["source"], doc.metadata["page"]))
+        return documents
+
     loader= DirectoryLoader(data,
                             glob="*.pdf",
                             loader_cls=PyPDFLoader)
@@ -15,15 +27,72 @@ def load_pdf_file(data):
 
 
 
+#Extract one page range of a PDF (runs inside a worker process)
+def _extract_pdf_pages(path, start, stop):
+    reader=PdfReader(path)
+    return [
+        Document(page_content=reader.pages[page].extract_text(), metadata={"source": path, "page": page})
+        for page in range(start, stop)
+    ]
+
+
+
+#Extract PDFs in parallel, yielding Documents as each page range finishes
+def iter_pdf_documents(paths, max_workers=None, pages_per_task=50):
+    """
+    Large PDFs are split into tasks of `pages_per_task` pages so a single big
+    book is spread over several worker processes. Documents come out in
+    completion order, not page order.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures=[]
+        for path in paths:
+            page_count=len(PdfReader(path).pages)
+            for start in range(0, page_count, pages_per_task):
+                futures.append(executor.submit(_extract_pdf_pages, path, start, min(start + pages_per_task, page_count)))
+
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+
+#Extract Data From a single PDF File
+def load_single_pdf_file(path):
+    loader=PyPDFLoader(path)
+
+    documents=loader.load()
+
+    return documents
+
+
+
 #Split the Data into Text Chunks
-def text_split(extracted_data):
-    text_splitter=RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=20)
+def text_split(extracted_data, chunk_size=500, chunk_overlap=20):
+    text_splitter=RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     text_chunks=text_splitter.split_documents(extracted_data)
     return text_chunks
 
 
 
 #Download the Embeddings from HuggingFace 
-def download_hugging_face_embeddings():
-    embeddings=HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')  #this model return 384 dimensions
-    return embeddings
\ No newline at end of file
+def download_hugging_face_embeddings(batch_size=32, normalize=False, cache_dir=None, read_only=False,
+                                     memory_entries=10000):
+    embeddings=HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2',  #this model return 384 dimensions
+                                     encode_kwargs={'batch_size': batch_size, 'normalize_embeddings': normalize})
+    if cache_dir:
+        #Persist every computed embedding so identical texts are never embedded twice;
+        #read_only (the query path) reuses them but keeps new ones in memory only
+        embeddings=CachedEmbeddings(embeddings, cache_dir=cache_dir,
+                                    namespace=f"all-MiniLM-L6-v2-normalize={normalize}",
+                                    read_only=read_only, memory_entries=memory_entries)
+    return embeddings
+
+
+
+#Build the final prompt from the retrieved chunks, packed into the context token budget when a packer is given
+def build_prompt(query, docs, prompt, packer=None):
+    if packer is not None:
+        context=packer.pack(docs).context
+    else:
+        context="\n\n".join(doc.page_content for doc in docs)
+    return prompt.format(context=context, question=query)
@@ -0,0 +1,283 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+from logger import logging
+from src.metrics import QUEUE_WAIT_SECONDS
+
+
+class QueueFullError(Exception):
+    """Raised when the request queue is at capacity; the caller should answer 429."""
+
+
+
+#Hand the items of a generator to `put` until it ends or `cancelled` is set, then close it
+def _drain(generator, put, cancelled):
+    try:
+        for item in generator:
+            if cancelled.is_set():
+                break
+            put(item)
+    finally:
+        close = getattr(generator, "close", None)
+        if close is not None:
+            close()
+
+
+
+@dataclass
+class ModelWorker:
+    """One loaded LLM owned by a single scheduler thread."""
+    llm: object
+    version: str = None
+
+
+
+class InferenceScheduler:
+    """
+    Runs jobs on a fixed pool of model workers.
+
+    Every worker thread builds and owns the object returned by
+    `worker_factory` (its own loaded model), so no two requests ever share a
+    CTransformers instance and the workers load their models in parallel.
+    Requests wait in a bounded FIFO queue; when it already holds `max_queue`
+    jobs `submit` raises QueueFullError instead of letting latency grow without
+    limit. Queue wait times are tracked for the stats endpoint.
+
+    `replace_workers` hot-swaps the models: a new set is loaded next to the
+    serving one and switched in at once, jobs already running finish on the
+    old models.
+    """
+
+    _STOP = object()
+
+    def __init__(self, worker_factory, num_workers=1, max_queue=8):
+        self.num_workers = num_workers
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.busy_workers = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+
+        self._loaded = 0
+        self._load_error = None
+        self._all_loaded = threading.Event()
+        self._workers = [None] * num_workers
+        self._swap_lock = threading.Lock()
+        self.swaps = 0
+
+        self._threads = []
+        for worker_id in range(num_workers):
+            thread = threading.Thread(target=self._run, args=(worker_id, worker_factory), name=f"llm-worker-{worker_id}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Inference scheduler started with {num_workers} workers and queue size {max_queue}")
+
+    def wait_until_ready(self, timeout=None):
+        """Blocks until every worker has loaded its model; re-raises a load failure."""
+        self._all_loaded.wait(timeout)
+        if self._load_error is not None:
+            raise self._load_error
+
+    def _run(self, worker_id, worker_factory):
+        try:
+            self._workers[worker_id] = worker_factory()
+        except Exception as e:
+            self._load_error = e
+            self._all_loaded.set()
+            return
+        with self._lock:
+            self._loaded += 1
+            if self._loaded == self.num_workers:
+                self._all_loaded.set()
+
+        while True:
+            job = self._queue.get()
+            if job is self._STOP:
+                return
+            fn, future, enqueued_at = job
+            # Picked per job, so a hot-swap takes effect with the next request
+            worker = self._workers[worker_id]
+            waited = time.perf_counter() - enqueued_at
+            QUEUE_WAIT_SECONDS.observe(waited)
+            with self._lock:
+                self.busy_workers += 1
+                self._queue_wait_total += waited
+                self._queue_wait_max = max(self._queue_wait_max, waited)
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(worker))
+                    with self._lock:
+                        self.completed += 1
+                except Exception as e:
+                    future.set_exception(e)
+                    with self._lock:
+                        self.failed += 1
+
+            with self._lock:
+                self.busy_workers -= 1
+
+    def replace_workers(self, worker_factory):
+        """
+        Loads `num_workers` new workers in parallel while the current ones keep
+        serving, then swaps them all in at once. Blocks until done; on a load
+        failure the current workers stay in place and the error is re-raised.
+        Returns the replaced workers.
+        """
+        if not self._swap_lock.acquire(blocking=False):
+            raise RuntimeError("A model swap is already in progress")
+        try:
+            workers = [None] * self.num_workers
+            errors = []
+
+            def load(worker_id):
+                try:
+                    workers[worker_id] = worker_factory()
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=load, args=(worker_id,), name=f"llm-swap-{worker_id}", daemon=True)
+                       for worker_id in range(self.num_workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise errors[0]
+
+            with self._lock:
+                replaced, self._workers = self._workers, workers
+                self.swaps += 1
+            logging.info(f"Swapped in {self.num_workers} new model workers")
+            return replaced
+        finally:
+            self._swap_lock.release()
+
+    def submit(self, fn):
+        """
+        Queues `fn(worker)` and returns a Future with its result.
+        Raises QueueFullError when the queue is full.
+        """
+        future = Future()
+        # Run the job in the caller's context, so its logs keep the request id
+        context = contextvars.copy_context()
+        try:
+            self._queue.put_nowait((lambda worker: context.run(fn, worker), future, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFullError(f"Inference queue is full ({self.max_queue} requests waiting)")
+        with self._lock:
+            self.submitted += 1
+        return future
+
+    def stream(self, fn):
+        """
+        Queues a generator function `fn(worker)` and returns an iterator over the
+        items it yields, handed over from the worker thread as they are produced.
+        Closing the iterator early (a client that disconnected) stops the
+        generator at its next item, or before it starts if it is still queued,
+        so the worker does not keep generating for nobody.
+        """
+        items = queue.Queue()
+        done = object()
+        cancelled = threading.Event()
+
+        def job(worker):
+            try:
+                if not cancelled.is_set():
+                    _drain(fn(worker), items.put, cancelled)
+            finally:
+                items.put(done)
+
+        future = self.submit(job)
+
+        def iterate():
+            try:
+                while True:
+                    item = items.get()
+                    if item is done:
+                        break
+                    yield item
+            finally:
+                cancelled.set()
+            future.result()  # re-raise a failure from the worker
+
+        return iterate()
+
+    def astream(self, fn):
+        """
+        Async counterpart of `stream` for the ASGI app: items are handed to the
+        event loop with call_soon_threadsafe, so no thread waits per client.
+        Closing or cancelling the iterator stops the generator like `stream`.
+        """
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+        done = object()
+        cancelled = threading.Event()
+
+        def put(item):
+            loop.call_soon_threadsafe(items.put_nowait, item)
+
+        def job(worker):
+            try:
+                if not cancelled.is_set():
+                    _drain(fn(worker), put, cancelled)
+            finally:
+                if not loop.is_closed():
+                    put(done)
+
+        future = self.submit(job)
+
+        async def iterate():
+            try:
+                while True:
+                    item = await items.get()
+                    if item is done:
+                        break
+                    yield item
+            finally:
+                cancelled.set()
+            await asyncio.wrap_future(future)  # re-raise a failure from the worker
+
+        return iterate()
+
+    def pressure(self):
+        """How full the request queue is, from 0.0 (empty) to 1.0 (new requests are rejected)."""
+        return min(self._queue.qsize() / self.max_queue, 1.0) if self.max_queue > 0 else 0.0
+
+    def stats(self):
+        with self._lock:
+            started = self.completed + self.failed + self.busy_workers
+            return {
+                "workers": self.num_workers,
+                "model_version": getattr(self._workers[0], "version", None),
+                "model_swaps": self.swaps,
+                "loaded_workers": self._loaded,
+                "busy_workers": self.busy_workers,
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "queue_wait_avg_seconds": round(self._queue_wait_total / started, 4) if started else 0.0,
+                "queue_wait_max_seconds": round(self._queue_wait_max, 4),
+            }
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put(self._STOP)
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,193 @@
+import glob
+import hashlib
+import json
+import os
+
+from src.helper import load_single_pdf_file, iter_pdf_documents, text_split
+from logger import logging
+
+
+#Hash a file's content in fixed-size blocks
+def file_hash(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+
+#Give every chunk an id derived from its source and content
+def chunk_ids(source, chunks):
+    """
+    Ids stay stable while a chunk's text is unchanged, so editing one part of a
+    PDF only re-embeds the chunks that actually changed. Repeated identical
+    chunks within one file are told apart by their occurrence number.
+    """
+    ids = []
+    seen = {}
+    for chunk in chunks:
+        digest = hashlib.sha256(f"{source}\x00{chunk.page_content}".encode("utf-8")).hexdigest()
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        ids.append(digest if occurrence == 0 else f"{digest}-{occurrence}")
+    return ids
+
+
+
+class IngestionManifest:
+    """
+    Records, for every ingested PDF, its content hash and the ids of the chunks
+    that were upserted for it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f).get("files", {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"files": self.files}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+
+#Number of vectors in the store, or None if the store cannot tell
+def index_size(vector_store):
+    if hasattr(vector_store, "__len__"):
+        return len(vector_store)
+    index = getattr(vector_store, "_index", None)  # PineconeVectorStore
+    if index is None:
+        return None
+    stats = index.describe_index_stats()
+    namespace = getattr(vector_store, "_namespace", None)
+    if namespace:
+        summary = stats.namespaces.get(namespace)
+        return summary.vector_count if summary else 0
+    return stats.total_vector_count
+
+
+
+#Bring the vector store in line with the PDFs currently in data_dir
+def incremental_ingest(data_dir, vector_store, manifest_path, persist=None, max_workers=1, pages_per_task=50,
+                       embedding_pipeline=None, chunk_size=500, chunk_overlap=20, lexical_index=None,
+                       reset_untracked=False):
+    """
+    Only new or changed chunks are embedded and upserted; vectors of chunks that
+    disappeared (edited or removed files) are deleted. Unchanged files are not
+    even parsed, and changed ones are extracted in parallel when
+    `max_workers` > 1. With an `embedding_pipeline` new chunks are embedded in
+    batches on its worker threads instead of through `add_documents`. `persist`
+    is called before the manifest is written, for stores such as
+    LocalVectorStore that have to be saved explicitly. A `lexical_index`
+    (BM25Index) is kept in line with the same chunks and saved as well; files
+    whose chunks it is missing are re-split, but not re-embedded. Returns a
+    summary dict with the counts.
+
+    The manifest is the only record of which vectors belong to which file, so
+    a store that already has vectors but no manifest (an index built before
+    incremental ingestion, or a lost manifest) would keep every old vector
+    next to the re-ingested ones. Such a store is refused with a ValueError
+    unless `reset_untracked` is set, in which case it is emptied once with
+    `delete(delete_all=True)` (the lexical index too) and rebuilt.
+    """
+    if not os.path.exists(manifest_path):
+        existing = index_size(vector_store)
+        if existing is None:
+            logging.warning(f"No manifest at {manifest_path} and the vector store cannot report its size; "
+                            "vectors ingested without a manifest will not be replaced")
+        elif existing:
+            if not reset_untracked:
+                raise ValueError(f"The vector store has {existing} vectors but there is no manifest at "
+                                 f"{manifest_path}; set INGESTION_RESET_UNTRACKED_INDEX=true to delete them "
+                                 "once and re-ingest, or restore the manifest")
+            logging.warning(f"No manifest at {manifest_path}: deleting {existing} untracked vectors before re-ingesting")
+            vector_store.delete(delete_all=True)
+            if lexical_index is not None:
+                lexical_index.delete(delete_all=True)
+
+    manifest = IngestionManifest(manifest_path)
+    summary = {"files_skipped": 0, "files_ingested": 0, "files_removed": 0,
+               "chunks_added": 0, "chunks_deleted": 0, "embedding_seconds": 0.0}
+
+    current_files = sorted(glob.glob(os.path.join(data_dir, "*.pdf")))
+    current_sources = set()
+    changed_files = []
+
+    for path in current_files:
+        source = os.path.relpath(path, data_dir)
+        current_sources.add(source)
+        content_hash = file_hash(path)
+
+        if source in manifest.files and manifest.files[source]["hash"] == content_hash:
+            if lexical_index is None or all(chunk_id in lexical_index for chunk_id in manifest.files[source]["chunks"]):
+                summary["files_skipped"] += 1
+                continue
+        changed_files.append((source, path, content_hash))
+
+    if max_workers and max_workers > 1:
+        pages_by_path = {path: [] for _, path, _ in changed_files}
+        for doc in iter_pdf_documents(list(pages_by_path), max_workers=max_workers, pages_per_task=pages_per_task):
+            pages_by_path[doc.metadata["source"]].append(doc)
+        for pages in pages_by_path.values():
+            pages.sort(key=lambda doc: doc.metadata["page"])
+    else:
+        pages_by_path = {path: load_single_pdf_file(path) for _, path, _ in changed_files}
+
+    for source, path, content_hash in changed_files:
+        previous = manifest.files.get(source)
+
+        chunks = text_split(pages_by_path.pop(path), chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        ids = chunk_ids(source, chunks)
+        previous_ids = set(previous["chunks"]) if previous is not None else set()
+
+        new_chunks = [(chunk_id, chunk) for chunk_id, chunk in zip(ids, chunks) if chunk_id not in previous_ids]
+        stale_ids = list(previous_ids - set(ids))
+
+        if new_chunks and embedding_pipeline is not None:
+            stats = embedding_pipeline.run([chunk for _, chunk in new_chunks], vector_store,
+                                           ids=[chunk_id for chunk_id, _ in new_chunks])
+            summary["embedding_seconds"] += stats["seconds"]
+        elif new_chunks:
+            vector_store.add_documents([chunk for _, chunk in new_chunks], ids=[chunk_id for chunk_id, _ in new_chunks])
+        if stale_ids:
+            vector_store.delete(ids=stale_ids)
+
+        if lexical_index is not None:
+            lexical_index.add_documents(chunks, ids=ids)
+            lexical_index.delete(stale_ids)
+
+        manifest.files[source] = {"hash": content_hash, "chunks": ids}
+
+        summary["files_ingested"] += 1
+        summary["chunks_added"] += len(new_chunks)
+        summary["chunks_deleted"] += len(stale_ids)
+        logging.info(f"Ingested {source}: {len(new_chunks)} new chunks, {len(stale_ids)} removed")
+
+    for source in sorted(set(manifest.files) - current_sources):
+        stale_ids = manifest.files.pop(source)["chunks"]
+        if stale_ids:
+            vector_store.delete(ids=stale_ids)
+        if lexical_index is not None:
+            lexical_index.delete(stale_ids)
+
+        summary["files_removed"] += 1
+        summary["chunks_deleted"] += len(stale_ids)
+        logging.info(f"Removed {source}: {len(stale_ids)} chunks deleted")
+
+    if summary["embedding_seconds"]:
+        summary["chunks_per_sec"] = round(summary["chunks_added"] / summary["embedding_seconds"], 1)
+
+    if persist is not None:
+        persist()
+    if lexical_index is not None and (changed_files or summary["files_removed"]):
+        lexical_index.save()
+    manifest.save()
+
+    logging.info(f"Incremental ingestion summary: {summary}")
+    return summary
@@ -0,0 +1,231 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+from langchain_core.documents import Document
+from logger import logging
+
+
+TERMS_FILE = "terms.json"
+OFFSETS_FILE = "offsets.i64"
+POSTINGS_FILE = "postings.i32"
+WEIGHTS_FILE = "weights.f16"
+DOCUMENTS_FILE = "documents.jsonl"
+META_FILE = "meta.json"
+
+# Words that occur in nearly every chunk and would only make posting lists long
+STOP_WORDS = frozenset("""
+a an and are as at be by can for from has have in into is it its may of on or such that the their them then there
+these they this to was were which will with
+""".split())
+
+# Keeps drug names, dosages and codes such as "e11.9", "500mg" or "beta-blocker" together as one term
+_TERM = re.compile(r"\w+(?:[-./]\w+)*")
+_PART = re.compile(r"[-./]")
+
+
+#Split text into index terms; compound terms are indexed whole and by their parts
+def tokenize(text):
+    terms = []
+    for term in _TERM.findall(text.lower()):
+        if term in STOP_WORDS:
+            continue
+        terms.append(term)
+        if _PART.search(term):
+            terms.extend(part for part in _PART.split(term) if part and part not in STOP_WORDS)
+    return terms
+
+
+
+#Fuse ranked result lists by reciprocal rank
+def reciprocal_rank_fusion(result_lists, k, rrf_k=60, names=("dense", "lexical")):
+    """
+    `result_lists` hold (Document, score) pairs in rank order. Chunks are matched
+    on their text and scored sum(1 / (rrf_k + rank)), normalized so a chunk
+    ranked first in every list scores 1.0. The fused score is stored as
+    `metadata["rrf_score"]`, the per-list scores as `metadata["<name>_score"]`.
+    `metadata["score"]` stays the score of the first (dense) list, the scale
+    `CONTEXT_MIN_SCORE` is set on; chunks only the other lists found have none.
+    """
+    fused = {}
+    for name, results in zip(names, result_lists):
+        for rank, (doc, score) in enumerate(results, start=1):
+            entry = fused.setdefault(doc.page_content, [doc, 0.0, {}])
+            entry[1] += 1 / (rrf_k + rank)
+            entry[2][f"{name}_score"] = float(score)
+
+    best = len(result_lists) / (rrf_k + 1)
+    ranked = sorted(fused.values(), key=lambda entry: -entry[1])[:k]
+    primary = f"{names[0]}_score"
+    return [
+        Document(page_content=doc.page_content,
+                 metadata={**{key: value for key, value in doc.metadata.items() if key != "score"},
+                           **scores, "rrf_score": round(total / best, 6),
+                           **({"score": scores[primary]} if primary in scores else {})})
+        for doc, total, scores in ranked
+    ]
+
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over the ingested chunks.
+
+    The index is rebuilt from its documents on `save` with the BM25 weight of
+    every (term, chunk) posting precomputed, so a query only sums the weights
+    of its terms' postings. Postings are stored as flat int32 / float16 arrays
+    with per-term offsets and memory-mapped on `load`; terms and documents are
+    read into memory. Changes (`add_documents`, `delete`) take effect on the
+    next `save`.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+
+        self._ids = []
+        self._documents = []
+        self._positions = {}  # chunk id -> row
+        self._deleted = set()
+        self._terms = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._postings = np.empty(0, dtype=np.int32)
+        self._weights = np.empty(0, dtype=np.float16)
+
+    def __len__(self):
+        return len(self._ids) - len(self._deleted)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self._positions and chunk_id not in self._deleted
+
+    def add_documents(self, documents, ids):
+        for chunk_id, doc in zip(ids, documents):
+            if chunk_id in self._positions:
+                self._deleted.discard(chunk_id)
+                continue
+            self._positions[chunk_id] = len(self._ids)
+            self._ids.append(chunk_id)
+            self._documents.append(doc)
+
+    def delete(self, ids=(), delete_all=False):
+        if delete_all:
+            ids = self._positions
+        self._deleted.update(chunk_id for chunk_id in ids if chunk_id in self._positions)
+
+    def _build(self):
+        keep = [row for row, chunk_id in enumerate(self._ids) if chunk_id not in self._deleted]
+        self._ids = [self._ids[row] for row in keep]
+        self._documents = [self._documents[row] for row in keep]
+        self._positions = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._deleted = set()
+
+        term_counts = [Counter(tokenize(doc.page_content)) for doc in self._documents]
+        lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) else 0.0
+
+        postings = {}
+        for row, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((row, count))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        rows = np.empty(sum(len(postings[term]) for term in terms), dtype=np.int32)
+        weights = np.empty(len(rows), dtype=np.float32)
+        start = 0
+        for index, term in enumerate(terms):
+            term_rows, counts = zip(*postings[term])
+            term_rows = np.array(term_rows, dtype=np.int32)
+            counts = np.array(counts, dtype=np.float32)
+            idf = math.log(1 + (len(keep) - len(term_rows) + 0.5) / (len(term_rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[term_rows] / average_length)
+            end = start + len(term_rows)
+            rows[start:end] = term_rows
+            weights[start:end] = idf * counts * (self.k1 + 1) / (counts + norm)
+            offsets[index + 1] = end
+            start = end
+
+        self._terms = {term: index for index, term in enumerate(terms)}
+        self._offsets = offsets
+        self._postings = rows
+        self._weights = weights.astype(np.float16)
+
+    def save(self):
+        self._build()
+        os.makedirs(self.path, exist_ok=True)
+
+        # Readers keep their memory maps of the replaced files, so a running server is never disturbed
+        for name, array in ((OFFSETS_FILE, self._offsets), (POSTINGS_FILE, self._postings),
+                            (WEIGHTS_FILE, self._weights)):
+            tmp_path = os.path.join(self.path, name + ".tmp")
+            np.ascontiguousarray(array).tofile(tmp_path)
+            os.replace(tmp_path, os.path.join(self.path, name))
+
+        for name, write in ((TERMS_FILE, lambda f: json.dump(self._terms, f)),
+                            (DOCUMENTS_FILE, self._write_documents),
+                            (META_FILE, lambda f: json.dump({"count": len(self._ids), "terms": len(self._terms),
+                                                             "postings": len(self._postings),
+                                                             "k1": self.k1, "b": self.b}, f))):
+            tmp_path = os.path.join(self.path, name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                write(f)
+            os.replace(tmp_path, os.path.join(self.path, name))
+
+        logging.info(f"Saved BM25 index of {len(self._ids)} chunks and {len(self._terms)} terms at {self.path}")
+
+    def _write_documents(self, f):
+        for chunk_id, doc in zip(self._ids, self._documents):
+            f.write(json.dumps({"id": chunk_id, "text": doc.page_content, "metadata": doc.metadata}) + "\n")
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+
+        index = cls(path=path, k1=meta["k1"], b=meta["b"])
+        with open(os.path.join(path, TERMS_FILE), encoding="utf-8") as f:
+            index._terms = json.load(f)
+        index._offsets = np.fromfile(os.path.join(path, OFFSETS_FILE), dtype=np.int64)
+        if meta["postings"]:
+            index._postings = np.memmap(os.path.join(path, POSTINGS_FILE), dtype=np.int32, mode="r",
+                                        shape=(meta["postings"],))
+            index._weights = np.memmap(os.path.join(path, WEIGHTS_FILE), dtype=np.float16, mode="r",
+                                       shape=(meta["postings"],))
+
+        with open(os.path.join(path, DOCUMENTS_FILE), encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                index._positions[record["id"]] = len(index._ids)
+                index._ids.append(record["id"])
+                index._documents.append(Document(page_content=record["text"], metadata=record["metadata"]))
+
+        logging.info(f"Loaded BM25 index of {len(index)} chunks from {path}")
+        return index
+
+    @classmethod
+    def open(cls, path):
+        """Loads the index at `path`, or starts an empty one there on the first ingestion."""
+        if os.path.exists(os.path.join(path, META_FILE)):
+            return cls.load(path)
+        return cls(path)
+
+    def search(self, query, k=4):
+        """Returns up to `k` (Document, BM25 score) pairs, best first."""
+        term_ids = {self._terms[term] for term in tokenize(query) if term in self._terms}
+        if not term_ids:
+            return []
+
+        scores = np.zeros(len(self._ids), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            scores[self._postings[start:end]] += self._weights[start:end]
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(self._documents[row], float(scores[row])) for row in candidates]
@@ -0,0 +1,198 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets (seconds) from sub-millisecond vector lookups up to multi-minute CPU generations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1, 2)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+PROMPT_TOKEN_BUCKETS = (32, 64, 128, 256, 384, 512, 768, 1024, 2048)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def set_function(self, function):
+        """Reads the value at scrape time from `function()`; a None result hides the metric."""
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            value = self._function()
+            return [] if value is None else [(self.name, "", value)]
+        with self._lock:
+            return [(self.name, _format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def summary(self):
+        """Count, sum and mean over all label values, e.g. for benchmark reports."""
+        with self._lock:
+            count = sum(sum(counts) for counts, _ in self._values.values())
+            total = sum(total for _, total in self._values.values())
+        return {"count": count, "sum": round(total, 6), "mean": round(total / count, 6) if count else 0.0}
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket",
+                                _format_labels(self.labelnames, key, [("le", _format_value(bound))]), cumulative))
+            samples.append((f"{self.name}_sum", _format_labels(self.labelnames, key), total))
+            samples.append((f"{self.name}_count", _format_labels(self.labelnames, key), cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Minimal Prometheus-style metrics registry: counters, gauges and
+    histograms with labels, rendered in the text exposition format for a
+    `/metrics` endpoint. Gauges and counters owned by other components (queue
+    depth, cache hits, ...) can be read at scrape time with `set_function`.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.counter("medicalbot_requests_total", "HTTP requests by route and status code", ("route", "status"))
+REQUEST_SECONDS = REGISTRY.histogram("medicalbot_request_seconds", "Time until the response, or the first chunk of a stream, is sent", ("route",))
+EMBEDDING_SECONDS = REGISTRY.histogram("medicalbot_embedding_seconds", "Embedding time of one retrieval batch")
+VECTOR_SEARCH_SECONDS = REGISTRY.histogram("medicalbot_vector_search_seconds", "Vector store query time of one retrieval batch")
+LEXICAL_SEARCH_SECONDS = REGISTRY.histogram("medicalbot_lexical_search_seconds", "BM25 index query time of one question")
+RERANK_SECONDS = REGISTRY.histogram("medicalbot_rerank_seconds", "Time a question waited for cross-encoder reranking")
+RERANKS = REGISTRY.counter("medicalbot_reranks_total", "Reranking outcomes: reranked, cached, timeout, busy or over_budget", ("outcome",))
+RETRIEVAL_BATCH_SIZE = REGISTRY.histogram("medicalbot_retrieval_batch_size", "Questions per retrieval batch", buckets=SIZE_BUCKETS)
+PROMPT_BUILD_SECONDS = REGISTRY.histogram("medicalbot_prompt_build_seconds", "Prompt assembly time")
+CONTEXT_TOKENS = REGISTRY.histogram("medicalbot_context_tokens", "Estimated tokens of retrieved context packed into a prompt", buckets=PROMPT_TOKEN_BUCKETS)
+CONTEXT_CHUNKS = REGISTRY.counter("medicalbot_context_chunks_total", "Retrieved chunks deduplicated, merged, trimmed or dropped by the context packer", ("outcome",))
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("medicalbot_queue_wait_seconds", "Time a request waited for a model worker")
+PROMPT_EVAL_SECONDS = REGISTRY.histogram("medicalbot_prompt_eval_seconds", "Prompt evaluation time (until the first generated token)")
+TOKEN_DECODE_SECONDS = REGISTRY.histogram("medicalbot_token_decode_seconds", "Decode time per generated token", buckets=TOKEN_BUCKETS)
+GENERATION_SECONDS = REGISTRY.histogram("medicalbot_generation_seconds", "Total generation time of one answer")
+TOKENS_GENERATED = REGISTRY.counter("medicalbot_tokens_generated_total", "Tokens generated by the model workers")
+GENERATION_STOPS = REGISTRY.counter("medicalbot_generation_stops_total", "Why generation ended: eos, stop_sequence, repetition or max_tokens", ("reason",))
+TOKENS_SAVED = REGISTRY.counter("medicalbot_tokens_saved_total", "Tokens short of the max_new_tokens limit by early stop or lowered token cap", ("reason",))
+PROMPT_TOKENS = REGISTRY.counter("medicalbot_prompt_tokens_total", "Prompt tokens restored from a cached model state or evaluated", ("source",))
+DECODE_BATCH_SIZE = REGISTRY.histogram("medicalbot_decode_batch_size", "Sequences sampled together in one continuous-batching decode step", buckets=SIZE_BUCKETS)
+DRAFT_TOKENS = REGISTRY.counter("medicalbot_draft_tokens_total", "Speculative decoding draft tokens accepted or rejected by the model", ("outcome",))
+
+
+#Record prompt eval, per-token decode and total generation time while passing the tokens through
+def observe_generation(tokens):
+    start = last = time.perf_counter()
+    first = True
+    try:
+        for token in tokens:
+            now = time.perf_counter()
+            if first:
+                PROMPT_EVAL_SECONDS.observe(now - start)
+                first = False
+            else:
+                TOKEN_DECODE_SECONDS.observe(now - last)
+            last = now
+            TOKENS_GENERATED.inc()
+            yield token
+    finally:
+        GENERATION_SECONDS.observe(time.perf_counter() - start)
@@ -0,0 +1,243 @@
+import codecs
+import threading
+from collections import OrderedDict
+
+from logger import logging
+from src.metrics import PROMPT_TOKENS
+
+try:
+    from llama_cpp import Llama
+except ImportError:  # optional, only needed for LLM_BACKEND=llama_cpp
+    Llama = None
+
+
+GGUF_MAGIC = b"GGUF"
+
+
+#Fail early with a clear message when llama.cpp is given a model file in the older GGML format
+def check_gguf(model_path, setting="LLM_MODEL_PATH"):
+    with open(model_path, "rb") as f:
+        magic = f.read(len(GGUF_MAGIC))
+    if magic != GGUF_MAGIC:
+        raise ValueError(f"{model_path} is not a GGUF file. llama.cpp only loads GGUF models; GGML .bin files such as "
+                         f"the llama-2-7b-chat.ggmlv3 model need LLM_BACKEND='ctransformers'. Set {setting} to a GGUF "
+                         f"model, or convert this one with llama.cpp's convert_llama_ggml_to_gguf.py")
+
+
+
+#Length of the common leading part of two token sequences
+def common_prefix_length(a, b):
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+
+#Memory held by a saved model state: the llama.cpp state (KV cache) plus the token ids and logits kept with it
+def state_size(state):
+    if isinstance(state, (bytes, bytearray)):
+        return len(state)
+    size = getattr(state, "llama_state_size", 0)
+    for array in (getattr(state, "input_ids", None), getattr(state, "scores", None)):
+        size += getattr(array, "nbytes", 0)
+    return size
+
+
+
+class PrefixStateCache:
+    """
+    Model states (KV cache) keyed by the tokens evaluated to reach them.
+
+    `lookup(tokens)` returns the state sharing the longest leading run of
+    tokens with a prompt. States are evicted least-recently-used beyond
+    `max_states` or `max_bytes`; pinned states (the static prompt prefix) are
+    never evicted. A state that does not fit next to the pinned ones is not
+    cached.
+    """
+
+    def __init__(self, max_states=4, max_bytes=None):
+        self.max_states = max_states
+        self.max_bytes = max_bytes
+        self._states = OrderedDict()  # tokens -> (state, pinned, size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, tokens):
+        return tuple(tokens) in self._states
+
+    def total_bytes(self):
+        return sum(size for _, _, size in self._states.values())
+
+    def _full(self):
+        return len(self._states) > self.max_states or (
+            self.max_bytes is not None and self.total_bytes() > self.max_bytes)
+
+    def add(self, tokens, state, pinned=False):
+        """Caches the state; returns False when it was evicted right away for lack of room."""
+        with self._lock:
+            self._states[tuple(tokens)] = (state, pinned, state_size(state))
+            self._states.move_to_end(tuple(tokens))
+            for key in [key for key, (_, pinned, _) in self._states.items() if not pinned]:
+                if not self._full():
+                    break
+                del self._states[key]
+            return tuple(tokens) in self._states
+
+    def lookup(self, tokens):
+        """Returns (matched token count, state), or (0, None) when no state shares a token."""
+        with self._lock:
+            best_key, best_length = None, 0
+            for key in self._states:
+                length = common_prefix_length(key, tokens)
+                if length > best_length:
+                    best_key, best_length = key, length
+            if best_key is None:
+                return 0, None
+            self._states.move_to_end(best_key)
+            return best_length, self._states[best_key][0]
+
+
+class PrefixCachingLLM:
+    """
+    llama.cpp model that evaluates the static part of the prompt only once.
+
+    `warm()` evaluates the fixed instruction text in front of `{context}` and
+    snapshots the model state. Each request restores the cached state that
+    shares the most leading tokens with its prompt (unless the state the model
+    is already in shares more) and evaluates only the remaining tokens. With
+    `chunk_min_hits` set, the state after the first context passage is
+    snapshotted as well once that passage has led `chunk_min_hits` prompts, so
+    frequently retrieved chunks are not re-evaluated either.
+
+    With a `draft` model (see src.speculative) llama.cpp decodes speculatively.
+
+    Not thread-safe: every model worker owns one instance.
+    """
+
+    def __init__(self, model, prefix, max_new_tokens=512, temperature=0.8, top_k=40, top_p=0.95,
+                 repeat_penalty=1.1, max_states=4, max_bytes=None, chunk_min_hits=2, chunk_separator="\n\n"):
+        self.model = model
+        self.prefix = prefix
+        self.max_new_tokens = max_new_tokens
+        self.sampling = {"temp": temperature, "top_k": top_k, "top_p": top_p, "repeat_penalty": repeat_penalty}
+        self.chunk_min_hits = chunk_min_hits
+        self.chunk_separator = chunk_separator
+
+        self.states = PrefixStateCache(max_states=max_states, max_bytes=max_bytes)
+        self.reused_tokens = 0
+        self.evaluated_tokens = 0
+
+        self._live_tokens = []
+        self._chunk_hits = OrderedDict()
+
+    @classmethod
+    def load(cls, model_path, prefix, context_length=2048, threads=None, batch_size=512, draft=None, **kwargs):
+        if Llama is None:
+            raise ImportError("LLM_BACKEND='llama_cpp' requires the llama-cpp-python package: pip install llama-cpp-python")
+        check_gguf(model_path)
+        model = Llama(model_path=model_path, n_ctx=context_length, n_threads=threads, n_batch=batch_size,
+                      use_mmap=True, verbose=False, draft_model=draft)
+        if draft is not None and draft.model.n_vocab() != model.n_vocab():
+            raise ValueError(f"The draft model's vocabulary ({draft.model.n_vocab()} tokens) does not match "
+                             f"the model's ({model.n_vocab()} tokens)")
+        return cls(model, prefix, **kwargs)
+
+    def _tokenize(self, text):
+        return self.model.tokenize(text.encode("utf-8"))
+
+    def _restore(self, tokens):
+        """
+        Loads the cached state sharing the most leading tokens with `tokens` when
+        it beats the state the model is in; returns the tokens left to evaluate.
+        """
+        cached_length, state = self.states.lookup(tokens)
+        if state is not None and cached_length > common_prefix_length(self._live_tokens, tokens):
+            self.model.load_state(state)
+            self._live_tokens = list(tokens[:cached_length])
+        # llama.cpp's generate() skips the tokens already in the KV cache, except the last one
+        reused = min(common_prefix_length(self._live_tokens, tokens), len(tokens) - 1)
+        self._live_tokens = list(tokens)
+        return reused
+
+    def _snapshot(self, tokens, pinned=False):
+        if tokens in self.states:
+            return None
+        reused = self._restore(tokens)
+        # generate() evaluates the prompt before it samples anything; stop it right there
+        generator = self.model.generate(tokens, reset=True, **self.sampling)
+        next(generator)
+        generator.close()
+        state = self.model.save_state()
+        size_mb = state_size(state) / (1024 * 1024)
+        if self.states.add(tokens, state, pinned=pinned):
+            logging.info(f"Cached the model state after {len(tokens)} prompt tokens ({size_mb:.1f} MB; "
+                         f"{len(self.states)} states, {self.states.total_bytes() / (1024 * 1024):.1f} MB)")
+        else:
+            logging.info(f"The model state after {len(tokens)} prompt tokens ({size_mb:.1f} MB) does not fit "
+                         f"into the prefix cache next to the pinned states, not cached")
+        return reused
+
+    def warm(self):
+        """Evaluates the static prompt prefix and keeps its state for every later request."""
+        self._snapshot(self._tokenize(self.prefix), pinned=True)
+
+    def _first_chunk(self, prompt):
+        if not self.chunk_min_hits or not prompt.startswith(self.prefix):
+            return None
+        end = prompt.find(self.chunk_separator, len(self.prefix))
+        if end < 0:
+            return None
+        text = prompt[:end]
+        self._chunk_hits[text] = self._chunk_hits.pop(text, 0) + 1
+        while len(self._chunk_hits) > 1024:
+            self._chunk_hits.popitem(last=False)
+        return text if self._chunk_hits[text] >= self.chunk_min_hits else None
+
+    def stream(self, prompt, max_new_tokens=None):
+        tokens = self._tokenize(prompt)
+        chunk = self._first_chunk(prompt)
+        snapshot_reused = None
+        if chunk is not None:
+            chunk_tokens = tokens[:common_prefix_length(self._tokenize(chunk), tokens)]
+            if len(chunk_tokens) < len(tokens):
+                snapshot_reused = self._snapshot(chunk_tokens)
+
+        reused = self._restore(tokens)
+        if snapshot_reused is not None:
+            # The passage evaluated for its snapshot was part of this prompt's evaluation
+            reused = snapshot_reused
+        self.reused_tokens += reused
+        self.evaluated_tokens += len(tokens) - reused
+        PROMPT_TOKENS.inc(reused, source="reused")
+        PROMPT_TOKENS.inc(len(tokens) - reused, source="evaluated")
+
+        limit = min(max_new_tokens or self.max_new_tokens, self.model.n_ctx() - len(tokens))
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        for count, token in enumerate(self.model.generate(tokens, reset=True, **self.sampling)):
+            if token == self.model.token_eos() or count >= limit:
+                break
+            text = decoder.decode(self.model.detokenize([token]))
+            if text:
+                yield text
+
+    def invoke(self, prompt):
+        return "".join(self.stream(prompt))
+
+    def stats(self):
+        total = self.reused_tokens + self.evaluated_tokens
+        stats = {
+            "states": len(self.states),
+            "state_bytes": self.states.total_bytes(),
+            "reused_tokens": self.reused_tokens,
+            "evaluated_tokens": self.evaluated_tokens,
+            "reuse_rate": round(self.reused_tokens / total, 4) if total else 0.0,
+        }
+        draft = getattr(self.model, "draft_model", None)
+        if draft is not None:
+            stats["speculative"] = draft.stats()
+        return stats
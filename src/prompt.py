@@ -8,3 +8,6 @@ Question: {question}
 Only return the helpful answer below and nothing else.
 Helpful answer:
 """
+
+#Static instruction text in front of the context, identical for every request
+prompt_prefix=prompt_template[:prompt_template.index("{context}")]
@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from langchain_core.documents import Document
+from logger import logging
+from src.metrics import RERANK_SECONDS, RERANKS
+
+
+class CrossEncoderReranker:
+    """
+    Reorders over-fetched retrieval candidates by cross-encoder relevance and
+    keeps the best `top_k`.
+
+    All (query, chunk) pairs that are not in the score cache are scored in one
+    batched `predict` call on a dedicated thread. The request waits at most
+    `budget_ms`: only as many uncached candidates as the measured per-pair cost
+    fits into the budget are scored, and when scoring still runs late (or
+    `max_pending` batches are already queued) the candidates are returned in
+    retrieval order instead. A late batch still fills the cache.
+    """
+
+    def __init__(self, model, top_k=2, budget_ms=200, cache_size=4096, batch_size=32, max_pending=2):
+        self.model = model
+        self.top_k = top_k
+        self.budget = budget_ms / 1000
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self._cache = OrderedDict()  # sha1(query, chunk) -> score
+        self._pair_seconds = None  # moving average of the model time per pair
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+    @classmethod
+    def load(cls, model_name, **kwargs):
+        from sentence_transformers import CrossEncoder
+        model = CrossEncoder(model_name, max_length=512, device="cpu")
+        # The first call is much slower than the rest and would skew the per-pair cost estimate
+        model.predict([("warm up", "warm up")], show_progress_bar=False)
+        return cls(model, **kwargs)
+
+    @staticmethod
+    def _key(query, doc):
+        return hashlib.sha1(f"{query}\x00{doc.page_content}".encode("utf-8")).digest()
+
+    def _plan(self, query, docs):
+        """Cached scores (None where missing) and the indexes of the candidates to score."""
+        with self._lock:
+            scores = []
+            for doc in docs:
+                key = self._key(query, doc)
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                scores.append(self._cache.get(key))
+            missing = [index for index, score in enumerate(scores) if score is None]
+            self.cache_hits += len(docs) - len(missing)
+            self.cache_misses += len(missing)
+            affordable = int(self.budget / self._pair_seconds) if self._pair_seconds else len(missing)
+        return scores, missing, affordable
+
+    def _score(self, query, docs):
+        try:
+            start = time.perf_counter()
+            scores = self.model.predict([(query, doc.page_content) for doc in docs], batch_size=self.batch_size,
+                                        show_progress_bar=False)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                per_pair = elapsed / len(docs)
+                self._pair_seconds = per_pair if self._pair_seconds is None else 0.8 * self._pair_seconds + 0.2 * per_pair
+                for doc, score in zip(docs, scores):
+                    self._cache[self._key(query, doc)] = float(score)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            return [float(score) for score in scores]
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _submit(self, query, docs, missing):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+        return self._pool.submit(self._score, query, [docs[index] for index in missing])
+
+    def _select(self, docs, scores, outcome, start):
+        RERANK_SECONDS.observe(time.perf_counter() - start)
+        RERANKS.inc(outcome=outcome)
+        if outcome in ("timeout", "busy", "over_budget"):
+            logging.info(f"Reranking skipped ({outcome}), keeping retrieval order")
+            return docs[:self.top_k]
+
+        # Candidates left unscored (over the budget) rank after the scored ones, in retrieval order.
+        # The cross-encoder's logits go under their own key: "score" stays the retrieval score that
+        # CONTEXT_MIN_SCORE is set against.
+        order = sorted(range(len(docs)), key=lambda index: (scores[index] is None, -(scores[index] or 0.0), index))
+        return [
+            Document(page_content=docs[index].page_content,
+                     metadata={**docs[index].metadata, "rerank_score": scores[index]} if scores[index] is not None
+                     else docs[index].metadata)
+            for index in order[:self.top_k]
+        ]
+
+    def _start(self, query, docs, start):
+        """Returns (result, None) when no scoring has to be waited for, else (None, (scores, missing, future))."""
+        scores, missing, affordable = self._plan(query, docs)
+        if not missing:
+            return self._select(docs, scores, "cached" if docs else "empty", start), None
+        if not affordable:
+            # Not one pair fits the budget; score them anyway to refresh the cost estimate and the cache
+            self._submit(query, docs, missing)
+            return self._select(docs, scores, "over_budget", start), None
+
+        missing = missing[:affordable]
+        future = self._submit(query, docs, missing)
+        if future is None:
+            return self._select(docs, scores, "busy", start), None
+        return None, (scores, missing, future)
+
+    def _finish(self, docs, scores, missing, fresh, start):
+        for index, score in zip(missing, fresh):
+            scores[index] = score
+        return self._select(docs, scores, "reranked", start)
+
+    def rerank(self, query, docs):
+        start = time.perf_counter()
+        result, pending = self._start(query, docs, start)
+        if pending is None:
+            return result
+
+        scores, missing, future = pending
+        try:
+            fresh = future.result(timeout=max(self.budget - (time.perf_counter() - start), 0))
+        except FutureTimeoutError:
+            return self._select(docs, scores, "timeout", start)
+        return self._finish(docs, scores, missing, fresh, start)
+
+    async def arerank(self, query, docs):
+        start = time.perf_counter()
+        result, pending = self._start(query, docs, start)
+        if pending is None:
+            return result
+
+        # asyncio.wait (unlike wait_for) leaves a late batch running so it still fills the cache
+        scores, missing, future = pending
+        wrapped = asyncio.wrap_future(future)
+        done, _ = await asyncio.wait([wrapped], timeout=max(self.budget - (time.perf_counter() - start), 0))
+        if not done:
+            return self._select(docs, scores, "timeout", start)
+        return self._finish(docs, scores, missing, wrapped.result(), start)
+
+    def stats(self):
+        with self._lock:
+            total = self.cache_hits + self.cache_misses
+            return {
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "hit_rate": self.cache_hits / total if total else 0.0,
+                "cache_size": len(self._cache),
+                "pair_ms": round(self._pair_seconds * 1000, 3) if self._pair_seconds else None,
+                "pending": self._pending,
+            }
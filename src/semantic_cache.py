@@ -0,0 +1,167 @@
+import atexit
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from logger import logging
+
+
+class SemanticCache:
+    """
+    Answer cache keyed on the query embedding.
+
+    A lookup embeds the question once, compares it with every cached question by
+    cosine similarity and returns the stored answer when the best match reaches
+    `threshold`. Entries are evicted least-recently-used once `max_size` is
+    reached and expire after `ttl` seconds. When `persist_path` is set the cache
+    is loaded from that file and written back by a background thread at most
+    every `save_interval` seconds after a change (and on exit), never on the
+    request path.
+    """
+
+    def __init__(self, embeddings, threshold=0.92, max_size=1024, ttl=86400, persist_path=None, save_interval=30):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self.save_interval = save_interval
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()  # key -> (vector, value, created_at)
+        self._next_key = 0
+        self._matrix = None
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = threading.Event()
+
+        if persist_path and os.path.exists(persist_path):
+            self._load()
+        if persist_path:
+            threading.Thread(target=self._save_periodically, name="semantic-cache-save", daemon=True).start()
+            atexit.register(self.flush)
+
+    def _embed(self, query):
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now):
+        if not self.ttl:
+            return
+        expired = [key for key, (_, _, created_at) in self._entries.items() if now - created_at > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _best_match(self, vector):
+        if not self._entries:
+            return None, 0.0
+        if self._matrix is None:
+            self._matrix_keys = list(self._entries.keys())
+            self._matrix = np.stack([self._entries[key][0] for key in self._matrix_keys])
+        scores = self._matrix @ vector
+        best = int(np.argmax(scores))
+        return self._matrix_keys[best], float(scores[best])
+
+    def lookup(self, query):
+        """
+        Returns (vector, value) where value is the cached answer or None on a miss.
+        The vector can be passed back to `store` so the query is only embedded once.
+        """
+        vector = self._embed(query)
+        with self._lock:
+            self._expire(time.time())
+            key, score = self._best_match(vector)
+            if key is not None and score >= self.threshold:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                logging.info(f"Semantic cache hit (similarity={score:.3f})")
+                return vector, self._entries[key][1]
+            self.misses += 1
+        return vector, None
+
+    def store(self, vector, value):
+        with self._lock:
+            self._entries[self._next_key] = (vector, value, time.time())
+            self._next_key += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+        self._dirty.set()
+
+    def get_or_compute(self, query, compute):
+        vector, value = self.lookup(query)
+        if value is None:
+            value = compute()
+            self.store(vector, value)
+        return value
+
+    def clear(self):
+        """Drops every cached answer, e.g. after the model producing them was replaced."""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+        self._dirty.set()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+    def _save_periodically(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self.save_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Could not save semantic cache to {self.persist_path}: {str(e)}")
+
+    def flush(self):
+        """Writes the cache to `persist_path` now if it changed since the last save."""
+        if not self.persist_path or not self._dirty.is_set():
+            return
+        with self._save_lock:
+            self._dirty.clear()
+            with self._lock:
+                entries = list(self._entries.values())
+            directory = os.path.dirname(self.persist_path) or "."
+            os.makedirs(directory, exist_ok=True)
+            # A unique temp file in the same directory, so the final rename is atomic
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.persist_path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(entries, f)
+                os.replace(tmp_path, self.persist_path)
+            except BaseException:
+                self._dirty.set()
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def _load(self):
+        try:
+            with open(self.persist_path, "rb") as f:
+                entries = pickle.load(f)
+        except Exception as e:
+            logging.error(f"Could not load semantic cache from {self.persist_path}: {str(e)}")
+            return
+        for entry in entries[-self.max_size:]:
+            self._entries[self._next_key] = entry
+            self._next_key += 1
+        logging.info(f"Loaded {len(self._entries)} semantic cache entries from {self.persist_path}")
@@ -0,0 +1,94 @@
+import numpy as np
+
+from logger import logging
+from src.metrics import DRAFT_TOKENS
+from src.prefix_cache import check_gguf
+
+try:
+    from llama_cpp import Llama
+    from llama_cpp.llama_speculative import LlamaDraftModel
+except ImportError:  # optional, only needed for LLM_DRAFT_MODEL_PATH
+    Llama = None
+    LlamaDraftModel = object
+
+
+class DraftModel(LlamaDraftModel):
+    """
+    Small llama.cpp model that proposes tokens for speculative decoding.
+
+    Passed as `draft_model` to the target `Llama`, it is called with the tokens
+    so far and greedily proposes the next `draft_tokens`. The target evaluates
+    its last token and the proposal in one batch, samples its own token at
+    every position and keeps the proposal only up to the first token it did
+    not sample, so answers come out exactly as they would without a draft.
+    The draft model keeps its KV cache between calls and only evaluates the
+    tokens it has not seen.
+
+    How much of a proposal was accepted shows in the tokens the target passes
+    to the next call; a generation's last proposal is never counted.
+
+    Not thread-safe: every model worker owns one instance.
+    """
+
+    def __init__(self, model, draft_tokens=4):
+        self.model = model
+        self.draft_tokens = draft_tokens
+
+        self.proposed = 0
+        self.accepted = 0
+
+        self._last_input = None
+        self._last_proposal = []
+
+    @classmethod
+    def load(cls, model_path, context_length=2048, threads=None, batch_size=512, **kwargs):
+        if Llama is None:
+            raise ImportError("LLM_DRAFT_MODEL_PATH requires the llama-cpp-python package: pip install llama-cpp-python")
+        check_gguf(model_path, setting="LLM_DRAFT_MODEL_PATH")
+        model = Llama(model_path=model_path, n_ctx=context_length, n_threads=threads, n_batch=batch_size,
+                      use_mmap=True, verbose=False)
+        logging.info(f"Draft model loaded from {model_path}")
+        return cls(model, **kwargs)
+
+    def _settle(self, input_ids):
+        """Counts the accepted tokens of the previous proposal if `input_ids` continue that generation."""
+        last, proposal = self._last_input, self._last_proposal
+        if last is None or not proposal or len(input_ids) <= len(last):
+            return
+        if not np.array_equal(input_ids[:len(last)], last):
+            return  # a new prompt: the previous generation ended on that proposal
+        continuation = input_ids[len(last):len(last) + len(proposal)]
+        accepted = 0
+        for token, proposed in zip(continuation, proposal):
+            if token != proposed:
+                break
+            accepted += 1
+        self.proposed += len(proposal)
+        self.accepted += accepted
+        DRAFT_TOKENS.inc(accepted, outcome="accepted")
+        DRAFT_TOKENS.inc(len(proposal) - accepted, outcome="rejected")
+
+    def __call__(self, input_ids, **kwargs):
+        self._settle(input_ids)
+
+        proposal = []
+        generator = self.model.generate(input_ids.tolist(), reset=True, temp=0.0)
+        for token in generator:
+            if token == self.model.token_eos():
+                break
+            proposal.append(token)
+            if len(proposal) >= self.draft_tokens:
+                break
+        generator.close()
+
+        self._last_input = np.array(input_ids, copy=True)
+        self._last_proposal = proposal
+        return np.array(proposal, dtype=np.intc)
+
+    def stats(self):
+        return {
+            "draft_tokens": self.draft_tokens,
+            "proposed_tokens": self.proposed,
+            "accepted_tokens": self.accepted,
+            "acceptance_rate": round(self.accepted / self.proposed, 4) if self.proposed else 0.0,
+        }
@@ -0,0 +1,105 @@
+import threading
+import time
+
+from logger import logging
+
+
+class StartupOrchestrator:
+    """
+    Runs the start-up phases of the server (embeddings, vector store, model
+    file, model workers, ...) on background threads so the HTTP port can be
+    bound immediately.
+
+    Each phase starts as soon as the phases it depends on have finished, so
+    independent phases overlap. Per-phase state and timings are exposed via
+    `status()` for the readiness endpoint.
+    """
+
+    def __init__(self):
+        self._phases = {}
+        self._order = []
+        self._lock = threading.Lock()
+        self.started_at = None
+
+    def add_phase(self, name, fn, depends_on=()):
+        """
+        Registers `fn(*results_of_depends_on)`; its return value becomes the
+        phase result.
+        """
+        self._phases[name] = {
+            "fn": fn,
+            "depends_on": tuple(depends_on),
+            "done": threading.Event(),
+            "status": "pending",
+            "seconds": None,
+            "result": None,
+            "error": None,
+        }
+        self._order.append(name)
+
+    def _run_phase(self, name):
+        phase = self._phases[name]
+        try:
+            for dependency in phase["depends_on"]:
+                self._phases[dependency]["done"].wait()
+                if self._phases[dependency]["status"] != "ready":
+                    raise RuntimeError(f"dependency '{dependency}' failed")
+
+            with self._lock:
+                phase["status"] = "running"
+            start = time.perf_counter()
+            args = [self._phases[dependency]["result"] for dependency in phase["depends_on"]]
+            result = phase["fn"](*args)
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                phase["result"] = result
+                phase["seconds"] = round(elapsed, 3)
+                phase["status"] = "ready"
+            logging.info(f"Startup phase '{name}' ready in {elapsed:.2f}s")
+
+        except Exception as e:
+            with self._lock:
+                phase["status"] = "failed"
+                phase["error"] = str(e)
+            logging.error(f"Startup phase '{name}' failed: {str(e)}")
+
+        finally:
+            phase["done"].set()
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        for name in self._order:
+            threading.Thread(target=self._run_phase, args=(name,), name=f"startup-{name}", daemon=True).start()
+
+    def result(self, name, timeout=None):
+        """Blocks until the phase has finished and returns its result."""
+        phase = self._phases[name]
+        phase["done"].wait(timeout)
+        if phase["status"] != "ready":
+            raise RuntimeError(f"Startup phase '{name}' is {phase['status']}")
+        return phase["result"]
+
+    def wait(self, timeout=None):
+        """Blocks until every phase has finished (or failed); returns whether all are ready."""
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+        for phase in self._phases.values():
+            phase["done"].wait(None if deadline is None else max(deadline - time.perf_counter(), 0))
+        return self.ready
+
+    @property
+    def ready(self):
+        return all(phase["status"] == "ready" for phase in self._phases.values())
+
+    @property
+    def failed(self):
+        return any(phase["status"] == "failed" for phase in self._phases.values())
+
+    def status(self):
+        with self._lock:
+            phases = {
+                name: {key: phase[key] for key in ("status", "seconds", "error") if phase[key] is not None}
+                for name, phase in self._phases.items()
+            }
+        elapsed = time.perf_counter() - self.started_at if self.started_at is not None else 0.0
+        return {"ready": self.ready, "uptime_seconds": round(elapsed, 3), "phases": phases}
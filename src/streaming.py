@@ -0,0 +1,30 @@
+import json
+
+from src.helper import build_prompt
+from src.generation import iter_tokens
+from src.metrics import PROMPT_BUILD_SECONDS
+
+
+#Format one Server-Sent Event frame
+def format_sse(data, event=None):
+    message = f"data: {json.dumps(data)}\n\n"
+    if event is not None:
+        message = f"event: {event}\n{message}"
+    return message
+
+
+
+#Stream the answer for one question token by token
+def stream_answer(query, docs, llm, prompt, packer=None, controller=None, max_new_tokens=None):
+    """
+    Yields SSE frames for every token the LLM emits for the already retrieved
+    `docs`, followed by an `end` event carrying the sources.
+    """
+    with PROMPT_BUILD_SECONDS.time():
+        final_prompt = build_prompt(query, docs, prompt, packer=packer)
+
+    for token in iter_tokens(llm, final_prompt, controller=controller, max_new_tokens=max_new_tokens):
+        yield format_sse({"token": token})
+
+    sources = [doc.metadata.get("source") for doc in docs]
+    yield format_sse({"sources": sources}, event="end")
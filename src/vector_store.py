@@ -0,0 +1,256 @@
+import json
+import os
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from logger import logging
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+VECTORS_FILE = "vectors.f32"
+DOCUMENTS_FILE = "documents.jsonl"
+META_FILE = "meta.json"
+HNSW_FILE = "hnsw.bin"
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector store for the chunk embeddings.
+
+    Vectors are L2-normalized and kept as one float32 matrix which is written to
+    `VECTORS_FILE` and memory-mapped on load, so cosine similarity is a single
+    NumPy dot product. With `index_type="hnsw"` an approximate hnswlib index is
+    built on save and used for search instead of the exact scan.
+    """
+
+    def __init__(self, embedding, path, dimension=384, index_type="exact"):
+        if index_type == "hnsw" and hnswlib is None:
+            raise ImportError("index_type='hnsw' requires the hnswlib package: pip install hnswlib")
+        self._embedding = embedding
+        self.path = path
+        self.dimension = dimension
+        self.index_type = index_type
+
+        self._vectors = np.empty((0, dimension), dtype=np.float32)
+        self._pending = []  # batches appended since the last consolidation
+        self._ids = []
+        self._known_ids = set()
+        self._documents = []
+        self._hnsw = None
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def __len__(self):
+        return len(self._ids)
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def add_vectors(self, vectors, texts, metadatas=None, ids=None):
+        """
+        Adds already computed embeddings so callers that batch the embedding
+        step themselves do not pay for it twice.
+        """
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+
+        # Upsert semantics: re-adding an id replaces the previous vector
+        self.delete([doc_id for doc_id in ids if doc_id in self._known_ids])
+
+        self._pending.append(self._normalize(vectors).reshape(-1, self.dimension))
+        self._ids.extend(ids)
+        self._known_ids.update(ids)
+        self._documents.extend(Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas))
+        self._hnsw = None
+        return ids
+
+    def _consolidate(self):
+        # Batches are concatenated once here instead of on every add
+        if self._pending:
+            self._vectors = np.concatenate([np.asarray(self._vectors)] + self._pending)
+            self._pending = []
+        return self._vectors
+
+    def delete(self, ids=None, delete_all=False, **kwargs):
+        if delete_all:
+            self._vectors = np.empty((0, self.dimension), dtype=np.float32)
+            self._pending = []
+            self._ids = []
+            self._known_ids = set()
+            self._documents = []
+            self._hnsw = None
+            return True
+        if not ids:
+            return False
+        self._consolidate()
+        to_delete = set(ids)
+        keep = [row for row, doc_id in enumerate(self._ids) if doc_id not in to_delete]
+        if len(keep) == len(self._ids):
+            return False
+        self._vectors = np.asarray(self._vectors)[keep]
+        self._ids = [self._ids[row] for row in keep]
+        self._known_ids = set(self._ids)
+        self._documents = [self._documents[row] for row in keep]
+        self._hnsw = None
+        return True
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_vectors(vectors, texts, metadatas=metadatas, ids=ids)
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        if not self._ids:
+            return []
+        query = self._normalize(embedding)
+        k = min(k, len(self._ids))
+
+        if self.index_type == "hnsw":
+            if self._hnsw is None:
+                self._build_hnsw()
+            labels, distances = self._hnsw.knn_query(query, k=k)
+            rows, scores = labels[0], 1.0 - distances[0]
+        else:
+            scores = self._consolidate() @ query
+            rows = np.argpartition(-scores, k - 1)[:k]
+            rows = rows[np.argsort(-scores[rows])]
+            scores = scores[rows]
+
+        return [(self._documents[row], float(score)) for row, score in zip(rows, scores)]
+
+    def similarity_search_by_vectors_with_score(self, embeddings, k=4):
+        """
+        Searches several query vectors at once: one matrix product for the
+        exact index, one knn_query call for hnsw.
+        """
+        if not self._ids:
+            return [[] for _ in embeddings]
+        queries = self._normalize(embeddings).reshape(-1, self.dimension)
+        k = min(k, len(self._ids))
+
+        if self.index_type == "hnsw":
+            if self._hnsw is None:
+                self._build_hnsw()
+            labels, distances = self._hnsw.knn_query(queries, k=k)
+            rows, scores = labels, 1.0 - distances
+        else:
+            all_scores = queries @ self._consolidate().T
+            rows = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(all_scores, rows, axis=1), axis=1)
+            rows = np.take_along_axis(rows, order, axis=1)
+            scores = np.take_along_axis(all_scores, rows, axis=1)
+
+        return [
+            [(self._documents[row], float(score)) for row, score in zip(query_rows, query_scores)]
+            for query_rows, query_scores in zip(rows, scores)
+        ]
+
+    def similarity_search_by_vectors(self, embeddings, k=4):
+        return [[doc for doc, _ in results] for results in self.similarity_search_by_vectors_with_score(embeddings, k=k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k=k)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities
+        return lambda score: score
+
+    def _build_hnsw(self):
+        index = hnswlib.Index(space="ip", dim=self.dimension)
+        index.init_index(max_elements=max(len(self._ids), 1), ef_construction=200, M=16)
+        index.add_items(np.asarray(self._consolidate()), np.arange(len(self._ids)))
+        index.set_ef(64)
+        self._hnsw = index
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+
+        vectors = np.ascontiguousarray(self._consolidate(), dtype=np.float32)
+        tmp_path = os.path.join(self.path, VECTORS_FILE + ".tmp")
+        vectors.tofile(tmp_path)
+        os.replace(tmp_path, os.path.join(self.path, VECTORS_FILE))
+
+        # Every file is written next to its final name and renamed into place, so a crash never leaves it truncated
+        tmp_path = os.path.join(self.path, DOCUMENTS_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for doc_id, doc in zip(self._ids, self._documents):
+                f.write(json.dumps({"id": doc_id, "text": doc.page_content, "metadata": doc.metadata}) + "\n")
+        os.replace(tmp_path, os.path.join(self.path, DOCUMENTS_FILE))
+
+        if self.index_type == "hnsw":
+            self._build_hnsw()
+            tmp_path = os.path.join(self.path, HNSW_FILE + ".tmp")
+            self._hnsw.save_index(tmp_path)
+            os.replace(tmp_path, os.path.join(self.path, HNSW_FILE))
+
+        # The metadata goes last: it holds the row count the other files are read with
+        tmp_path = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"dimension": self.dimension, "count": len(self._ids)}, f)
+        os.replace(tmp_path, os.path.join(self.path, META_FILE))
+
+        logging.info(f"Saved {len(self._ids)} vectors to local vector store at {self.path}")
+
+    @classmethod
+    def load(cls, embedding, path, index_type="exact"):
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+
+        store = cls(embedding=embedding, path=path, dimension=meta["dimension"], index_type=index_type)
+        if meta["count"]:
+            store._vectors = np.memmap(os.path.join(path, VECTORS_FILE), dtype=np.float32, mode="r",
+                                       shape=(meta["count"], meta["dimension"]))
+
+        with open(os.path.join(path, DOCUMENTS_FILE), encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                store._ids.append(record["id"])
+                store._known_ids.add(record["id"])
+                store._documents.append(Document(page_content=record["text"], metadata=record["metadata"]))
+
+        hnsw_path = os.path.join(path, HNSW_FILE)
+        if index_type == "hnsw" and os.path.exists(hnsw_path):
+            store._hnsw = hnswlib.Index(space="ip", dim=store.dimension)
+            store._hnsw.load_index(hnsw_path, max_elements=max(meta["count"], 1))
+            store._hnsw.set_ef(64)
+
+        logging.info(f"Loaded {len(store)} vectors from local vector store at {path}")
+        return store
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, path="local_index", dimension=384,
+                   index_type="exact", **kwargs):
+        store = cls(embedding=embedding, path=path, dimension=dimension, index_type=index_type)
+        store.add_texts(texts, metadatas=metadatas, ids=kwargs.get("ids"))
+        store.save()
+        return store
+
+
+
+#Open the configured vector store for querying
+def load_vector_store(backend, embeddings, index_name="medicalchatbot", local_path="local_index", index_type="exact"):
+    if backend == "local":
+        return LocalVectorStore.load(embedding=embeddings, path=local_path, index_type=index_type)
+    if backend == "pinecone":
+        from langchain_pinecone import PineconeVectorStore
+        return PineconeVectorStore.from_existing_index(index_name=index_name, embedding=embeddings)
+    raise ValueError(f"Unknown vector store backend: {backend}")
@@ -1,41 +1,95 @@
-from src.helper import load_pdf_file, text_split, download_hugging_face_embeddings
-from pinecone.grpc import PineconeGRPC as Pinecone
-from pinecone import ServerlessSpec
-from langchain_pinecone import PineconeVectorStore
+from src.helper import download_hugging_face_embeddings
+from src.ingestion import incremental_ingest
+from src.embedding_pipeline import EmbeddingPipeline
+from src.vector_store import LocalVectorStore, META_FILE
+from src.lexical_index import BM25Index
+from medicalbot.constants import (VECTOR_STORE_BACKEND, VECTOR_STORE_INDEX_NAME, VECTOR_STORE_LOCAL_DIR,
+                                  VECTOR_STORE_LOCAL_INDEX_TYPE, VECTOR_STORE_DIMENSION,
+                                  INGESTION_DATA_DIR, INGESTION_MANIFEST_PATH, INGESTION_PDF_WORKERS,
+                                  INGESTION_PDF_PAGES_PER_TASK, INGESTION_EMBEDDING_BATCH_SIZE,
+                                  INGESTION_EMBEDDING_WORKERS, INGESTION_RESET_UNTRACKED_INDEX,
+                                  EMBEDDING_CACHE_DIR,
+                                  RETRIEVAL_HYBRID_ENABLED, RETRIEVAL_LEXICAL_INDEX_DIR)
 from dotenv import load_dotenv
 import os
 
 
-load_dotenv()
+# The guard keeps worker processes of the parallel PDF extraction from re-running ingestion.
+if __name__ == "__main__":
+    load_dotenv()
 
-PINECONE_API_KEY=os.environ.get('PINECONE_API_KEY')
-os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
+    embeddings = download_hugging_face_embeddings(batch_size=INGESTION_EMBEDDING_BATCH_SIZE,
+                                                  cache_dir=EMBEDDING_CACHE_DIR)
+    embedding_pipeline = EmbeddingPipeline(
+        embeddings=embeddings,
+        batch_size=INGESTION_EMBEDDING_BATCH_SIZE,
+        max_workers=INGESTION_EMBEDDING_WORKERS,
+    )
 
+    index_name = VECTOR_STORE_INDEX_NAME
+    manifest_path = INGESTION_MANIFEST_PATH
+    persist = None
 
-extracted_data=load_pdf_file(data='data/')
-text_chunks=text_split(extracted_data)
-embeddings = download_hugging_face_embeddings()
+    if VECTOR_STORE_BACKEND == "local":
+        # Open the existing local index, or start an empty one on the first run.
+        if os.path.exists(os.path.join(VECTOR_STORE_LOCAL_DIR, META_FILE)):
+            docsearch = LocalVectorStore.load(
+                embedding=embeddings,
+                path=VECTOR_STORE_LOCAL_DIR,
+                index_type=VECTOR_STORE_LOCAL_INDEX_TYPE,
+            )
+        else:
+            docsearch = LocalVectorStore(
+                embedding=embeddings,
+                path=VECTOR_STORE_LOCAL_DIR,
+                dimension=VECTOR_STORE_DIMENSION,
+                index_type=VECTOR_STORE_LOCAL_INDEX_TYPE,
+            )
+        persist = docsearch.save
 
+        # The manifest lives next to the vectors it describes.
+        manifest_path = os.path.join(VECTOR_STORE_LOCAL_DIR, "ingest_manifest.json")
 
-pc = Pinecone(api_key=PINECONE_API_KEY)
+    else:
+        from pinecone.grpc import PineconeGRPC as Pinecone
+        from pinecone import ServerlessSpec
+        from langchain_pinecone import PineconeVectorStore
 
-index_name = "medicalchatbot"
+        PINECONE_API_KEY=os.environ.get('PINECONE_API_KEY')
+        os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
 
+        pc = Pinecone(api_key=PINECONE_API_KEY)
 
-pc.create_index(
-    name=index_name,
-    dimension=384, 
-    metric="cosine", 
-    spec=ServerlessSpec(
-        cloud="aws", 
-        region="us-east-1"
-    ) 
-) 
+        # Only create the index on the first run.
+        if index_name not in pc.list_indexes().names():
+            pc.create_index(
+                name=index_name,
+                dimension=VECTOR_STORE_DIMENSION,
+                metric="cosine",
+                spec=ServerlessSpec(
+                    cloud="aws",
+                    region="us-east-1"
+                )
+            )
 
-# Embed each chunk and upsert the embeddings into your Pinecone index.
-docsearch = PineconeVectorStore.from_documents(
-    documents=text_chunks,
-    index_name=index_name,
-    embedding=embeddings, 
-)
+        docsearch = PineconeVectorStore.from_existing_index(
+            index_name=index_name,
+            embedding=embeddings,
+        )
 
+    # The BM25 side of hybrid retrieval indexes the same chunks.
+    lexical_index = BM25Index.open(RETRIEVAL_LEXICAL_INDEX_DIR) if RETRIEVAL_HYBRID_ENABLED else None
+
+    # Embed and upsert only new or changed chunks, and delete vectors of removed chunks.
+    summary = incremental_ingest(
+        data_dir=INGESTION_DATA_DIR,
+        vector_store=docsearch,
+        manifest_path=manifest_path,
+        persist=persist,
+        max_workers=INGESTION_PDF_WORKERS,
+        pages_per_task=INGESTION_PDF_PAGES_PER_TASK,
+        embedding_pipeline=embedding_pipeline,
+        lexical_index=lexical_index,
+        reset_untracked=INGESTION_RESET_UNTRACKED_INDEX,
+    )
+    print(summary)
@@ -0,0 +1,74 @@
+import asyncio
+import itertools
+import threading
+
+import pytest
+
+from src.inference_scheduler import InferenceScheduler, QueueFullError
+
+
+def wait_for(condition, timeout=5):
+    event = threading.Event()
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        event.wait(0.01)
+    return False
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = InferenceScheduler(lambda: "worker", num_workers=1, max_queue=1)
+    scheduler.wait_until_ready(timeout=5)
+    yield scheduler
+    scheduler.shutdown()
+
+
+def test_submit_rejects_when_the_queue_is_full(scheduler):
+    release = threading.Event()
+    running = scheduler.submit(lambda worker: release.wait(5))
+    assert wait_for(lambda: scheduler.busy_workers == 1)
+    queued = scheduler.submit(lambda worker: worker)
+
+    with pytest.raises(QueueFullError):
+        scheduler.submit(lambda worker: worker)
+
+    release.set()
+    assert running.result(timeout=5) is True
+    assert queued.result(timeout=5) == "worker"
+    assert scheduler.stats()["rejected"] == 1
+
+
+def counting(closed):
+    def generate(worker):
+        try:
+            yield from itertools.count()
+        finally:
+            closed.set()
+    return generate
+
+
+def test_closing_a_stream_stops_the_generator(scheduler):
+    closed = threading.Event()
+    items = scheduler.stream(counting(closed))
+
+    assert [next(items), next(items)] == [0, 1]
+    items.close()
+
+    assert closed.wait(5)
+    # The worker is free again
+    assert scheduler.submit(lambda worker: worker).result(timeout=5) == "worker"
+
+
+def test_closing_an_async_stream_stops_the_generator(scheduler):
+    closed = threading.Event()
+
+    async def read_two():
+        items = scheduler.astream(counting(closed))
+        received = [await items.__anext__(), await items.__anext__()]
+        await items.aclose()
+        return received
+
+    assert asyncio.run(read_two()) == [0, 1]
+    assert closed.wait(5)
+    assert scheduler.submit(lambda worker: worker).result(timeout=5) == "worker"
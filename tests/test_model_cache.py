@@ -0,0 +1,76 @@
+import hashlib
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from cloud_storage.model_cache import ModelCache
+
+
+BUCKET = "llma2-model"
+CONTENTS = {key: key.encode() * 20 for key in ("a.bin", "b.bin", "c.bin")}  # 100 bytes each
+
+
+def sha256(key):
+    return hashlib.sha256(CONTENTS[key]).hexdigest()
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        for key, body in CONTENTS.items():
+            client.put_object(Bucket=BUCKET, Key=key, Body=body)
+        yield client
+
+
+def cached_keys(cache):
+    return sorted(entry["s3_key"] for entry in cache.stats()["models"])
+
+
+def test_evict_removes_least_recently_used_but_never_pinned(s3_client, tmp_path):
+    cache = ModelCache(str(tmp_path), s3_client=s3_client)
+    cache.fetch(BUCKET, "a.bin")
+    cache.fetch(BUCKET, "b.bin")
+    cache.fetch(BUCKET, "c.bin")
+
+    cache.max_bytes = 100
+    evicted = cache.evict(pinned=(sha256("a.bin"),))
+
+    assert sorted(evicted) == sorted([sha256("b.bin"), sha256("c.bin")])
+    assert cached_keys(cache) == ["a.bin"]
+    assert not os.path.exists(tmp_path / "blobs" / sha256("b.bin"))
+
+
+def test_fetch_keeps_pinned_artifacts_when_making_room(s3_client, tmp_path):
+    cache = ModelCache(str(tmp_path), s3_client=s3_client, max_bytes=250)
+    cache.fetch(BUCKET, "a.bin")
+    cache.fetch(BUCKET, "b.bin")
+
+    # a.bin is the least recently used, but pinned (e.g. the active version), so b.bin makes room
+    cache.fetch(BUCKET, "c.bin", pinned=(sha256("a.bin"),))
+
+    assert cached_keys(cache) == ["a.bin", "c.bin"]
+
+
+def test_index_is_replaced_atomically_and_reloaded(s3_client, tmp_path):
+    cache = ModelCache(str(tmp_path), s3_client=s3_client)
+    path = cache.fetch(BUCKET, "a.bin")
+
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+    reloaded = ModelCache(str(tmp_path), s3_client=s3_client)
+    assert reloaded.cached_path(BUCKET, "a.bin") == path
+
+
+def test_shared_returns_one_instance_per_directory(s3_client, tmp_path):
+    offline = ModelCache.shared(str(tmp_path / "shared"))
+    online = ModelCache.shared(str(tmp_path / "shared"), s3_client=s3_client)
+
+    assert online is offline
+    assert online.s3_client is s3_client
+    assert ModelCache.shared(str(tmp_path / "other")) is not online
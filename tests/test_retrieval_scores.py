@@ -0,0 +1,44 @@
+from langchain_core.documents import Document
+
+from src.context_packer import ContextPacker
+from src.lexical_index import reciprocal_rank_fusion
+
+
+STRONG = Document(page_content="Aspirin lowers fever in adults.", metadata={"source": "a.pdf"})
+EXACT = Document(page_content="Ibuprofen 200 mg tablets.", metadata={"source": "b.pdf"})
+WEAK = Document(page_content="Cats sleep most of the day.", metadata={"source": "c.pdf"})
+
+
+def fuse():
+    dense = [(STRONG, 0.9), (WEAK, 0.1)]
+    lexical = [(EXACT, 7.0), (STRONG, 3.0)]
+    return reciprocal_rank_fusion([dense, lexical], k=3)
+
+
+def test_fusion_keeps_the_dense_similarity_as_score():
+    strong, exact, weak = fuse()
+
+    assert strong.page_content == STRONG.page_content
+    assert strong.metadata["score"] == 0.9
+    assert strong.metadata["dense_score"] == 0.9
+    assert strong.metadata["lexical_score"] == 3.0
+    # First and second place of two lists, relative to first place in both
+    assert strong.metadata["rrf_score"] == round((1 / 61 + 1 / 62) / (2 / 61), 6)
+    # Found by BM25 alone: no dense similarity to compare with CONTEXT_MIN_SCORE
+    assert "score" not in exact.metadata
+    assert weak.metadata["score"] == 0.1
+    assert strong.metadata["rrf_score"] > exact.metadata["rrf_score"] > weak.metadata["rrf_score"]
+
+
+def test_packer_filters_on_dense_score_and_orders_by_fused_score():
+    packed = ContextPacker(token_budget=200, min_score=0.5).pack(list(reversed(fuse())))
+
+    assert packed.dropped == 1
+    assert packed.context == f"{STRONG.page_content}\n\n{EXACT.page_content}"
+
+
+def test_packer_orders_dense_results_by_score():
+    docs = [Document(page_content="Second passage.", metadata={"score": 0.4}),
+            Document(page_content="First passage.", metadata={"score": 0.8})]
+
+    assert ContextPacker(token_budget=200).pack(docs).context == "First passage.\n\nSecond passage."
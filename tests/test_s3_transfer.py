@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from cloud_storage.s3_transfer import S3ParallelDownloader
+from medicalbot.exception import MedicalException
+
+
+BUCKET = "llma2-model"
+KEY = "model.bin"
+PART_SIZE = 1024
+CONTENT = bytes(range(256)) * 12  # 3072 bytes: three parts
+
+
+class RecordingClient:
+    """Passes calls through to the S3 client and records the byte ranges requested."""
+
+    def __init__(self, client):
+        self.client = client
+        self.ranges = []
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def get_object(self, **kwargs):
+        self.ranges.append(kwargs["Range"])
+        return self.client.get_object(**kwargs)
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        client.put_object(Bucket=BUCKET, Key=KEY, Body=CONTENT)
+        yield RecordingClient(client)
+
+
+def write_partial(destination, etag, completed, part_bytes):
+    """Leaves the .part file and its .part.json state of an interrupted download behind."""
+    with open(f"{destination}.part", "wb") as f:
+        f.write(part_bytes.ljust(len(CONTENT), b"\0"))
+    with open(f"{destination}.part.json", "w") as f:
+        json.dump({"etag": etag, "size": len(CONTENT), "part_size": PART_SIZE, "completed": completed}, f)
+
+
+def test_download_renames_the_finished_file_into_place(s3_client, tmp_path):
+    destination = str(tmp_path / "model.bin")
+
+    result = S3ParallelDownloader(s3_client, max_concurrency=2, part_size=PART_SIZE).download(BUCKET, KEY, destination)
+
+    assert result == destination
+    with open(destination, "rb") as f:
+        assert f.read() == CONTENT
+    assert sorted(os.listdir(tmp_path)) == ["model.bin"]
+    assert len(s3_client.ranges) == 3
+
+
+def test_download_resumes_from_the_recorded_parts(s3_client, tmp_path):
+    destination = str(tmp_path / "model.bin")
+    etag = s3_client.head_object(Bucket=BUCKET, Key=KEY)["ETag"]
+    write_partial(destination, etag, completed=[0], part_bytes=CONTENT[:PART_SIZE])
+
+    S3ParallelDownloader(s3_client, max_concurrency=2, part_size=PART_SIZE).download(BUCKET, KEY, destination)
+
+    assert sorted(s3_client.ranges) == ["bytes=1024-2047", "bytes=2048-3071"]
+    with open(destination, "rb") as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(f"{destination}.part.json")
+
+
+def test_download_starts_over_when_the_object_changed(s3_client, tmp_path):
+    destination = str(tmp_path / "model.bin")
+    write_partial(destination, '"0123456789abcdef0123456789abcdef"', completed=[0, 1], part_bytes=b"stale" * 400)
+
+    S3ParallelDownloader(s3_client, max_concurrency=2, part_size=PART_SIZE).download(BUCKET, KEY, destination)
+
+    assert len(s3_client.ranges) == 3
+    with open(destination, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_etag_mismatch_deletes_the_partial_download(s3_client, tmp_path):
+    destination = str(tmp_path / "model.bin")
+    with open(destination, "wb") as f:
+        f.write(b"previous model")
+    etag = s3_client.head_object(Bucket=BUCKET, Key=KEY)["ETag"]
+    # Part 0 is recorded as done but its bytes are corrupt, so the finished file does not match the ETag
+    write_partial(destination, etag, completed=[0], part_bytes=b"\xff" * PART_SIZE)
+
+    with pytest.raises(MedicalException, match="Checksum mismatch"):
+        S3ParallelDownloader(s3_client, max_concurrency=2, part_size=PART_SIZE).download(BUCKET, KEY, destination)
+
+    assert not os.path.exists(f"{destination}.part")
+    assert not os.path.exists(f"{destination}.part.json")
+    with open(destination, "rb") as f:
+        assert f.read() == b"previous model"
+
+
+def test_download_is_verified_against_the_manifest_sha256(s3_client, tmp_path):
+    destination = str(tmp_path / "model.bin")
+    downloader = S3ParallelDownloader(s3_client, max_concurrency=2, part_size=PART_SIZE)
+
+    downloader.download(BUCKET, KEY, destination, sha256=hashlib.sha256(CONTENT).hexdigest())
+    with open(destination, "rb") as f:
+        assert f.read() == CONTENT
+
+    with pytest.raises(MedicalException, match="Checksum mismatch"):
+        downloader.download(BUCKET, KEY, str(tmp_path / "other.bin"), sha256="0" * 64)
+    assert not os.path.exists(str(tmp_path / "other.bin"))